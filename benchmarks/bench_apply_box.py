@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: benchmark of nuclear cropping over a synthetic condition,
+              comparing np.ix_ copies with tools.image.apply_box views.
+'''
+
+# DEPENDENCIES =================================================================
+
+import time
+import tracemalloc
+
+import numpy as np
+from skimage.measure import label
+
+from pygpseq.tools import image as imt
+
+# FUNCTIONS ====================================================================
+
+def apply_box_ix(i, box, copy = False):
+    """Previous np.ix_-based cropping, always returning a copy. """
+    box = imt.check_box(i.shape, box)
+    return(i[np.ix_(*[tuple(range(t[0], t[1]+1)) for t in box])])
+
+def crop_condition(crop, fields):
+    """Crop every nucleus of a condition, as segmentation and analysis do:
+    image and mask at instantiation, then DNA/signal copies and mask when
+    retrieving nuclear data.
+
+    Args:
+      crop (fun): cropping function, with apply_box signature.
+      fields (list): (mask, dna, sig, boxes) per series.
+
+    Returns:
+      tuple: bytes allocated by cropping and number of crops.
+    """
+
+    allocated = 0
+    ncrops = 0
+    for (mask, dna, sig, boxes) in fields:
+        for box in boxes:
+            for (im, copy) in [(dna, False), (mask, False),
+                (dna, True), (sig, True), (mask, False)]:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                out = crop(im, list(box), copy = copy)
+                allocated += tracemalloc.get_traced_memory()[1] - before
+                ncrops += 1
+                del out
+    return((allocated, ncrops))
+
+def mk_condition(nseries, shape, nnuclei, radius, seed = 0):
+    """Generate a synthetic condition with spherical nuclei.
+
+    Args:
+      nseries (int): number of series.
+      shape (tuple[int]): field shape (Z, Y, X).
+      nnuclei (int): number of nuclei per series.
+      radius (int): nuclear radius in vx.
+      seed (int): random seed.
+
+    Returns:
+      list: (mask, dna, sig, boxes) per series.
+    """
+
+    rng = np.random.RandomState(seed)
+    zz, yy, xx = np.mgrid[:shape[0], :shape[1], :shape[2]]
+    fields = []
+    for s in range(nseries):
+        mask = np.zeros(shape, dtype = 'bool')
+        for n in range(nnuclei):
+            c = [rng.randint(radius, d - radius) for d in shape]
+            mask |= ((zz - c[0])**2 + (yy - c[1])**2 + (xx - c[2])**2
+                <= radius**2)
+        dna = rng.randint(100, 1000, shape).astype('u2')
+        sig = rng.randint(50, 500, shape).astype('u2')
+
+        L = label(mask)
+        boxes = []
+        for n in range(1, L.max() + 1):
+            idx = np.nonzero(L == n)
+            boxes.append([(int(c.min()), int(c.max())) for c in idx])
+        fields.append((mask, dna, sig, boxes))
+    return(fields)
+
+def run(nseries = 5, shape = (40, 512, 512), nnuclei = 30, radius = 12):
+    """Run the benchmark over a synthetic condition. """
+
+    fields = mk_condition(nseries, shape, nnuclei, radius)
+
+    print("%10s %8s %14s %10s" % ("method", "crops", "allocated [MB]",
+        "time [s]"))
+    tracemalloc.start()
+    for (name, crop) in [("np.ix_", apply_box_ix),
+        ("slices", imt.apply_box)]:
+        t = time.time()
+        allocated, ncrops = crop_condition(crop, fields)
+        print("%10s %8d %14.1f %10.4f" % (name, ncrops, allocated / 1024.**2,
+            time.time() - t))
+    tracemalloc.stop()
+
+    # Views and copies select the same voxels
+    mask, dna, sig, boxes = fields[0]
+    for box in boxes:
+        assert np.array_equal(apply_box_ix(dna, list(box)),
+            imt.apply_box(dna, list(box)))
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+    run()
+
+# END ==========================================================================
+
+################################################################################
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: micro-benchmark of single-pixel extraction in Nucleus.get_data,
+              comparing the list-based path with Nucleus.select_pixels.
+'''
+
+# DEPENDENCIES =================================================================
+
+import time
+
+import numpy as np
+
+from pygpseq import const
+from pygpseq.anim import Nucleus
+from pygpseq.tools import distance as dist
+from pygpseq.tools import vector as vt
+
+# FUNCTIONS ====================================================================
+
+def mk_nucleus(rz, ryx, seed = 0):
+    """Generate a synthetic ellipsoidal nucleus with a radial gradient.
+
+    Args:
+      rz (int): Z semi-axis in vx.
+      ryx (int): Y/X semi-axes in vx.
+      seed (int): random seed.
+
+    Returns:
+      tuple: mask, DNA, signal, lamina/center/normalized distances and
+             partial volume mask.
+    """
+
+    rng = np.random.RandomState(seed)
+    zz, yy, xx = np.mgrid[-rz-1:rz+2, -ryx-1:ryx+2, -ryx-1:ryx+2]
+    d = (zz / float(rz))**2 + (yy / float(ryx))**2 + (xx / float(ryx))**2
+    mask = d <= 1
+    dna = (rng.normal(100, 5, mask.shape) + 1000 * (1 - d) * mask)
+    sig = (rng.normal(50, 5, mask.shape) + 500 * d * mask)
+    dna = np.clip(dna, 0, None).astype('u2')
+    sig = np.clip(sig, 0, None).astype('u2')
+    laminD, centrD = dist.calc_nuclear_distances(const.LD_CENTER_PERC,
+        mask, (1., 1., 1.))
+    laminD_norm = dist.normalize_nuclear_distance(const.LD_CENTER_PERC,
+        laminD, centrD)
+    part = (d <= .5).astype('u4')
+    return((mask, dna, sig, laminD, centrD, laminD_norm, part))
+
+def select_pixels_lists(n, dna_bg, sig_bg, mask, dna, sig,
+    laminD, centrD, laminD_norm, sm):
+    """Previous list-based extraction path of Nucleus.get_data. """
+
+    mask_flat = mask.reshape([np.prod(mask.shape)])
+    mask_flat = mask_flat.tolist()
+    mask_flat = [i for i in range(len(mask_flat)) if 1 == mask_flat[i]]
+
+    data = np.zeros(len(mask_flat), dtype = const.DTYPE_NUCLEAR_DATA)
+    data['dna'] = vt.flatten_and_select(dna, mask_flat)
+    data['sig'] = vt.flatten_and_select(sig, mask_flat)
+    data['lamin_d'] = vt.flatten_and_select(laminD, mask_flat)
+    data['centr_d'] = vt.flatten_and_select(centrD, mask_flat)
+    data['part'] = vt.flatten_and_select(sm, mask_flat)
+    data['n'] = [n for i in data['dna']]
+
+    data['dna'] = np.array(data['dna'])
+    data['dna'][data['dna'] < dna_bg] = dna_bg
+    data['dna'] = np.array(data['dna']) - dna_bg
+    data['sig'] = np.array(data['sig'])
+    data['sig'][data['sig'] < sig_bg] = sig_bg
+    data['sig'] = np.array(data['sig']) - sig_bg
+
+    data['lamin_dnorm'] = vt.flatten_and_select(laminD_norm, mask_flat)
+    return(data)
+
+def timeit(f, nrep, *args):
+    """Return the best wall time over nrep calls and the last output. """
+    best = float('inf')
+    for i in range(nrep):
+        t = time.time()
+        out = f(*args)
+        best = min(best, time.time() - t)
+    return((best, out))
+
+def run(sizes = ((5, 20), (10, 35), (20, 50)), nrep = 3):
+    """Run the benchmark over nuclei of increasing size. """
+
+    print("%10s %12s %12s %9s" % ("voxels", "lists [s]", "masked [s]", "speedup"))
+    for (rz, ryx) in sizes:
+        fields = mk_nucleus(rz, ryx)
+        nucleus = Nucleus(logpath = '/dev/null', n = 1, series_id = 1,
+            mask = fields[0], i = fields[1], thr = 0, offset = (0, 0, 0),
+            aspect = (1., 1., 1.), dna_bg = 100.5, sig_bg = 50.,
+            box = [(0, d - 1) for d in fields[0].shape])
+        nucleus.verbose = False
+
+        t_old, old = timeit(select_pixels_lists, nrep, nucleus.n,
+            nucleus.dna_bg, nucleus.sig_bg, *fields)
+        t_new, new = timeit(nucleus.select_pixels, nrep, *fields)
+
+        for name in new.dtype.names:
+            assert np.array_equal(old[name], new[name]), name
+
+        print("%10d %12.4f %12.4f %8.1fx" % (new.shape[0], t_old, t_new,
+            t_old / t_new))
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+    run()
+
+# END ==========================================================================
+
+################################################################################
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: benchmark suite of the anim pipeline. Times every stage of
+              Main.run over synthetic datasets of increasing scale, and stores
+              the results per commit, for comparison.
+'''
+
+# DEPENDENCIES =================================================================
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+
+import pygpseq as gp
+
+import synthetic
+
+# CONSTANTS ====================================================================
+
+# Benchmark scales: name and synthetic series settings
+SCALES = (
+    ('small', {'shape' : (20, 256, 256), 'nnuclei' : 8}),
+    ('medium', {'shape' : (30, 512, 512), 'nnuclei' : 30}),
+    ('large', {'shape' : (40, 1024, 1024), 'nnuclei' : 100}),
+)
+
+# Results folder
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'results')
+
+# FUNCTIONS ====================================================================
+
+def compare(results, reference):
+    """Print the per-stage wall time ratio between two benchmark results.
+
+    Args:
+      results (dict): current results, see run_scale.
+      reference (dict): reference results, see run_scale.
+    """
+
+    print("\nComparison with %s (%s)" % (reference['commit'],
+        reference['date']))
+    print("%-8s %-50s %10s %10s %7s" % ("scale", "stage", "ref. [s]",
+        "curr. [s]", "ratio"))
+    for (scale, res) in results['scales'].items():
+        if not scale in reference['scales'].keys():
+            continue
+        ref = reference['scales'][scale]
+        if res['params'] != ref['params']:
+            print("%-8s %s" % (scale, "different settings, skipped."))
+            continue
+        for (name, s) in res['spans'].items():
+            if not name in ref['spans'].keys():
+                continue
+            r = ref['spans'][name]['wall']
+            print("%-8s %-50s %10.3f %10.3f %6.2fx" % (scale, name, r,
+                s['wall'], s['wall'] / r if 0 != r else float('nan')))
+
+def get_commit():
+    """Return the current commit hash, with a "+" if the tree is dirty.
+    "unknown" if not in a git repository. """
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short',
+            'HEAD'], cwd = cwd, stderr = subprocess.DEVNULL).decode().strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain',
+            '--untracked-files=no'], cwd = cwd,
+            stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return('unknown')
+    if 0 != len(status):
+        commit += '+'
+    return(commit)
+
+def run_pipeline(basedir, outdir, ncores = 1, plotting = False):
+    """Run Main over a dataset, with the default gpseq_anim settings and
+    no mask cache, skipping the final report.
+
+    Returns:
+      dict: timing report, see pygpseq.tools.trace.Tracer.report.
+    """
+
+    gpi = gp.anim.Main(ncores = ncores)
+    gpi.basedir = basedir
+    gpi.outdir = outdir
+    gpi.logpath = os.path.join(outdir, 'log')
+    gpi.dna_names = ('dapi',)
+    gpi.sig_names = ('cy5',)
+    gpi.seg_type = gp.const.SEG_DEFAULT
+    gpi.an_type = gp.const.AN_DEFAULT
+    gpi.nsf = (gp.const.NSEL_FLAT_SIZE, gp.const.NSEL_SUMI)
+    gpi.mask_cache = None
+    gpi.plotting = plotting
+    gpi.skip = [5]
+    gpi.verbose = False
+    gpi.timing = True
+    gpi.run()
+
+    with open(os.path.join(outdir, 'timing.json'), 'r') as f:
+        return(json.load(f))
+
+def run_scale(scale, params, nrep = 1, ncores = 1, plotting = False,
+    nconditions = 2, nseries = 2):
+    """Time every stage of the pipeline over a synthetic dataset.
+
+    Args:
+      scale (string): scale name.
+      params (dict): synthetic series settings, see synthetic.mk_series.
+      nrep (int): number of repetitions. The best wall time of each stage
+                  is kept.
+      ncores (int): number of cores.
+      plotting (bool): True to generate plots.
+      nconditions (int): number of conditions.
+      nseries (int): number of series per condition.
+
+    Returns:
+      dict: settings, total wall time and per-stage statistics.
+    """
+
+    workdir = tempfile.mkdtemp(prefix = 'pygpseq.bench.')
+    try:
+        basedir = os.path.join(workdir, 'data')
+        synthetic.mk_dataset(basedir, nconditions, nseries, **params)
+
+        wall = float('inf')
+        spans = {}
+        for i in range(nrep):
+            outdir = os.path.join(workdir, 'out%d' % i)
+            report = run_pipeline(basedir, outdir, ncores, plotting)
+            wall = min(wall, report['wall'])
+            for s in report['spans']:
+                if not s['name'] in spans.keys() or (
+                    s['wall'] < spans[s['name']]['wall']):
+                    spans[s['name']] = dict([(k, s[k]) for k in
+                        ['calls', 'wall', 'cpu', 'rss']])
+    finally:
+        shutil.rmtree(workdir, ignore_errors = True)
+
+    print("%-8s %-50s %6s %10s %10s %10s" % ("scale", "stage", "calls",
+        "wall [s]", "cpu [s]", "rss [MiB]"))
+    for (name, s) in spans.items():
+        print("%-8s %-50s %6d %10.3f %10.3f %10.1f" % (scale, name,
+            s['calls'], s['wall'], s['cpu'], s['rss']))
+
+    params = dict(params)
+    params.update({'nconditions' : nconditions, 'nseries' : nseries,
+        'nrep' : nrep, 'ncores' : ncores, 'plotting' : plotting})
+    return({'params' : json.loads(json.dumps(params)), 'wall' : wall,
+        'spans' : spans})
+
+def run(scales = None, nrep = 1, ncores = 1, plotting = False,
+    results_dir = None, reference = None):
+    """Run the benchmark suite and store the results.
+
+    Args:
+      scales (list[string]): scale names, see SCALES (opt, def: all).
+      nrep (int): number of repetitions per scale.
+      ncores (int): number of cores.
+      plotting (bool): True to generate plots.
+      results_dir (string): results folder (opt, def: RESULTS_DIR).
+      reference (string): path to reference results, to compare with (opt).
+
+    Returns:
+      string: path to the stored results.
+    """
+
+    if type(None) == type(scales):
+        scales = [s[0] for s in SCALES]
+    if type(None) == type(results_dir):
+        results_dir = RESULTS_DIR
+
+    results = {'commit' : get_commit(),
+        'date' : datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'version' : gp.const.VERSION, 'python' : platform.python_version(),
+        'numpy' : np.__version__, 'machine' : platform.machine(),
+        'cpu_count' : os.cpu_count(), 'scales' : {}}
+    for (scale, params) in SCALES:
+        if scale in scales:
+            results['scales'][scale] = run_scale(scale, params, nrep,
+                ncores, plotting)
+
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    fpath = os.path.join(results_dir, '%s.json' % results['commit'])
+    with open(fpath, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print("\nResults stored in '%s'." % fpath)
+
+    if not type(None) == type(reference):
+        with open(reference, 'r') as f:
+            compare(results, json.load(f))
+
+    return(fpath)
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = """
+Time every stage of the anim pipeline over synthetic datasets, and store the
+results in '<results>/<commit>.json' for comparison across commits.
+""", formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type = str, nargs = '+',
+        choices = [s[0] for s in SCALES], default = None,
+        help = """Scales to run. Default: all""")
+    parser.add_argument('-r', '--nrep', type = int, default = 1,
+        help = """Repetitions per scale, keeping the best. Default: 1""")
+    parser.add_argument('-t', '--threads', type = int, default = 1,
+        help = """Number of threads. Default: 1""")
+    parser.add_argument('--plot', action = 'store_const',
+        const = True, default = False,
+        help = """Generate plots.""")
+    parser.add_argument('--results', type = str, default = RESULTS_DIR,
+        help = """Results folder. Default: '%s'""" % RESULTS_DIR)
+    parser.add_argument('--compare', type = str, default = None,
+        metavar = 'results', help = """Path to reference results.""")
+    args = parser.parse_args()
+
+    run(args.scales, args.nrep, args.threads, args.plot, args.results,
+        args.compare)
+
+# END ==========================================================================
+
+################################################################################
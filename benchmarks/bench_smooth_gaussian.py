@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: micro-benchmark of stat.smooth_gaussian, comparing the
+              point-by-point loop with the vectorized implementation.
+'''
+
+# DEPENDENCIES =================================================================
+
+import time
+
+import numpy as np
+
+from pygpseq.tools import stat as stt
+
+# FUNCTIONS ====================================================================
+
+def smooth_gaussian_loop(x, y, sigma_smooth, nbins):
+    """Previous point-by-point implementation of stat.smooth_gaussian. """
+
+    xs = np.linspace(0, max(x), nbins)
+    ynum = np.zeros(len(xs))
+    ysum = np.zeros(len(xs))
+    for i in [i for i in range(len(x)) if not np.isnan(y[i])]:
+        norm = stt.get_norm_pdf(x[i], sigma_smooth, xs)
+        ynum += norm
+        ysum += norm * y[i]
+    return(ysum / ynum)
+
+def mk_profile(nbins, seed = 0):
+    """Generate a binned profile as produced by stat.binned_profile.
+
+    Args:
+      nbins (int): number of bins.
+      seed (int): random seed.
+
+    Returns:
+      tuple: bin breaks (float32, as stored in binned profiles) and values,
+             with a few empty (NaN) bins.
+    """
+
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 1, nbins).astype('f')
+    y = np.sin(x * 3) + rng.normal(0, .1, nbins)
+    y[rng.rand(nbins) < .05] = np.nan
+    y[0] = np.nan
+    return((x, y.astype('f')))
+
+def timeit(f, nrep, *args):
+    """Return the best wall time over nrep calls and the last output. """
+    best = float('inf')
+    for i in range(nrep):
+        t = time.time()
+        out = f(*args)
+        best = min(best, time.time() - t)
+    return((best, out))
+
+def run(nbins_list = None, nrep = 3):
+    """Run the benchmark and print a summary table.
+
+    Args:
+      nbins_list (list): profile precisions to benchmark.
+      nrep (int): number of repetitions per timing.
+    """
+
+    if None == nbins_list:
+        nbins_list = [200, 1000, 5000]
+
+    print("%8s %12s %12s %9s %12s" % (
+        "nbins", "loop [s]", "vect. [s]", "speedup", "max err"))
+    for nbins in nbins_list:
+        x, y = mk_profile(nbins)
+        sigma = .01 * np.max(x)
+        t_loop, y_loop = timeit(smooth_gaussian_loop, nrep, x, y, sigma, nbins)
+        t_vect, y_vect = timeit(stt.smooth_gaussian, nrep, x, y, sigma, nbins)
+        err = np.nanmax(np.abs(y_loop - y_vect)) / np.nanmax(np.abs(y_loop))
+        print("%8d %12.4f %12.4f %8.1fx %12.2e" % (
+            nbins, t_loop, t_vect, t_loop / t_vect, err))
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+    run()
+
+# END ==========================================================================
+
+################################################################################
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: synthetic GPSeq dataset generator. Writes condition folders of
+              DNA and signal stacks, named as expected by Condition.reg, with
+              ellipsoidal nuclei and radial intensity gradients.
+'''
+
+# DEPENDENCIES =================================================================
+
+import argparse
+import os
+
+import numpy as np
+
+from pygpseq.tools import path as pt
+from pygpseq.tools import plot
+
+# FUNCTIONS ====================================================================
+
+def mk_dataset(path, nconditions = 2, nseries = 2, seed = 0,
+    dna_name = 'dapi', sig_name = 'cy5', **kwargs):
+    """Write a synthetic dataset, one folder per condition.
+    Images are named "<channel>.channel00<c>.series00<s>.tif", as expected
+    by the default Condition.reg, with the DNA channel first.
+
+    Args:
+      path (string): dataset folder path.
+      nconditions (int): number of conditions.
+      nseries (int): number of series per condition.
+      seed (int): random seed.
+      dna_name (string): DNA channel name.
+      sig_name (string): signal channel name.
+      **kwargs: series settings, see mk_series.
+
+    Returns:
+      list: condition folder paths.
+    """
+
+    rng = np.random.RandomState(seed)
+    path = pt.add_trailing_slash(path)
+
+    conds = []
+    for ci in range(nconditions):
+        cpath = '%scondition%03d/' % (path, ci + 1)
+        if not os.path.isdir(cpath):
+            os.makedirs(cpath)
+        for si in range(nseries):
+            dna, sig = mk_series(rng = rng, **kwargs)[:2]
+            for (chi, name, im) in [(1, dna_name, dna), (2, sig_name, sig)]:
+                plot.save_tif('%s%s.channel%03d.series%03d.tif' % (
+                    cpath, name, chi, si + 1), im, 'uint16', False,
+                    bundled_axes = 'ZYX')
+        conds.append(cpath)
+    return(conds)
+
+def mk_nucleus(rz, ry, rx, theta):
+    """Generate the normalized radius of an ellipsoidal nucleus, rotated
+    on the XY plane.
+
+    Args:
+      rz, ry, rx (float): semi-axes in vx.
+      theta (float): rotation on the XY plane, in radians.
+
+    Returns:
+      np.ndarray: normalized radius (<= 1 inside the nucleus), over the
+                  nucleus bounding box.
+    """
+
+    rxy = int(np.ceil(max(ry, rx)))
+    zz, yy, xx = np.mgrid[-int(np.ceil(rz)):int(np.ceil(rz)) + 1,
+        -rxy:rxy + 1, -rxy:rxy + 1].astype('float')
+    yr = yy * np.cos(theta) - xx * np.sin(theta)
+    xr = yy * np.sin(theta) + xx * np.cos(theta)
+    return(np.sqrt((zz / rz)**2 + (yr / ry)**2 + (xr / rx)**2))
+
+def mk_series(shape = None, nnuclei = 10, rz = None, ryx = None,
+    noise = .05, dna_bg = 100., sig_bg = 50., dna_max = 1000.,
+    sig_max = 500., rng = None):
+    """Generate DNA and signal stacks of a synthetic series.
+    Nuclei are placed at random, without overlapping, with random semi-axes
+    and XY orientation. DNA intensity decreases from the nuclear center to
+    the lamina, while signal intensity increases, as in GPSeq.
+
+    Args:
+      shape (tuple[int]): stack shape (Z, Y, X) (opt, def: (30, 256, 256)).
+      nnuclei (int): number of nuclei. Less nuclei are placed if the field
+                     is too crowded.
+      rz (tuple[float]): Z semi-axis interval in vx (opt, def: (6, 8)).
+      ryx (tuple[float]): Y/X semi-axes interval in vx (opt, def: (15, 19)).
+      noise (float): gaussian noise sigma, as fraction of the maximum
+                     intensity.
+      dna_bg, sig_bg (float): background intensities.
+      dna_max, sig_max (float): maximum nuclear intensities, above background.
+      rng (np.random.RandomState): random generator (opt).
+
+    Returns:
+      tuple: DNA (uint16), signal (uint16) and labels of the placed nuclei.
+    """
+
+    if type(None) == type(shape):
+        shape = (30, 256, 256)
+    if type(None) == type(rz):
+        rz = (6., 8.)
+    if type(None) == type(ryx):
+        ryx = (15., 19.)
+    if type(None) == type(rng):
+        rng = np.random.RandomState()
+
+    L = np.zeros(shape, dtype = 'u2')
+    dna = np.zeros(shape, dtype = 'float')
+    sig = np.zeros(shape, dtype = 'float')
+
+    n = 0
+    for attempt in range(nnuclei * 20):
+        if n == nnuclei:
+            break
+
+        d = mk_nucleus(rng.uniform(*rz), rng.uniform(*ryx),
+            rng.uniform(*ryx), rng.uniform(0, np.pi))
+        if any([d.shape[i] >= shape[i] for i in range(3)]):
+            continue
+
+        # Random position, avoiding other nuclei
+        c = [rng.randint(0, shape[i] - d.shape[i] + 1) for i in range(3)]
+        box = tuple([slice(c[i], c[i] + d.shape[i]) for i in range(3)])
+        inside = d <= 1
+        if (L[box][inside] != 0).any():
+            continue
+
+        n += 1
+        L[box][inside] = n
+        dna[box][inside] = dna_max * (1 - .5 * d[inside])
+        sig[box][inside] = sig_max * d[inside]
+
+    dna += dna_bg + rng.normal(0, noise * dna_max, shape)
+    sig += sig_bg + rng.normal(0, noise * sig_max, shape)
+    dna = np.clip(np.round(dna), 0, 2**16 - 1).astype('u2')
+    sig = np.clip(np.round(sig), 0, 2**16 - 1).astype('u2')
+
+    return((dna, sig, L))
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = """
+Write a synthetic GPSeq dataset, one folder per condition.
+""", formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('outDir', type = str,
+        help = """Path to output directory.""")
+    parser.add_argument('-c', '--conditions', type = int, default = 2,
+        help = """Number of conditions. Default: 2""")
+    parser.add_argument('-s', '--series', type = int, default = 2,
+        help = """Number of series per condition. Default: 2""")
+    parser.add_argument('-S', '--shape', type = int, nargs = 3,
+        default = [30, 256, 256], metavar = ('Z', 'Y', 'X'),
+        help = """Stack shape. Default: 30 256 256""")
+    parser.add_argument('-n', '--nuclei', type = int, default = 10,
+        help = """Number of nuclei per series. Default: 10""")
+    parser.add_argument('--noise', type = float, default = .05,
+        help = """Noise sigma, as fraction of maximum intensity.
+        Default: .05""")
+    parser.add_argument('--seed', type = int, default = 0,
+        help = """Random seed. Default: 0""")
+    args = parser.parse_args()
+
+    mk_dataset(args.outDir, args.conditions, args.series, args.seed,
+        shape = tuple(args.shape), nnuclei = args.nuclei, noise = args.noise)
+
+# END ==========================================================================
+
+################################################################################
@@ -47,6 +47,19 @@ class Analyzer(iot.IOinterface):
       rescale_deconvolved (bool): True to rescale deconvolved images.
       correctCA (bool): True to correct for chromatic aberrations (TODO).
       normalize_distance (bool): True to use relative distance from lamina.
+      crop_folder (string): folder to spill nuclear crops to. If None, crops
+                            are kept in memory.
+      mask_cache (string): segmentation mask cache folder. If None, masks
+                           are not cached.
+      mask_cache_size (float): maximum mask cache size, in GiB.
+      channel_cache_size (float): memory budget of the decoded channel cache
+                                  of every process, in GiB. If 0, channels
+                                  are not cached in memory.
+      channel_cache_folder (string): folder to spill decoded channels to,
+                                     for memory-mapped reuse. If None,
+                                     channels are kept in memory only.
+      buffer_folder (string): folder for the on-disk single-pixel tables
+                              of the analysis. If None, the output folder.
       cdescr (dict): dictionary with better condition descriptions. The keys
                      are the condition subfolder names, the values the
                      descriptions.
@@ -64,6 +77,12 @@ class Analyzer(iot.IOinterface):
     mask_folder = None
     mask2d_folder = None
     mask_prefix = "mask_"
+    crop_folder = None
+    mask_cache = None
+    mask_cache_size = 4.
+    channel_cache_size = 0.
+    channel_cache_folder = None
+    buffer_folder = None
     labeled = False
     compressed = False
     an_type = const.AN_SUM_PROJ
@@ -152,6 +171,16 @@ class Analyzer(iot.IOinterface):
             assert 0 != len(value), assert_msg
             assert all([type(0) == type(s) for s in value]), assert_msg
 
+        elif 'mask_cache_size' == name:
+            assert_msg = '"%s" must be a positive float.' % name
+            assert type(.0) == type(value), assert_msg
+            assert 0 < value, assert_msg
+
+        elif 'channel_cache_size' == name:
+            assert_msg = '"%s" must be a non-negative float.' % name
+            assert type(.0) == type(value), assert_msg
+            assert 0 <= value, assert_msg
+
         elif name in ["sigma_smooth", "sigma_density"]:
             assert_msg = '"%s" must be a positive float.'
             assert type(.0) == type(value), assert_msg
@@ -11,17 +11,21 @@
 from joblib import Parallel, delayed
 import multiprocessing
 import os
+import tempfile
 import time
 
-from matplotlib.backends.backend_pdf import PdfPages
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
 from pygpseq import const
-from pygpseq.tools import path as pt, io as iot, plot, stat as stt, string as st
+from pygpseq.tools import path as pt, io as iot, parallel as pa, plot
+from pygpseq.tools import render
+from pygpseq.tools import stat as stt, string as st
+from pygpseq.tools.accumulator import ProfileAccumulator
+from pygpseq.tools.store import PixelStore
+from pygpseq.tools.trace import traced
 
-from pygpseq.anim.series import Series
+from pygpseq.anim.series import Series, from_descriptor
 
 # CLASSES ======================================================================
 
@@ -145,12 +149,6 @@ class Condition(iot.IOinterface):
         else:
             ncores = kwargs['ncores']
 
-        # Set output suffix
-        if not 'suffix' in kwargs.keys():
-            suffix = ''
-        else:
-            suffix = st.add_leading_dot(kwargs['suffix'])
-
         # Check plotting
         if not 'plotting' in kwargs.keys():
             kwargs['plotting'] = True
@@ -172,189 +170,38 @@ class Condition(iot.IOinterface):
 
         # GET NUCLEAR DATA =====================================================
 
-        # Retrieve nuclei
-        nuclei = self.get_nuclei()
-
-        # Check that the condition contains nuclei
-        if 0 == len(nuclei):
+        # Retrieve and filter nuclear summaries
+        summary = self.get_selected_summary(**kwargs)
+        if type(None) == type(summary):
             return((None, None, None, None))
 
-        # Retrieve nuclei summaries
-        self.printout('Retrieving nuclear summary...', 1)
-        summary = np.zeros(len(nuclei),
-            dtype = const.DTYPE_NUCLEAR_SUMMARY)
-        for i in range(len(nuclei)):
-            summary[i] = nuclei[i].get_summary()
-
-        # Filter nuclei
-        msg = 'Filtering nuclei based on size, intensity and shape...'
-        self.printout(msg, 1)
-        selected = self.multi_threshold_nuclei(data = summary, **kwargs)
-
-        # Check that nuclei are selected
-        if 0 == len(selected):
-            return((None, None, None, None))
-        
-        # Apply selection
-        summary = np.asarray([summary[i] for i in selected],
-            dtype = const.DTYPE_NUCLEAR_SUMMARY)
-        
-        # Retrieve selected nuclei single-pixel data
-        data_nested = Parallel(n_jobs = ncores)(
-            delayed(get_series_nuclear_data)(self, summary, sidx, **kwargs)
-            for sidx in list(set(summary['s'])))
-
-        # Un-nest nuclear data
-        data = []
-        [data.extend(nested['spx_data']) for nested in data_nested]
-
-        # Assemble into a single array
-        self.printout('Merging into a single table...', 1)
-        merged = np.zeros(sum([d.shape[0] for d in data]),
-            dtype = const.DTYPE_NUCLEAR_DATA)
-        currpos = 0
-        for d in data:
-            merged[currpos:(currpos + d.shape[0])] = d
-            currpos = currpos + d.shape[0]
-
-        # Remove rows with no DNA signal
-        self.printout('Removing pixels without DNA signal...', 1)
-        self.printout('Identifying pixels...', 2)
-        toKeep = np.where(merged['dna'] != 0)[0]
-        nToRemove = len(merged) - len(toKeep)
-        if not 0 == nToRemove:
-            merged = merged[toKeep]
-            msg = 'Removed %i pixels without DNA signal...' % nToRemove
-            self.printout(msg, 2)
-
-        # Density profile ------------------------------------------------------
-
-        dp = np.vstack([nested['density'] for nested in data_nested])
-        dp = pd.DataFrame(dp)
-        col_labs = ["c", "s", "n"]
-        col_labs.extend(["nd_%f" % b
-            for b in np.linspace(0, 1, kwargs['nbins'] + 1)[1:]])
-        dp.columns = col_labs
-
-        # Volume profile -------------------------------------------------------
-
-        vp = np.vstack([nested['volume'] for nested in data_nested])
-        vp = pd.DataFrame(vp)
-        col_labs = ["c", "s", "n"]
-        col_labs.extend(["nd_%f" % b
-            for b in np.linspace(0, 1, kwargs['nbins'] + 1)[1:]])
-        vp.columns = col_labs
-
-        # PLOT =================================================================
-
-        # EVERY PIXEL ----------------------------------------------------------
-
-        # Produce profile plot
-        self.printout('Generating profiles...', 1)
-        profiles = self.make_profiles(merged, len(data), **kwargs)
-
-        # Export single profile study
-        self.printout('Studying single-pixel behaviour...', 1)
-        self.check_single_pixels(merged, profiles, **kwargs)
-
-        # Export single-condition plot
-        self.printout('Exporting profiles...', 1)
-
-        # Mean/median/mode profile plot
-        fig = plot.single_condition_profiles(profiles, n_nuclei = len(data),
-            **kwargs)
-        plot.single_condition_profiles(profiles, n_nuclei = len(data),
-            yfield = 'median', new_figure = False, **kwargs)
-        plot.single_condition_profiles(profiles, n_nuclei = len(data),
-            yfield = 'mode', new_figure = False, **kwargs)
-        plot.single_condition_profiles(profiles, n_nuclei = len(data),
-            yfield = 'max', new_figure = False, **kwargs)
-
-        # Add legend
-        plt.subplot(3, 2, 1)
-        plot.set_font_size(12)
-        plt.legend(labels = ['mean', 'median', 'mode', 'max'],
-            bbox_to_anchor = (0., 1.12, 1., .102), loc = 3,
-            ncol = 2, mode = "expand", borderaxespad = 0.)
-
-        # Export PDF
-        fname = kwargs['out_dir'] + const.OUTDIR_PDF + self.name
-        fname += '.profiles' + suffix + '.pdf'
-        if kwargs['plotting']: plot.export(fname, 'pdf')
-
-        # Export PNG
-        fname = kwargs['out_dir'] + const.OUTDIR_PNG + self.name
-        fname += '.profiles' + suffix + '.png'
-        if kwargs['plotting']: plot.export(fname, 'png')
-
-        # Close figure
-        plt.close(fig)
-
-        # PARTIAL VOLUME -------------------------------------------------------
-        if const.AN_3D == kwargs['an_type']:
-            part = merged[np.where(merged['part'] == 1)]
-            
-            # Produce partial nucleus profile plots
-            msg = 'Generating partial profiles ['
-            msg += str(kwargs['part_n_erosion']) + ']...'
-            self.printout(msg, 1)
-
-            # Store partial profile in the output
-            profiles['part'] = self.make_profiles(part, len(data), **kwargs)
-
-            # Export single profile study for partial volume
-            msg = 'Studying single-pixel behaviour'
-            msg += ' on partial volume [' + str(kwargs['part_n_erosion']) + ']'
-            msg += '...'
-            self.printout(msg, 1)
-            supcomm = ' [partial volume ' + str(kwargs['part_n_erosion']) + ']'
-            self.check_single_pixels(part, profiles['part'], partial = True,
-                supcomm = supcomm, **kwargs)
-
-            # Export partial nucleus single-condition plot
-            title = 'partial_volume ' + str(kwargs['part_n_erosion'])
-            fig = plot.single_condition_profiles(profiles['part'],
-                n_nuclei = len(data), title_comment = title, **kwargs)
-            plot.single_condition_profiles(profiles['part'],
-                n_nuclei = len(data), yfield = 'median', title_comment = title,
-                new_figure = False, **kwargs)
-            plot.single_condition_profiles(profiles['part'],
-                n_nuclei = len(data), yfield = 'mode', title_comment = title,
-                new_figure = False, **kwargs)
-            plot.single_condition_profiles(profiles['part'],
-                n_nuclei = len(data), yfield = 'max', title_comment = title,
-                new_figure = False, **kwargs)
-
-            # Add legend
-            plt.subplot(3, 2, 1)
-            plot.set_font_size(12)
-            plt.legend(labels = ['mean', 'median', 'mode', 'max'],
-                bbox_to_anchor = (0., 1.12, 1., .102), loc = 3,
-                ncol = 2, mode = "expand", borderaxespad = 0.)
-
-            # Export PDF
-            fname = kwargs['out_dir'] + const.OUTDIR_PDF + self.name
-            fname += '.profiles.part' + suffix + '.pdf'
-            if kwargs['plotting']: plot.export(fname, 'pdf')
-
-            # Export PNG
-            fname = kwargs['out_dir'] + const.OUTDIR_PNG + self.name
-            fname += '.profiles.part' + suffix + '.png'
-            if kwargs['plotting']: plot.export(fname, 'png')
-
-            # Close figure
-            plt.close(fig)
-
-        # Output
-        self.printout('', 0)
-        return((profiles, summary, merged, dp, vp))
+        # Retrieve selected nuclei single-pixel data, removing the condition
+        # buffer if anything fails
+        tasks, spx_path = self.get_analysis_tasks(summary, **kwargs)
+        try:
+            data_nested = Parallel(n_jobs = ncores)(
+                delayed(f)(*args, **fkwargs) for (f, args, fkwargs) in tasks)
+
+            # Accumulate profiles on the condition bins, if needed
+            accs = Parallel(n_jobs = ncores)(delayed(f)(*args, **fkwargs)
+                for (f, args, fkwargs) in self.get_accumulation_tasks(
+                    data_nested, **kwargs))
+            for i in range(len(accs)):
+                data_nested[i]['accs'] = accs[i]
+
+            # Merge, build profiles and plot
+            return(self.merge_nuclear_data(summary, data_nested, **kwargs))
+        except:
+            PixelStore(spx_path, []).remove()
+            raise
 
     def check_single_pixels(self, indata, profiles, partial = None,
         supcomm = None, **kwargs):
         """Produce single pixel behaviour study plot.
 
         Args:
-          indata (np.array): single-pixel table, const.DTYPE_NUCLEAR_DATA.
+          indata (np.array, PixelStore): single-pixel table,
+                                         const.DTYPE_NUCLEAR_DATA.
           profiles (dict): smoothened and raw profiles (I ~ d).
           partial (bool): True if working on partial volume.
           supcomm (string): a comment to be add to the plot main title.
@@ -377,26 +224,22 @@ class Condition(iot.IOinterface):
         if not 'plotting' in kwargs.keys():
             kwargs['plotting'] = True
 
-        # Output file pointers
+        # Skip rendering if not plotting
+        if not kwargs['plotting']:
+            return
+
+        # Output paths
         fname = kwargs['out_dir'] + const.OUTDIR_PDF
         out_png = kwargs['out_dir'] + const.OUTDIR_PNG
         out_png += self.name + '.pixel_study.'
         if partial:
             fname += self.name + '.pixel_study.part' + suffix + '.pdf'
+            out_png = [out_png + lab + '.part' + suffix + '.png'
+                for lab in ['dna', 'sig', 'ratio']]
         else:
             fname += self.name + '.pixel_study' + suffix + '.pdf'
-        if kwargs['plotting']: pp = PdfPages(fname)
-
-        # PREPARE DATA =========================================================
-        
-        # Setup data for plotting
-        dna = indata['dna'].astype('float')
-        rat = indata['sig'] / dna
-        pltitems = [
-            ('DNA channel...', indata['dna'], 'DNA [a.u.]', 'dna'),
-            ('Signal channel...', indata['sig'], 'Signal [a.u.]', 'sig'),
-            ('Signal/DNA ratio...', rat[rat != np.inf], 'Signal/DNA', 'ratio')
-        ]
+            out_png = [out_png + lab + suffix + '.png'
+                for lab in ['dna', 'sig', 'ratio']]
 
         # PLOT =================================================================
 
@@ -411,32 +254,10 @@ class Condition(iot.IOinterface):
         suptitle += ' [sigma = ' + str(kwargs['sigma_smooth']) + ']'
         suptitle += ' [nbins = ' + str(kwargs['nbins']) + ']'
 
-        # Plot
-        for (msg, y, ylab, lab) in pltitems:
-            self.printout(msg, 2)
-
-            # Actual plot
-            fig = plot.single_pixel_study(indata[kwargs['dfield']],
-                y, ylab, profiles[lab], partial = partial, **kwargs)
-            fig.tight_layout()
-            plt.subplots_adjust(top = 0.95)
-            plt.suptitle(suptitle)
-
-            # Export PDF
-            if kwargs['plotting']: plt.savefig(pp, format = 'pdf')
-
-            # Export PNG
-            if partial:
-                fname = out_png + lab + '.part' + suffix + '.png'
-            else:
-                fname = out_png + lab + suffix + '.png'
-            if kwargs['plotting']: plt.savefig(fname, format = 'png')
-
-            # Close figure
-            plt.close(fig)
-
-        # Close file pointer
-        if kwargs['plotting']: pp.close()
+        # Submit DNA, signal and ratio plots to the render queue
+        render.get_render_queue().submit('single_pixel_studies',
+            [indata, profiles, suptitle], dict(kwargs, partial = partial),
+            pdf = fname, png = out_png)
 
     def export_nuclei(self, **kwargs):
         """Export current condition nuclei. """
@@ -511,22 +332,154 @@ class Condition(iot.IOinterface):
 
         # Segment every series in the condition
         self.printout('Current condition: "' + self.name + '"...', 0)
-        self.series = Parallel(n_jobs = ncores)(
-            delayed(find_series_nuclei)(self, i, **kwargs)
-            for i in range(len(self.series)))
+        self.series = [from_descriptor(d) for d in Parallel(n_jobs = ncores)(
+            delayed(f)(*args, **fkwargs) for (f, args, fkwargs)
+            in self.get_segmentation_tasks(**kwargs))]
+
+    def get_accumulation_tasks(self, data_nested, **kwargs):
+        """Build the profile accumulation tasks, one per series, when the
+        analysis workers could not accumulate the profiles themselves. That
+        is the case for absolute distances, as the profile bins span the
+        whole condition, whose maximum distance is known only once every
+        series has been retrieved.
+
+        Args:
+          data_nested (list): get_series_nuclear_data output, one per series.
+          **kwargs
+
+        Returns:
+          list: tasks, see pygpseq.tools.parallel.mk_task. Empty if every
+                series was already accumulated.
+        """
+
+        if all(['accs' in nested.keys() for nested in data_nested]):
+            return([])
+
+        # Profile bins span the whole condition
+        xmax = dict([(v, max([nested['xmax'][v] for nested in data_nested]))
+            for v in ['all', 'part']])
+
+        return([pa.mk_task(accumulate_series_profiles, nested['spx_path'],
+            (nested['offset'], sum(nested['counts'])), xmax, **kwargs)
+            for nested in data_nested])
+
+    def get_analysis_tasks(self, summary, **kwargs):
+        """Build the single-pixel data retrieval tasks, one per series.
+
+        Args:
+          summary (np.array): selected nuclear summaries,
+                              const.DTYPE_NUCLEAR_SUMMARY.
+          **kwargs: out_dir, buffer_folder (opt).
+
+        Returns:
+          tuple: tasks (see pygpseq.tools.parallel.mk_task) and path to the
+                 condition buffer, to be removed by the caller.
+        """
+
+        # Only the selected nuclei of the series are sent to the worker
+        sids = list(set(summary['s']))
+        ds = [self.series[sidx - 1].get_descriptor(
+            summary['n'][summary['s'] == sidx]) for sidx in sids]
+
+        # Reserve rows for every series in a condition buffer, where workers
+        # write their single-pixel tables. The buffer is written to the
+        # buffer folder if any, otherwise to the output folder, as the
+        # system temporary folder is often too small for it
+        sizes = [sum([n.get_max_npixels() for n in d['nuclei']]) for d in ds]
+        offsets = np.cumsum([0] + sizes).tolist()
+        folder = kwargs['out_dir']
+        if 'buffer_folder' in kwargs.keys():
+            if not type(None) == type(kwargs['buffer_folder']):
+                folder = kwargs['buffer_folder']
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok = True)
+        fd, spx_path = tempfile.mkstemp(prefix = 'pygpseq.%s.' % self.name,
+            suffix = '.npy', dir = folder)
+        os.close(fd)
+        buf = np.lib.format.open_memmap(spx_path, 'w+',
+            dtype = const.DTYPE_NUCLEAR_DATA, shape = (max(1, offsets[-1]),))
+        del buf
+
+        return(([pa.mk_task(get_series_nuclear_data, ds[i], self.verbose,
+            spx_path, offsets[i], sizes[i], **kwargs)
+            for i in range(len(ds))], spx_path))
 
     def get_nuclei(self):
         """Return a list of the nuclei in the condition. """
         nuclei = []
         for s in self.series:
-            nuclei.extend(s.nuclei)
+            nuclei.extend(s.get_nuclei())
         return(nuclei)
 
+    def get_selected_summary(self, **kwargs):
+        """Retrieve and filter the summaries of the condition nuclei.
+
+        Args:
+          **kwargs
+
+        Returns:
+          np.array: selected nuclear summaries, const.DTYPE_NUCLEAR_SUMMARY.
+                    None if no nucleus is found or selected.
+        """
+
+        # Retrieve nuclei
+        nuclei = self.get_nuclei()
+
+        # Check that the condition contains nuclei
+        if 0 == len(nuclei):
+            return(None)
+
+        # Retrieve nuclei summaries
+        self.printout('Retrieving nuclear summary...', 1)
+        summary = np.zeros(len(nuclei),
+            dtype = const.DTYPE_NUCLEAR_SUMMARY)
+        for i in range(len(nuclei)):
+            summary[i] = nuclei[i].get_summary()
+
+        # Filter nuclei
+        msg = 'Filtering nuclei based on size, intensity and shape...'
+        self.printout(msg, 1)
+        selected = self.multi_threshold_nuclei(data = summary, **kwargs)
+
+        # Check that nuclei are selected
+        if 0 == len(selected):
+            return(None)
+        
+        # Apply selection
+        summary = np.asarray([summary[i] for i in selected],
+            dtype = const.DTYPE_NUCLEAR_SUMMARY)
+
+        # Output
+        return(summary)
+
+    def get_segmentation_tasks(self, series_ids = None, **kwargs):
+        """Build the segmentation tasks, one per series. Only the selected
+        series are described, so that the checkpoint records of the others
+        are not loaded.
+
+        Args:
+          series_ids (list[int]): indexes of the series to segment
+                                  (opt, def: all).
+          **kwargs: all Main attributes.
+
+        Returns:
+          list: tasks, see pygpseq.tools.parallel.mk_task.
+        """
+        if type(None) == type(series_ids):
+            series_ids = range(len(self.series))
+        return([pa.mk_task(find_series_nuclei,
+            self.series[i].get_descriptor(), self.verbose, **kwargs)
+            for i in series_ids])
+
+    @traced()
     def make_profiles(self, pdata, n_nuclei, **kwargs):
         """Prepare profiles for plotting.
 
         Args:
-          pdata (np.array): single-pixel data table, const.DTYPE_NUCLEAR_DATA.
+          pdata (np.array, dict): single-pixel data table,
+                                  const.DTYPE_NUCLEAR_DATA, or accumulated
+                                  'dna', 'sig' and 'ratio' profiles
+                                  (ProfileAccumulator).
           n_nuclei (int): number of nuclei.
           **kwargs
         
@@ -537,22 +490,44 @@ class Condition(iot.IOinterface):
         # Will contain the profiles
         profiles = {}
 
-        # DNA profile
-        self.printout('DNA profile...', 2)
-        profiles['dna'] = stt.smooth_sparse_gaussian(
-            pdata[kwargs['dfield']].tolist(), pdata['dna'].tolist(), **kwargs)
-
-        # Signal profile
-        self.printout('Signal profile...', 2)
-        profiles['sig'] = stt.smooth_sparse_gaussian(
-            pdata[kwargs['dfield']].tolist(), pdata['sig'].tolist(), **kwargs)
-
-        # Ratio profile
-        self.printout('Signal/DNA profile...', 2)
-        rat = pdata['sig'] / pdata['dna'].astype('float')
-        profiles['ratio'] = stt.smooth_sparse_gaussian(
-            pdata[kwargs['dfield']][rat != np.inf].tolist(),
-            rat[rat != np.inf].tolist(), **kwargs)
+        # Profiles accumulated by the workers
+        if isinstance(pdata, dict):
+            for (k, label) in [('dna', 'DNA'), ('sig', 'Signal'),
+                ('ratio', 'Signal/DNA')]:
+                self.printout(label + ' profile...', 2)
+                profiles[k] = stt.smooth_accumulated_gaussian(
+                    pdata[k], **kwargs)
+
+                # Boxplot statistics, per bin and overall
+                profiles[k]['box'] = [pdata[k].get_box_stats(b)
+                    for b in range(pdata[k].nbins)]
+                profiles[k]['box_all'] = pdata[k].get_box_stats()
+        else:
+            # Read every column only once
+            x = pdata[kwargs['dfield']]
+            dna = pdata['dna']
+            sig = pdata['sig']
+
+            # DNA profile
+            self.printout('DNA profile...', 2)
+            profiles['dna'] = stt.smooth_sparse_gaussian(x, dna, **kwargs)
+
+            # Signal profile
+            self.printout('Signal profile...', 2)
+            profiles['sig'] = stt.smooth_sparse_gaussian(x, sig, **kwargs)
+
+            # Ratio profile
+            self.printout('Signal/DNA profile...', 2)
+            rat = sig / dna.astype('float')
+            profiles['ratio'] = stt.smooth_sparse_gaussian(
+                x[rat != np.inf], rat[rat != np.inf], **kwargs)
+
+            # Boxplot statistics, per bin and overall
+            nbins = kwargs['nbins'] if 'nbins' in kwargs.keys() else None
+            for (k, xk, yk) in [('dna', x, dna), ('sig', x, sig),
+                ('ratio', x[rat != np.inf], rat[rat != np.inf])]:
+                profiles[k]['box'], profiles[k]['box_all'] = (
+                    stt.binned_box_stats(xk, yk, nbins))
 
         # Save number of nuclei and condition name
         profiles['n'] = n_nuclei
@@ -561,6 +536,140 @@ class Condition(iot.IOinterface):
         # Output
         return(profiles)
 
+    @traced()
+    def merge_nuclear_data(self, summary, data_nested, **kwargs):
+        """Merge the single-pixel data retrieved from every series, then
+        build and plot the condition profiles.
+
+        Args:
+          summary (np.array): selected nuclear summaries,
+                              const.DTYPE_NUCLEAR_SUMMARY.
+          data_nested (list): get_series_nuclear_data output, one per series,
+                              with profile accumulators ('accs', see
+                              get_accumulation_tasks).
+          **kwargs
+
+        Returns:
+          tuple: profiles, summaries, single-pixel table (PixelStore, to be
+                 removed by the caller) and density/volume profiles.
+        """
+
+        # Set output suffix
+        if not 'suffix' in kwargs.keys():
+            suffix = ''
+        else:
+            suffix = st.add_leading_dot(kwargs['suffix'])
+
+        # Check plotting
+        if not 'plotting' in kwargs.keys():
+            kwargs['plotting'] = True
+
+        # Un-nest nuclear data
+        counts = []
+        [counts.extend(nested['counts']) for nested in data_nested]
+        n_nuclei = len(counts)
+
+        # Read the rows written by the workers to the condition buffer,
+        # skipping rows with no DNA signal
+        self.printout('Opening single-pixel table...', 1)
+        merged = PixelStore(data_nested[0]['spx_path'],
+            [(nested['offset'], sum(nested['counts']))
+            for nested in data_nested])
+
+        # Report rows with no DNA signal
+        self.printout('Removing pixels without DNA signal...', 1)
+        self.printout('Identifying pixels...', 2)
+        nToRemove = sum(counts) - merged.count()
+        if not 0 == nToRemove:
+            msg = 'Removed %i pixels without DNA signal...' % nToRemove
+            self.printout(msg, 2)
+
+        # Merge the series profile accumulators
+        accs = data_nested[0]['accs']
+        for nested in data_nested[1:]:
+            for v in accs.keys():
+                [accs[v][k].merge(nested['accs'][v][k])
+                    for k in accs[v].keys()]
+
+        # Density profile ------------------------------------------------------
+
+        dp = np.vstack([nested['density'] for nested in data_nested])
+        dp = pd.DataFrame(dp)
+        col_labs = ["c", "s", "n"]
+        col_labs.extend(["nd_%f" % b
+            for b in np.linspace(0, 1, kwargs['nbins'] + 1)[1:]])
+        dp.columns = col_labs
+
+        # Volume profile -------------------------------------------------------
+
+        vp = np.vstack([nested['volume'] for nested in data_nested])
+        vp = pd.DataFrame(vp)
+        col_labs = ["c", "s", "n"]
+        col_labs.extend(["nd_%f" % b
+            for b in np.linspace(0, 1, kwargs['nbins'] + 1)[1:]])
+        vp.columns = col_labs
+
+        # PLOT =================================================================
+
+        # EVERY PIXEL ----------------------------------------------------------
+
+        # Produce profile plot
+        self.printout('Generating profiles...', 1)
+        profiles = self.make_profiles(accs['all'], n_nuclei, **kwargs)
+        self.set_profile_label(profiles, **kwargs)
+
+        # Export single profile study
+        self.printout('Studying single-pixel behaviour...', 1)
+        self.check_single_pixels(merged, profiles, **kwargs)
+
+        # Export single-condition plot
+        self.printout('Exporting profiles...', 1)
+
+        # Mean/median/mode profile plot
+        fname = self.name + '.profiles' + suffix
+        if kwargs['plotting']:
+            render.get_render_queue().submit('single_condition_profile_stats',
+                [profiles], dict(kwargs, n_nuclei = n_nuclei),
+                pdf = kwargs['out_dir'] + const.OUTDIR_PDF + fname + '.pdf',
+                png = kwargs['out_dir'] + const.OUTDIR_PNG + fname + '.png')
+
+        # PARTIAL VOLUME -------------------------------------------------------
+        if const.AN_3D == kwargs['an_type']:
+            part = merged.get_part()
+            
+            # Produce partial nucleus profile plots
+            msg = 'Generating partial profiles ['
+            msg += str(kwargs['part_n_erosion']) + ']...'
+            self.printout(msg, 1)
+
+            # Store partial profile in the output
+            profiles['part'] = self.make_profiles(accs['part'], n_nuclei,
+                **kwargs)
+            self.set_profile_label(profiles['part'], **kwargs)
+
+            # Export single profile study for partial volume
+            msg = 'Studying single-pixel behaviour'
+            msg += ' on partial volume [' + str(kwargs['part_n_erosion']) + ']'
+            msg += '...'
+            self.printout(msg, 1)
+            supcomm = ' [partial volume ' + str(kwargs['part_n_erosion']) + ']'
+            self.check_single_pixels(part, profiles['part'], partial = True,
+                supcomm = supcomm, **kwargs)
+
+            # Export partial nucleus single-condition plot
+            title = 'partial_volume ' + str(kwargs['part_n_erosion'])
+            fname = self.name + '.profiles.part' + suffix
+            if kwargs['plotting']:
+                render.get_render_queue().submit(
+                    'single_condition_profile_stats', [profiles['part']],
+                    dict(kwargs, n_nuclei = n_nuclei, title_comment = title),
+                    pdf = kwargs['out_dir'] + const.OUTDIR_PDF + fname + '.pdf',
+                    png = kwargs['out_dir'] + const.OUTDIR_PNG + fname + '.png')
+
+        # Output
+        self.printout('', 0)
+        return((profiles, summary, merged, dp, vp))
+
     def multi_threshold_nuclei(self,
         cond_name, seg_type, data, sigma_density, nsf,
         font_size, out_dir, wspace = None, hspace = None, **kwargs):
@@ -589,49 +698,27 @@ class Condition(iot.IOinterface):
         if not 'plotting' in kwargs.keys():
             kwargs['plotting'] = True
 
-        fig = plt.figure(figsize = [8, 8])
         suptitle = 'Automatic nuclei threshold for condition '
         if self.name in kwargs['cdescr'].keys():
             suptitle += '"%s"' % (kwargs['cdescr'][cond_name],)
         else:
             suptitle += '"%s"' % (cond_name,)
             suptitle += "\n [sigma: %.2f]" % (sigma_density,)
-        plt.suptitle(suptitle)
-
-        # Setup subplots spacing
-        if None == wspace:
-            wspace = .4
-        if None == hspace:
-            hspace = .4
-        plt.subplots_adjust(wspace = wspace, hspace = hspace)
 
+        sel_data = {}
         if not 0 == len(nsf):
             # Filter features
-            sel_data = {}
-            plot_counter = 1
             for nsfi in nsf:
                 # Identify Nuclear Selection Feature
                 nsf_field = const.NSEL_FIELDS[nsfi]
                 nsf_name = const.NSEL_NAMES[nsfi]
                 self.printout('Filtering ' + nsf_name + '...', 2)
 
-                # Select subplot
-                if 1 == len(nsf):
-                    plt.subplot(1, 1, 1)
-                else:
-                    plt.subplot(2, 2, plot_counter)
-
-                # Plot
+                # Calculate density and FWHM range
                 sel_data[nsf_field] = self.single_threshold_nuclei(
                     data = data[nsf_field], sigma_density = sigma_density,
                     xlab = plot.get_nsf_label(nsfi, seg_type))
 
-                # Edit plot
-                plot.set_font_size(font_size)
-                plot.density_with_range(new_figure = False,
-                    **sel_data[nsf_field])
-                plot_counter += 1
-
             # Select based on range
             self.printout('Selecting nuclei...', 2)
             f = lambda x, r: x >= r[0] and x <= r[1]
@@ -649,47 +736,35 @@ class Condition(iot.IOinterface):
             selected = [sel_data[f]['sel'] for f in nsfields]
             g = lambda i: all([sel[i] for sel in selected])
             selected = [i for i in range(len(selected[0])) if g(i)]
-            sub_data = data[selected]
 
             # Set title
             title = 'Selected ' + str(len(selected)) + '/'
             title += str(len(sel_data[const.NSEL_FIELDS[nsf[0]]]['data']))
             title += ' nuclei.'
-
-            if not 1 == len(nsf):
-                # General scatterplot
-                plt.subplot(2, 2, 4)
-                plot.set_font_size(font_size)
-                plt.plot(data[const.NSEL_FIELDS[nsf[0]]],
-                    data[const.NSEL_FIELDS[nsf[1]]], ',k')
-                plt.hold(True)
-
-                # Selected scatterplot
-                plt.plot(sub_data[const.NSEL_FIELDS[nsf[0]]],
-                    sub_data[const.NSEL_FIELDS[nsf[1]]], ',r')
-                plt.xlabel(plot.get_nsf_label(nsf[0], seg_type))
-                plt.ylabel(plot.get_nsf_label(nsf[1], seg_type))
-                plt.title(title)
-                plt.ticklabel_format(style = 'sci', axis = 'x',
-                    scilimits = (0, 0))
-                plt.ticklabel_format(style = 'sci', axis = 'y',
-                    scilimits = (0, 0))
         else:
             # Set title
             selected = range(data.shape[0])
             title = 'Selected ' + str(len(selected)) + ' nuclei.'
-            plt.title(title)
 
-        # Export plot
+        # Submit plot to the render queue, with picklable densities
         self.printout('Exporting threshold plot...', 2)
-        fname = out_dir + const.OUTDIR_PDF + self.name + '.threshold_summary'
-        fname += suffix + '.pdf'
-        if kwargs['plotting']: plot.export(fname, 'pdf')
-        fname = out_dir + const.OUTDIR_PNG + self.name + '.threshold_summary'
-        fname += suffix + '.png'
-        if kwargs['plotting']: plot.export(fname, 'png')
+        if kwargs['plotting']:
+            plot_data = {}
+            for (nsf_field, t) in sel_data.items():
+                t = dict([(k, t[k]) for k in t.keys() if not k in ['sel']])
+                t['density'] = {'x' : t['density']['x'],
+                    'y' : t['density']['y'],
+                    'f' : t['density']['f'](t['fwhm_range'])}
+                plot_data[nsf_field] = t
+
+            fname = self.name + '.threshold_summary' + suffix
+            render.get_render_queue().submit('nuclear_threshold_summary',
+                [plot_data, nsf, seg_type, data, list(selected), suptitle,
+                title], dict(font_size = font_size, wspace = wspace,
+                hspace = hspace),
+                pdf = out_dir + const.OUTDIR_PDF + fname + '.pdf',
+                png = out_dir + const.OUTDIR_PNG + fname + '.png')
         self.printout(title, 2)
-        plt.close(fig)
 
         # Output
         return(selected)
@@ -699,6 +774,13 @@ class Condition(iot.IOinterface):
         for i in range(len(self.series)):
             self.series[i][key] = self[key]
 
+    def set_profile_label(self, profiles, cdescr = None, **kwargs):
+        """Label profiles with the condition description, if available, as
+        done when plotting them. """
+        if type(None) != type(cdescr):
+            if profiles['condition'] in cdescr.keys():
+                profiles['condition'] = cdescr[profiles['condition']]
+
     def single_threshold_nuclei(self, data, sigma_density, xlab = None,
         **kwargs):
         """Select a single-feature nuclear threshold.
@@ -737,81 +819,184 @@ class Condition(iot.IOinterface):
 
 # FUNCTIONS ====================================================================
 
-def find_series_nuclei(self, i, **kwargs):
+def accumulate_profiles(chunks, xmax, dfield, an_type = None, nbins = None,
+    **kwargs):
+    """Accumulate the DNA, signal and ratio profiles of single-pixel rows,
+    of every pixel and, for 3D analyses, of the partial volume.
+
+    Args:
+      chunks (iterable[np.array]): single-pixel rows with DNA signal,
+                                   const.DTYPE_NUCLEAR_DATA.
+      xmax (dict): upper bound of the profile domain, for 'all' and 'part'.
+      dfield (string): distance column.
+      an_type (int): analysis type according to pygpseq.const (opt).
+      nbins (int): curve precision (opt, def: 200).
+      **kwargs
+
+    Returns:
+      dict: 'all' and, for 3D analyses, 'part' ProfileAccumulator for 'dna',
+            'sig' and 'ratio'.
+    """
+
+    vols = ['all']
+    if const.AN_3D == an_type:
+        vols.append('part')
+    accs = dict([(v, dict([(k, ProfileAccumulator(xmax[v], nbins))
+        for k in ['dna', 'sig', 'ratio']])) for v in vols])
+
+    for chunk in chunks:
+        for v in vols:
+            vchunk = chunk if 'all' == v else chunk[chunk['part'] == 1]
+            x = vchunk[dfield]
+            accs[v]['dna'].update(x, vchunk['dna'])
+            accs[v]['sig'].update(x, vchunk['sig'])
+            rat = vchunk['sig'] / vchunk['dna'].astype('float')
+            accs[v]['ratio'].update(x[rat != np.inf], rat[rat != np.inf])
+
+    return(accs)
+
+@traced()
+def accumulate_series_profiles(spx_path, region, xmax, **kwargs):
+    """Function for parallelized profile accumulation of a series, reading
+    its rows of the condition buffer chunk by chunk.
+
+    Args:
+      spx_path (string): path to the condition buffer (.npy).
+      region (tuple[int]): (first row, number of rows) of the series.
+      xmax (dict): upper bound of the profile domain, for 'all' and 'part'.
+      **kwargs: dfield, an_type, nbins.
+
+    Returns:
+      dict: see accumulate_profiles.
+    """
+    pstore = PixelStore(spx_path, [region])
+    return(accumulate_profiles(pstore.iter_chunks(
+        [kwargs['dfield'], 'dna', 'sig', 'part']), xmax, **kwargs))
+
+@traced()
+def find_series_nuclei(d, cond_verbose, **kwargs):
     """Function for parallelized nuclear segmentation.
 
     Args:
-      i (int): series index.
+      d (dict): series descriptor, see Series.get_descriptor.
+      cond_verbose (bool): condition verbosity, for the log.
       **kwargs: ncores.
     
     Returns:
-      pygpseq.wraps.Series: updated i-th series instance.
+      dict: descriptor of the segmented series.
     """
 
+    # Rebuild series
+    s = from_descriptor(d)
+    logger = iot.IOinterface(path = d['logpath'], append = True)
+    logger.verbose = cond_verbose
+
     # Set series verbosity
     if kwargs['ncores'] != 1:
-        self.series[i].verbose = False
+        s.verbose = False
 
     # Get starting time
     start_time = time.time()
 
     # Find nuclei
-    self.series[i], log = self.series[i].find_nuclei(**kwargs)
+    s, log = s.find_nuclei(**kwargs)
 
     # Print log all at once
     time_msg = 'Took %s s.\n' % (round(time.time() - start_time, 3))
     if not 1 == kwargs['ncores']:
         log += iot.printout(time_msg, 1, False)
-        self.printout(log, 0)
+        logger.printout(log, 0)
     else:
-        self.printout(time_msg, 1)
+        logger.printout(time_msg, 1)
 
     # Output
-    return(self.series[i])
+    s.verbose = d['verbose']
+    return(s.get_descriptor())
 
-def get_series_nuclear_data(self, summary, sidx, **kwargs):
+@traced()
+def get_series_nuclear_data(d, cond_verbose, spx_path, spx_offset, spx_size,
+    **kwargs):
     """Function for parallelized single-pixel nuclear data retrieval.
+    The single-pixel tables are written to the condition buffer, starting
+    from the series offset, instead of being returned.
 
     Args:
-      summary (list): list of summaries.
-      sidx (int): series index.
+      d (dict): series descriptor, with only the selected nuclei,
+                see Series.get_descriptor.
+      cond_verbose (bool): condition verbosity, for the log.
+      spx_path (string): path to the condition buffer (.npy).
+      spx_offset (int): first buffer row reserved to the series.
+      spx_size (int): number of buffer rows reserved to the series.
       **kwargs: ncores.
     
     Returns:
-      np.array: series nuclear data.
+      dict: buffer path, series offset, number of rows per nucleus,
+            density/volume profiles, maximum distance ('xmax', for 'all' and
+            'part') and, for normalized distances, the profile accumulators
+            ('accs', see accumulate_profiles).
     """
 
+    # Rebuild series
+    s = from_descriptor(d)
+    logger = iot.IOinterface(path = d['logpath'], append = True)
+    logger.verbose = cond_verbose
+
     # Set series verbosity
     if kwargs['ncores'] != 1:
-        self.series[sidx - 1].verbose = False
+        s.verbose = False
     else:
-        self.series[sidx - 1].verbose = True
+        s.verbose = True
 
     # Get starting time
     start_time = time.time()
 
     # Setup starting message
-    msg = 'Retrieving nuclear data from series #' + str(sidx) + '...'
+    msg = 'Retrieving nuclear data from series #' + str(s.n) + '...'
     msg = iot.printout(msg, 1, verbose = False)
 
-    # Get nuclei ids for current series
-    ns = [i for i in range(summary.shape[0]) if summary['s'][i] == sidx]
-    ns = summary['n'][ns]
-
     # Retrieve nuclear data
-    data, dp, vp, log = self.series[sidx - 1].get_nuclei_data(ns, **kwargs)
+    ns = [n.n for n in s.nuclei]
+    data, dp, vp, log = s.get_nuclei_data(ns, **kwargs)
 
     # Print log all at once
     time_msg = 'Took %s s.' % (round(time.time() - start_time, 3))
     if not 1 == kwargs['ncores']:
         log = msg + log
         log += iot.printout(time_msg, 2, False)
-        self.printout(log, 0)
+        logger.printout(log, 0)
     else:
-        self.printout(time_msg, 2)
+        logger.printout(time_msg, 2)
+
+    # Write to the condition buffer
+    counts = [ndata.shape[0] for ndata in data]
+    if sum(counts) > spx_size:
+        msg = 'Single-pixel data of series #%d exceed the reserved size.'
+        raise ValueError(msg % s.n)
+    buf = np.lib.format.open_memmap(spx_path, 'r+')
+    pos = spx_offset
+    for ndata in data:
+        buf[pos:(pos + ndata.shape[0])] = ndata
+        pos += ndata.shape[0]
+    buf.flush()
+    del buf
+
+    # Maximum distance, of every pixel and of the partial volume
+    rows = [ndata[ndata['dna'] != 0] for ndata in data]
+    xmax = {}
+    for (v, xs) in [('all', [r[kwargs['dfield']] for r in rows]),
+        ('part', [r[kwargs['dfield']][r['part'] == 1] for r in rows])]:
+        xmax[v] = max([0.] + [x.max() for x in xs if 0 != x.shape[0]])
+    out = {'spx_path' : spx_path, 'offset' : spx_offset, 'counts' : counts,
+        'density' : dp, 'volume': vp, 'xmax' : xmax}
+
+    # Normalized distances have fixed profile bins, so the profiles are
+    # accumulated right away
+    if const.DLAMIN_NORM_LABEL == kwargs['dfield']:
+        out['accs'] = accumulate_profiles(rows, {'all' : 1., 'part' : 1.},
+            **kwargs)
 
     # Output
-    return({'spx_data' : data, 'density' : dp, 'volume': vp})
+    return(out)
 
 # END ==========================================================================
 
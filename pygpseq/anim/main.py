@@ -14,6 +14,7 @@ import datetime
 import multiprocessing
 import os
 import pkg_resources
+import tempfile
 import time
 import warnings
 
@@ -27,15 +28,22 @@ from weasyprint import HTML, CSS
 
 from pygpseq import const
 
+from pygpseq.tools.cache import MaskCache
+from pygpseq.tools.checkpoint import CheckpointStore
+from pygpseq.tools.store import PixelStore
 from pygpseq.tools import io as iot
+from pygpseq.tools import parallel as pa
 from pygpseq.tools import path as pt
 from pygpseq.tools import plot
+from pygpseq.tools import render
 from pygpseq.tools import stat as stt
 from pygpseq.tools import string as st
+from pygpseq.tools import trace as trc
 from pygpseq.tools import vector as vt
 
 from pygpseq.anim.analysis import Analyzer
 from pygpseq.anim.condition import Condition
+from pygpseq.anim.series import from_descriptor
 
 # CLASSES ======================================================================
 
@@ -47,9 +55,9 @@ class Main(Analyzer):
       basedir (string): input data directory path.
       outdir (string): output directory path.
       skip (list): steps to be skipped.
-        1  : skip instantiation (need gpi.inst.cpickle, otherwise unskips).
-        2  : skip segmentation (need gpi.seg.cpickle, otherwise unskips).
-        3  : skip analysis (need gpi.an.cpickle, otherwise unskips).
+        1  : skip instantiation (need gpi checkpoint, otherwise unskips).
+        2  : resume segmentation, only series without gpi checkpoint.
+        3  : resume analysis, only conditions without gpi checkpoint.
         3.5: skip single-nuclei boxplot (end of step 3).
         4  : final plots.
         5  : final report.
@@ -62,6 +70,9 @@ class Main(Analyzer):
                         Save intermediate nuclear tif images
                         of DNA, Sig, D and mask.
       plotting (bool): True to generate plot.
+      timing (bool): True to export a per-stage timing report of the run.
+      trace (bool): True to export a flame chart trace of the run, besides
+                    the timing report.
       suffix (string): suffix to every output file.
       notes (string): user-provided notes.
     """
@@ -80,6 +91,8 @@ class Main(Analyzer):
     font_size = 8
     debugging = False
     plotting = True
+    timing = False
+    trace = False
     ncores = 1
     notes = '...'
 
@@ -217,6 +230,10 @@ class Main(Analyzer):
         # Output
         return(checked)
 
+    def get_params(self, keys):
+        """Return the current value of the provided parameters, as a dict. """
+        return(dict([(k, self[k]) for k in keys]))
+
     def is_skipped(self, step):
         """Check if a run step should be skipped. """
         return(step in self.skip)
@@ -226,7 +243,8 @@ class Main(Analyzer):
         The function keeps some parameters from the current instance.
 
         Args:
-          f (file): file pointer to dumped instance.
+          f (file, pygpseq.Main): file pointer to dumped instance,
+                                  or already loaded instance.
           more_keys (list[string]): list of attribute names to be kept
                                     from the current instance.
 
@@ -241,7 +259,10 @@ class Main(Analyzer):
         vals = [self[k] for k in keys]
 
         # Load
-        loaded = cp.load(f)
+        if hasattr(f, 'read'):
+            loaded = cp.load(f)
+        else:
+            loaded = f
 
         # If the loaded cpickle bundle contained a Main instance
         if type(loaded) == type(self):
@@ -271,8 +292,11 @@ class Main(Analyzer):
 
         return(loaded)
 
-    def mk_general_boxplots(self, profiles, sumd, md, **kwargs):
-        """Generate general boxplots. """
+    @trc.traced()
+    def mk_general_boxplots(self, profiles, sumd, **kwargs):
+        """Generate general boxplots.
+        Single-pixel boxplots use the statistics precomputed with the
+        profiles. """
         
         # Common destinations
         out_pdf = self.outdir + const.OUTDIR_PDF
@@ -280,18 +304,11 @@ class Main(Analyzer):
         
         # Multi-condition single-nucleus boxplots
         self.printout('Preparing general single-nuclei boxplot...', 0)
-        fig = plot.multi_condition_boxplot(profiles, sumd, md, **kwargs)
-
-        # Export PDF
-        fname = out_pdf + 'boxplots' + kwargs['suffix'] + '.pdf'
-        if self.plotting: plot.export(fname, 'pdf')
-
-        # Export PNG
-        fname = out_png + 'boxplots' + kwargs['suffix'] + '.png'
-        if self.plotting: plot.export(fname, 'png')
-
-        # Close figure
-        plt.close(fig)
+        queue = render.get_render_queue()
+        if self.plotting:
+            queue.submit('multi_condition_boxplot', [profiles, sumd],
+                kwargs, pdf = out_pdf + 'boxplots' + kwargs['suffix'] + '.pdf',
+                png = out_png + 'boxplots' + kwargs['suffix'] + '.png')
 
         # Calculate boxplot relative widths
         bp_widths = [p['n'] for p in profiles]
@@ -315,12 +332,13 @@ class Main(Analyzer):
             ('sum(DNA [a.u.]) [per nucleus]', 'sumI')
         ]
         for (ylab, field) in bpitems:
-            plot.multi_condition_single_boxplot(profiles, sumd, field,
-                bp_widths, ylab, self.outdir + const.OUTDIR_PNG_REPORT,
-                **kwargs)
+            queue.submit('multi_condition_single_boxplot', [profiles, sumd,
+                field, bp_widths, ylab, self.outdir + const.OUTDIR_PNG_REPORT],
+                kwargs)
 
         # Calculate boxplot relative widths
-        bp_widths = np.asarray([m.shape[0] for m in md], dtype='float')
+        pxd = plot.get_pixel_box_stats(profiles)
+        bp_widths = np.asarray([m['dna']['n'] for m in pxd], dtype='float')
         bp_widths = bp_widths / bp_widths.max() * 0.9
 
         # Per pixel boxplots
@@ -332,9 +350,9 @@ class Main(Analyzer):
             ('Signal [a.u.] [per pixel]', 'sig')
         ]
         for (ylab, field) in bpitems:
-            plot.multi_condition_single_boxplot(profiles, md, field,
-                bp_widths, ylab, self.outdir + const.OUTDIR_PNG_REPORT,
-                **kwargs)
+            queue.submit('multi_condition_single_boxplot', [profiles, pxd,
+                field, bp_widths, ylab, self.outdir + const.OUTDIR_PNG_REPORT],
+                kwargs)
 
         # Compare per pixel distributions --------------------------------------
         
@@ -357,6 +375,7 @@ class Main(Analyzer):
         # fname += 'single_pixel_wmw' + kwargs['suffix'] + '.csv'
         # if self.plotting: pd.DataFrame(pvals).to_csv(fname)
 
+    @trc.traced()
     def mk_general_plots(self, profiles, sumd, **kwargs):
         """Generate final plots.
 
@@ -374,25 +393,18 @@ class Main(Analyzer):
         out_png = self.outdir + const.OUTDIR_PNG
 
         # Multi condition profile plot
+        queue = render.get_render_queue()
         for yfield in ['mean', 'median', 'mode', 'max']:
             msg = 'Preparing multi-condition profiles plot [' + yfield + ']...'
             self.printout(msg, 0)
 
-            # Plot
-            fig = plot.multi_condition_profiles(profiles,
-                yfield = yfield, **kwargs)
-
-            # Export PDF
+            # Plot and export PDF/PNG
             common_name = 'profiles.' + yfield + kwargs['suffix']
-            fname = out_pdf + common_name + '.pdf'
-            if self.plotting: plot.export(fname, 'pdf')
-
-            # Export PNG
-            fname = out_png + common_name + '.png'
-            if self.plotting: plot.export(fname, 'png')
-
-            # Close figure
-            plt.close(fig)
+            if self.plotting:
+                queue.submit('multi_condition_profiles', [profiles],
+                    dict(kwargs, yfield = yfield),
+                    pdf = out_pdf + common_name + '.pdf',
+                    png = out_png + common_name + '.png')
 
         # Export profiles to CSV
         self.printout('Exporting profiles to CSV...', 0)
@@ -430,22 +442,15 @@ class Main(Analyzer):
                 msg += yfield + ']...'
                 self.printout(msg, 0)
 
-                # Plot
-                fig = plot.multi_condition_profiles(part_profiles,
-                    yfield = yfield, title_comment = 'partial_volume '
-                    + str(kwargs['part_n_erosion']), **kwargs)
-
-                # Export PDF
+                # Plot and export PDF/PNG
                 common_name = 'profiles.part.' + yfield + kwargs['suffix']
-                fname = out_pdf + common_name + '.pdf'
-                if self.plotting: plot.export(fname,'pdf')
-
-                # Export PNG
-                fname = out_png + common_name + '.png'
-                if self.plotting: plot.export(fname,'png')
-
-                # Close
-                plt.close(fig)
+                if self.plotting:
+                    queue.submit('multi_condition_profiles', [part_profiles],
+                        dict(kwargs, yfield = yfield,
+                        title_comment = 'partial_volume '
+                        + str(kwargs['part_n_erosion'])),
+                        pdf = out_pdf + common_name + '.pdf',
+                        png = out_png + common_name + '.png')
 
             # Export profiles to CSV
             self.printout('Exporting partial profiles to CSV...', 0)
@@ -473,6 +478,7 @@ class Main(Analyzer):
         self.printout('Plotting background levels...', 0)
         plot.bgplot(self.conds, self.outdir + const.OUTDIR_PNG_REPORT, **kwargs)
     
+    @trc.traced()
     def mk_report(self, start_time, end_time, profeat, path = None):
         """Produce PDF report.
 
@@ -541,7 +547,7 @@ class Main(Analyzer):
             'rescale_deconvolved' : self.rescale_deconvolved,
             'notes' : self.notes,
             'conds' : self.conds,
-            'cnuclei' : [sum([len(s.nuclei) for s in c.series])
+            'cnuclei' : [sum([s.count_nuclei() for s in c.series])
                 for c in self.conds],
             'cdescr' : self.cdescr
         }
@@ -646,139 +652,133 @@ class Main(Analyzer):
             if type(getattr(self, n)) in const.KWARGS_TYPELIST and
             not n.startswith('__') and not n in const.KWARGS_AVOIDLIST])
 
-        # SINGLE STEPS =========================================================
-
-        # INSTANTIATION --------------------------------------------------------
-        # Check whether to skip instantiation
-        if self.is_skipped(1):
-            fname = self.outdir + 'gpi.inst' + kwargs['suffix'] + '.cpickle'
-            if os.path.exists(fname):
-                self.printout('Skipping instantiation...', 0)
-                self.printout('Loading dumped instance...\n', 0)
-
-                try:
-                    # Load
-                    f = open(fname, 'rb')
-                    keys = list(const.PARAM_SEG)
-                    keys.extend(list(const.PARAM_AN))
-                    self = self.load(f, keys)
-                    f.close()
-
-                    # Dump
-                    f = open(fname, 'wb')
-                    cp.dump(self, f)
-                    f.close()
-                except:
-                    self.printout('Unable to load dumped instance...', 0)
+        # Record timing spans of every process, started from now on, only if
+        # a timing report or a trace is requested
+        trace = self.trace
+        timing = self.timing or trace
+        tracer = trc.get_tracer()
+        if timing:
+            tracer = trc.get_tracer(
+                tempfile.mkdtemp(prefix = 'pygpseq.trace.'))
+
+        try:
+            # Render figures on a separate process pool, while computing
+            queue = render.get_render_queue(kwargs['ncores'])
+
+            # SINGLE STEPS =====================================================
+
+            # Checkpoint store, with one record per finished unit, and stage
+            # parameters check against the previous run
+            store = CheckpointStore(self.outdir + 'gpi' + kwargs['suffix'])
+            params = [('inst', const.PARAM_INST), ('seg', const.PARAM_SEG),
+                ('an', const.PARAM_AN)]
+            for (stage, keys) in params:
+                if not store.check_params(stage, self.get_params(keys)):
+                    msg = 'Parameters changed, dropping "%s" checkpoints...'
+                    self.printout(msg % stage, -1)
+            params = dict([(stage, self.get_params(keys))
+                for (stage, keys) in params])
+
+            # INSTANTIATION ----------------------------------------------------
+            # Check whether to skip instantiation
+            if self.is_skipped(1):
+                if store.has('inst'):
+                    self.printout('Skipping instantiation...', 0)
+                    self.printout('Loading checkpoint...\n', 0)
+
+                    try:
+                        keys = list(const.PARAM_SEG)
+                        keys.extend(list(const.PARAM_AN))
+                        self = self.load(store.load('inst'), keys)
+                    except (IOError, OSError, EOFError, cp.UnpicklingError,
+                        KeyError) as e:
+                        msg = 'Unable to load checkpoint, ignoring record'
+                        msg += ' (%s: %s)...' % (type(e).__name__, e)
+                        self.printout(msg, -1)
+                        self.printout('Unskipping instantiation...', 0)
+                        self.unskip(1)
+                else:
                     self.printout('Unskipping instantiation...', 0)
                     self.unskip(1)
-            else:
-                self.printout('Unskipping instantiation...', 0)
-                self.unskip(1)
         
-        if not self.is_skipped(1):
-            # Run instantiation if not skipped
-            self.run_initialization(**kwargs)
-
-            # Dump
-            fname = self.outdir + 'gpi.inst' + kwargs['suffix'] + '.cpickle'
-            f = open(fname, 'wb')
-            cp.dump(self, f)
-            f.close()
-
-        # SEGMENTATION ---------------------------------------------------------
-        # Check whether to skip segmentation
-        if self.is_skipped(2):
-            fname = self.outdir + 'gpi.seg' + kwargs['suffix'] + '.cpickle'
-            if os.path.exists(fname):
-                self.printout('Skipping segmentation...', 0)
-                self.printout('Loading dumped instance...\n', 0)
-
-                try:
-                    # Load
-                    f = open(fname, 'rb')
-                    self = self.load(f, const.PARAM_AN)
-                    f.close()
-
-                    # Dump
-                    f = open(fname, 'wb')
-                    cp.dump(self, f)
-                    f.close()
-                except:
-                    self.printout('Unable to load dumped instance...', 0)
-                    self.printout('Unskipping segmentation...', 0)
-                    self.unskip(2)
+            if not self.is_skipped(1):
+                # Run instantiation if not skipped
+                self.run_initialization(**kwargs)
+
+                # Save checkpoint
+                store.set_params('inst', params['inst'])
+                store.save(self, 'inst')
+
+            # SEGMENTATION -----------------------------------------------------
+            # Resume segmentation from the segmented series if skipped,
+            # otherwise segment every series
+            if self.is_skipped(2):
+                self.printout('Resuming segmentation from checkpoints...', 0)
             else:
-                self.printout('Unskipping segmentation...', 0)
-                self.unskip(2)
-        
-        if not self.is_skipped(2):
-            # Run segmentation if not skipped
-            self.run_segmentation(**kwargs)
-
-            # Dump
-            fname = self.outdir + 'gpi.seg'+ kwargs['suffix'] +'.cpickle'
-            f = open(fname, 'wb')
-            cp.dump(self, f)
-            f.close()
-
-        # ANALYSIS -------------------------------------------------------------
-        # Check whether to skip analysis
-        if self.is_skipped(3):
-            fname = self.outdir + 'gpi.an' + kwargs['suffix'] + '.cpickle'
-            if os.path.exists(fname):
-                self.printout('Skipping analysis...', 0)
-                self.printout('Loading dumped instance...\n', 0)
-
-                try:
-                    # Load
-                    f = open(fname, 'rb')
-                    self, profiles, profeat, sumd = self.load(f)
-                    f.close()
-
-                    # Dump
-                    f = open(fname, 'wb')
-                    cp.dump((self, profiles, profeat, sumd), f)
-                    f.close()
-                except:
-                    self.printout('Unable to load dumped instance...', 0)
-                    self.printout('Unskipping analysis...', 0)
-                    self.unskip(3)
+                store.drop('seg', 'an')
+            store.set_params('seg', params['seg'])
+            self.run_segmentation(checkpoint = store, **kwargs)
+
+            # ANALYSIS ---------------------------------------------------------
+            # Resume analysis from the analyzed conditions if skipped,
+            # otherwise analyze every condition
+            if self.is_skipped(3):
+                self.printout('Resuming analysis from checkpoints...', 0)
             else:
-                self.printout('Unskipping analysis...', 0)
-                self.unskip(3)
-        
-        if not self.is_skipped(3):
-            # Run analysis if not skipped
-            profiles, profeat, sumd, md = self.run_analysis(**kwargs)
-
-            # Dump
-            fname = self.outdir + 'gpi.an' + kwargs['suffix'] + '.cpickle'
-            f = open(fname, 'wb')
-            cp.dump((self, profiles, profeat, sumd), f)
-            f.close()
-
-            # Generate general boxplots if not skipped
-            if not self.is_skipped(3.5):
-                self.mk_general_boxplots(profiles, sumd, md, **kwargs)
-
-        # FINAL PLOTS ----------------------------------------------------------
-        # Produce final plots if not skipped
-        if not self.is_skipped(4):
-            self.mk_general_plots(profiles, sumd, **kwargs)
-        else:
-            self.printout('Skipping final plots...', 0)
-
-        # FINAL REPORT ---------------------------------------------------------
-        # Execution end
-        end_time = time.time()
-
-        # Generate final report if not skipped
-        if not self.is_skipped(5):
-            self.printout('Generating final report...', 0)
-            self.mk_report(start_time, end_time, profeat)
-        else:
-            self.printout('Skipping final report...', 0)
+                store.drop('an')
+            store.set_params('an', params['an'])
+            profiles, profeat, sumd, md = self.run_analysis(
+                checkpoint = store, **kwargs)
+
+            # Generate general boxplots if not skipped and every condition
+            # has boxplot statistics
+            try:
+                if any([not 'box_all' in p['dna'].keys() for p in profiles]):
+                    msg = 'Skipping general boxplots, '
+                    msg += 'missing boxplot statistics...'
+                    self.printout(msg, 0)
+                elif not self.is_skipped(3.5):
+                    self.mk_general_boxplots(profiles, sumd, **kwargs)
+
+                # FINAL PLOTS --------------------------------------------------
+                # Produce final plots if not skipped
+                if not self.is_skipped(4):
+                    self.mk_general_plots(profiles, sumd, **kwargs)
+                else:
+                    self.printout('Skipping final plots...', 0)
+
+                # Wait for every figure to be rendered
+                self.printout('Waiting for figures to be rendered...', 0)
+                with tracer.span('tools.render.RenderQueue.wait'):
+                    queue.wait()
+            finally:
+                # Remove single-pixel tables
+                [m.remove() for m in md if not type(None) == type(m)]
+
+            # FINAL REPORT -----------------------------------------------------
+            # Execution end
+            end_time = time.time()
+
+            # Generate final report if not skipped
+            if not self.is_skipped(5):
+                self.printout('Generating final report...', 0)
+                self.mk_report(start_time, end_time, profeat)
+            else:
+                self.printout('Skipping final report...', 0)
+
+            # Export timing report, and flame chart trace if requested
+            if timing:
+                fname = self.outdir + 'timing' + kwargs['suffix'] + '.json'
+                self.printout('Exporting timing report to "%s"...' % fname, 0)
+                tracer.write_report(fname)
+            if trace:
+                fname = self.outdir + 'trace' + kwargs['suffix'] + '.json'
+                self.printout('Exporting trace to "%s"...' % fname, 0)
+                tracer.write_trace(fname)
+        finally:
+            # Turn tracing off, removing the recorded spans
+            if timing:
+                tracer.stop()
 
         # CONCLUSION ===========================================================
 
@@ -790,36 +790,129 @@ class Main(Analyzer):
 
         return(self)
 
-    def run_analysis(self, **kwargs):
-        """Run analysis. """
+    @trc.traced()
+    def run_analysis(self, checkpoint = None, **kwargs):
+        """Run analysis.
+
+        Args:
+          checkpoint (pygpseq.tools.CheckpointStore): checkpoint store.
+            Analyzed conditions are loaded from it instead of being analyzed
+            again, and newly analyzed ones are saved to it (opt).
+          **kwargs
+
+        Returns:
+          tuple: profiles, profile features, summaries and single-pixel tables
+                 (None for conditions loaded from the checkpoint).
+        """
 
         # Retrieve and save nuclear data
         self.printout('* Retrieving nuclear data *', 0)
         self.printout('', 0)
 
-        # [{dtype:{x:float, y:float}, n:int, condition:string}]
-        data = [c.analyze_nuclei(**kwargs) for c in self.conds]
-        profiles = [d[0] for d in data if not type(None) == type(d)]
-        sumd = [d[1] for d in data if not type(None) == type(d)]
-        md = [d[2] for d in data if not type(None) == type(d)]
-        dp = [d[3] for d in data if not type(None) == type(d)]
-        vp = [d[4] for d in data if not type(None) == type(d)]
-
-        # Assemble and export density profile
-        dp = pd.concat(dp)
-        dp.to_csv("%s%s/density_profiles%s.csv" % (
-            kwargs['outdir'], const.OUTDIR_CSV, kwargs['suffix']))
+        # Retrieve and filter nuclear summaries, condition by condition
+        tasks = []
+        summaries = {}
+        ckwargs = {}
+        nested = {}
+        pending = {}
+        data = [None for c in self.conds]
+
+        # Condition buffers are removed if anything fails, otherwise
+        # by the caller once plotted
+        spx_paths = []
+        try:
+            for ci in range(len(self.conds)):
+                c = self.conds[ci]
+                if not type(None) == type(checkpoint) and checkpoint.has(
+                    'an', c.name):
+                    self.printout(
+                        'Resuming condition: "' + c.name + '"...', 0)
+                    data[ci] = checkpoint.load('an', c.name)
+                    continue
+                self.printout('Current condition: "' + c.name + '"...', 0)
+                ckwargs[ci] = c.adjust_options(**kwargs)
+                summary = c.get_selected_summary(**ckwargs[ci])
+                if type(None) == type(summary):
+                    continue
+                ctasks, spx_path = c.get_analysis_tasks(summary,
+                    **ckwargs[ci])
+                spx_paths.append(spx_path)
+                summaries[ci] = summary
+                nested[ci] = [None for t in ctasks]
+                pending[ci] = len(ctasks)
+                tasks.extend([(ci, j, ctasks[j]) for j in range(len(ctasks))])
+            self.printout('', 0)
 
-        # Assemble and export volume profile
-        vp = pd.concat(vp)
-        vp.to_csv("%s%s/volume_profiles%s.csv" % (
-            kwargs['outdir'], const.OUTDIR_CSV, kwargs['suffix']))
+            def merge(ci):
+                c = self.conds[ci]
+                self.printout('Merging condition "' + c.name + '"...', 0)
+                data[ci] = c.merge_nuclear_data(summaries[ci], nested[ci],
+                    **ckwargs[ci])
+                nested[ci] = None
+
+                # Save checkpoint, without the temporary single-pixel table
+                if not type(None) == type(checkpoint):
+                    checkpoint.save(data[ci][:2] + (None,) + data[ci][3:],
+                        'an', c.name)
+
+            # Retrieve single-pixel data of every series from a single queue,
+            # and merge each condition as soon as all of its series are done
+            # and their profiles accumulated
+            # [{dtype:{x:float, y:float}, n:int, condition:string}]
+            msg = 'Retrieving nuclear data from %d series...' % len(tasks)
+            self.printout(msg, 0)
+            atasks = []
+            for (ti, out) in pa.run_tasks([t[2] for t in tasks],
+                kwargs['ncores']):
+                ci, j = tasks[ti][:2]
+                nested[ci][j] = out
+                pending[ci] -= 1
+                if 0 == pending[ci]:
+                    ctasks = self.conds[ci].get_accumulation_tasks(
+                        nested[ci], **ckwargs[ci])
+                    if 0 == len(ctasks):
+                        merge(ci)
+                    pending[ci] = len(ctasks)
+                    atasks.extend([(ci, j, ctasks[j])
+                        for j in range(len(ctasks))])
+
+            # Accumulate the profiles of the series whose condition bins were
+            # not known to their worker
+            if 0 != len(atasks):
+                msg = 'Accumulating profiles of %d series...' % len(atasks)
+                self.printout(msg, 0)
+            for (ti, accs) in pa.run_tasks([t[2] for t in atasks],
+                kwargs['ncores']):
+                ci, j = atasks[ti][:2]
+                nested[ci][j]['accs'] = accs
+                pending[ci] -= 1
+                if 0 == pending[ci]:
+                    merge(ci)
+
+            profiles = [d[0] for d in data if not type(None) == type(d)]
+            sumd = [d[1] for d in data if not type(None) == type(d)]
+            md = [d[2] for d in data if not type(None) == type(d)]
+            dp = [d[3] for d in data if not type(None) == type(d)]
+            vp = [d[4] for d in data if not type(None) == type(d)]
+
+            # Assemble and export density profile
+            dp = pd.concat(dp)
+            dp.to_csv("%s%s/density_profiles%s.csv" % (
+                kwargs['outdir'], const.OUTDIR_CSV, kwargs['suffix']))
+
+            # Assemble and export volume profile
+            vp = pd.concat(vp)
+            vp.to_csv("%s%s/volume_profiles%s.csv" % (
+                kwargs['outdir'], const.OUTDIR_CSV, kwargs['suffix']))
+        except:
+            [PixelStore(p, []).remove() for p in spx_paths]
+            raise
 
         # Calculate profile-specific features
         self.printout('* Calculating profile features *', 0)
         profeat = []
         for ip in range(len(profiles)):
-            self.printout('Working on "' + self.conds[ip].name + '"', 1)
+            self.printout('Working on "' + profiles[ip]['condition'] + '"', 1)
             profile = profiles[ip]
 
             # Will contain current profile features
@@ -873,6 +966,7 @@ class Main(Analyzer):
 
         return((profiles, profeat, sumd, md))
 
+    @trc.traced()
     def run_initialization(self, **kwargs):
         """Initialize run. """
 
@@ -902,18 +996,69 @@ class Main(Analyzer):
             main = self) for c in self.conds]
         self.printout('', 0)
 
-    def run_segmentation(self, **kwargs):
-        """Run segmentation. """
+    @trc.traced()
+    def run_segmentation(self, checkpoint = None, **kwargs):
+        """Run segmentation.
+
+        Args:
+          checkpoint (pygpseq.tools.CheckpointStore): checkpoint store.
+            Segmented series are lazily loaded from it instead of being
+            segmented again, and newly segmented ones are saved to it (opt).
+          **kwargs
+        """
 
         # Check analysis/segmentation types
         self.check_anseg_types()
         kwargs['seg_type'] = self.seg_type
         kwargs['an_type'] = self.an_type
 
-        # Identify nuclei
+        # Identify nuclei, segmenting the series of every condition
+        # from a single queue
         self.printout('* Looking for nuclei *', 0)
         self.printout('', 0)
-        [c.find_nuclei(**kwargs) for c in self.conds]
+        todo = []
+        for c in self.conds:
+            for i in range(len(c.series)):
+                if not type(None) == type(checkpoint) and checkpoint.has(
+                    'seg', c.name, c.series[i].n):
+                    c.series[i].set_record(checkpoint.get_record(
+                        'seg', c.name, c.series[i].n))
+                else:
+                    todo.append((c, i))
+
+        # Cores in excess of the series to segment (e.g., all of them when
+        # a single series is left) calculate the per-slice local threshold
+        kwargs['adp_threads'] = max(1, kwargs['ncores'] // max(1,
+            min(kwargs['ncores'], len(todo))))
+
+        tasks = []
+        for c in self.conds:
+            ids = [i for (tc, i) in todo if tc is c]
+            ctasks = c.get_segmentation_tasks(ids,
+                **c.adjust_options(**kwargs))
+            tasks.extend([(c, i, t) for (i, t) in zip(ids, ctasks)])
+        nseries = sum([len(c.series) for c in self.conds])
+        if len(tasks) != nseries:
+            msg = 'Resuming %d segmented series...' % (nseries - len(tasks))
+            self.printout(msg, 0)
+        msg = 'Segmenting %d series from %d condition(s)...' % (
+            len(tasks), len(self.conds))
+        self.printout(msg, 0)
+
+        # Keep track of mask cache events, for the report
+        if not type(None) == type(self.mask_cache):
+            cache = MaskCache(self.mask_cache, self.mask_cache_size * 1024**3)
+            cache_stats = cache.get_stats()
+
+        for (ti, series) in pa.run_tasks([t[2] for t in tasks],
+            kwargs['ncores']):
+            c, i = tasks[ti][:2]
+            c.series[i] = from_descriptor(series)
+            if not type(None) == type(checkpoint):
+                checkpoint.save(series, 'seg', c.name, c.series[i].n,
+                    meta = c.series[i].get_checkpoint_meta())
+        if not type(None) == type(self.mask_cache):
+            self.printout(cache.report(cache_stats), 0)
         self.printout('', 0)
 
     def unskip(self, step):
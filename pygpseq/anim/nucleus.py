@@ -8,6 +8,8 @@
 
 # DEPENDENCIES =================================================================
 
+import os
+
 import numpy as np
 from scipy import ndimage as ndi
 from scipy.ndimage.measurements import center_of_mass
@@ -20,6 +22,7 @@ import warnings
 from pygpseq import const
 from pygpseq.tools import distance as dist, io as iot, image as imt
 from pygpseq.tools import stat as stt, string as st, vector as vt
+from pygpseq.tools.trace import traced
 
 # CLASSES ======================================================================
 
@@ -43,6 +46,8 @@ class Nucleus(iot.IOinterface):
 		meanI (float): mean of the intensity of every px/vx in the nucleus.
 		shape (float): nucleus shape descriptor.
 		thr (float): global threshold used to identify the nucleus.
+		crops (dict or string): nuclear mask and channel crops, or path to
+								the file they were spilled to.
 	"""
 
 	__version__ = const.VERSION
@@ -65,17 +70,19 @@ class Nucleus(iot.IOinterface):
 	meanI = 0
 	shape = 0
 	thr = 0
+	crops = None
 
 	def __init__(self, logpath, n, series_id, mask, i, thr, offset, aspect,
-		dna_bg, sig_bg, calc_n_surface = None, cond_name = None, **kwargs):
+		dna_bg, sig_bg, calc_n_surface = None, cond_name = None, box = None,
+		measures = None, **kwargs):
 		"""Run IOinterface __init__ method.
 
 		Args:
 		logpath (string): path to the log file.
 		n (int): nucleus id (1-indexed).
 		series_id (int): series id (1-indexed).
-		mask (numpy.array): binary image.
-		i (numpy.array): image.
+		mask (numpy.array): binary image, cropped to box if provided.
+		i (numpy.array): image, cropped to box if provided.
 		thr (uint16): threshold obtained with Otsu's method.
 		offset (tuple[int]): dimensions box/square offset.
 		aspect (tuple[float]): pixel/voxel dimension proportion.
@@ -84,6 +91,13 @@ class Nucleus(iot.IOinterface):
 		calc_n_surface (bool): True to calculate the nucleus mesh surface.
 								 Optional, defaults to True.
 		cname (str): condition name.
+		box (list[tuple[int]]): bounding box corner coordinates of the
+								pre-cropped mask and image. Optional, if not
+								provided it is identified from the mask.
+		measures (np.void): nucleus measurements, from the labeled image the
+							mask was cropped from, see
+							pygpseq.tools.objects.measure. Optional, if not
+							provided they are measured on the mask.
 		**kwargs
 		"""
 		
@@ -98,22 +112,33 @@ class Nucleus(iot.IOinterface):
 		self.c = "%s" % cond_name if type(None) != type(cond_name) else ""
 		self.s = series_id
 		self.n = n
-		self.box = self.get_bounding_box(mask, offset)
 		self.thr = thr
 		self.dna_bg = dna_bg
 		self.sig_bg = sig_bg
 		self.aspect = aspect
 
-		# Apply box selection to the image
-		i = imt.apply_box(i, self.box)
-		mask = imt.apply_box(mask, self.box)
+		if type(None) == type(box):
+			# Apply box selection to the image
+			self.box = self.get_bounding_box(mask, offset)
+			i = imt.apply_box(i, self.box)
+			mask = imt.apply_box(mask, self.box)
+		else:
+			# Already cropped
+			self.box = list(box)
 
 		# Nuclear measurements
-		self.size = mask.sum()
-		if 3 == len(i.shape):
-			self.flat_size = mask.max(0).sum()
+		if type(None) == type(measures):
+			self.size = mask.sum()
+			if 3 == len(i.shape):
+				self.flat_size = mask.max(0).sum()
+			else:
+				self.flat_size = self.size
+			self.box_mass_center = center_of_mass(mask)
 		else:
-			self.flat_size = self.size
+			self.size = measures['size']
+			self.flat_size = measures['flat_size']
+			self.box_mass_center = tuple(measures['centroid'] - [
+				c[0] for c in self.box])
 		self.unit = imt.get_unit(i.shape)
 		self.sumI = i[mask == 1].sum()
 		self.meanI = self.sumI / self.size
@@ -130,7 +155,6 @@ class Nucleus(iot.IOinterface):
 
 		self.box_origin = np.array([c[0] + 1 for c in self.box])
 		self.box_sides = np.array([np.diff(c) for c in self.box])
-		self.box_mass_center = center_of_mass(mask)
 
 	def __getitem__(self, key):
 		""" Allow get item. """
@@ -296,17 +320,34 @@ class Nucleus(iot.IOinterface):
 		elif 3 == len(mask.shape):
 			return(self.get_3d_bounding_box(mask, offset))
 
-	def get_data(self, dna_ch, sig_ch, an_type, aspect, debugging,
-		part_n_erosion, **kwargs):
+	def get_crops(self):
+		"""Retrieve the nuclear crops stored at segmentation.
+
+		Returns:
+			dict: mask, dna and sig crops. None if no crops were stored.
+		"""
+
+		if type('') == type(self.crops):
+			with np.load(self.crops) as f:
+				return(dict([(k, f[k]) for k in f.files]))
+		return(self.crops)
+
+	@traced()
+	def get_data(self, an_type, aspect, debugging, part_n_erosion,
+		dna_ch = None, sig_ch = None, **kwargs):
 		"""Get nuclear data.
+		Uses the crops stored at segmentation, unless the full-field channels
+		are provided.
 
 		Args:
-		dna_ch (np.array): image (dimensionality based on an_type).
-		sig_ch (np.array): image (dimensionality based on an_type).
 		an_type (int): analysis type according to pygpseq.const.
 		aspect (tuple[float]): pixel/voxel dimension proportion.
 		debugging (bool): True for debugging mode.
 		part_n_erosion (float): partial nucleus erosion distance threshold.
+		dna_ch (np.array): image (dimensionality based on an_type, opt), or
+		                   path to the image file, to read the box only.
+		sig_ch (np.array): image (dimensionality based on an_type, opt), or
+		                   path to the image file, to read the box only.
 		**kwargs
 
 		Returns:
@@ -330,17 +371,30 @@ class Nucleus(iot.IOinterface):
 		# Start log
 		log = ""
 
-		# Apply box selection to channels
-		dna = imt.apply_box(dna_ch, self.box)
-		sig = imt.apply_box(sig_ch, self.box)
-
-		# Produce or select mask
-		if not 'mask' in kwargs.keys():
-			bi = Binarize(path = self.logpath, append = True, **kwargs)
-			bi.verbose = self.verbose
-			mask, thr, tmp_log = bi.run(dna.copy())
+		crops = self.get_crops()
+		if type(None) == type(dna_ch) and type(None) != type(crops):
+			# Use segmentation crops
+			dna = crops['dna'].copy()
+			sig = crops['sig'].copy()
+			mask = crops['mask']
 		else:
-			mask = imt.apply_box(kwargs['mask'], self.box)
+			# Apply box selection to channels, reading only the box from file
+			if type('') == type(dna_ch):
+				dna = self.read_box(dna_ch, an_type, **kwargs)
+			else:
+				dna = imt.apply_box(dna_ch, self.box, copy = True)
+			if type('') == type(sig_ch):
+				sig = self.read_box(sig_ch, an_type, **kwargs)
+			else:
+				sig = imt.apply_box(sig_ch, self.box, copy = True)
+
+			# Produce or select mask
+			if not 'mask' in kwargs.keys():
+				bi = Binarize(path = self.logpath, append = True, **kwargs)
+				bi.verbose = self.verbose
+				mask, thr, tmp_log = bi.run(dna.copy())
+			else:
+				mask = imt.apply_box(kwargs['mask'], self.box)
 
 		# Select largest object only
 		L = label(mask)
@@ -399,34 +453,13 @@ class Nucleus(iot.IOinterface):
 			if not '' == e:
 				log += self.printout(e, -1)
 		
-		# Convert image into a list
-		mask_flat = mask.reshape([np.prod(mask.shape)])
-		mask_flat = mask_flat.tolist()
-		mask_flat = [i for i in range(len(mask_flat)) if 1 == mask_flat[i]]
-
-		# Prepare output
-		data = np.zeros(len(mask_flat), dtype = const.DTYPE_NUCLEAR_DATA)
-
-		# Flatten data for export
-		data['dna'] = vt.flatten_and_select(dna, mask_flat)
-		data['sig'] = vt.flatten_and_select(sig, mask_flat)
-		data['lamin_d'] = vt.flatten_and_select(laminD, mask_flat)
-		data['centr_d'] = vt.flatten_and_select(centrD, mask_flat)
-		data['part'] = vt.flatten_and_select(sm, mask_flat)
-		data['n'] = [self.n for i in data['dna']]
-
-		# Remove background
-		data['dna'] = np.array(data['dna'])
-		data['dna'][data['dna'] < self.dna_bg] = self.dna_bg
-		data['dna'] = np.array(data['dna']) - self.dna_bg
-		data['sig'] = np.array(data['sig'])
-		data['sig'][data['sig'] < self.sig_bg] = self.sig_bg
-		data['sig'] = np.array(data['sig']) - self.sig_bg
-
 		# Add normalized distance
 		laminD_norm = dist.normalize_nuclear_distance(
 			kwargs['dist_type'], laminD, centrD)
-		data['lamin_dnorm'] = vt.flatten_and_select(laminD_norm, mask_flat)
+
+		# Flatten data for export
+		data = self.select_pixels(mask, dna, sig, laminD, centrD,
+			laminD_norm, sm)
 
 		# Prepare density profile
 		density_profile, volume_profile = self.calc_density_profile(
@@ -435,6 +468,14 @@ class Nucleus(iot.IOinterface):
 		# Output
 		return((data, density_profile, volume_profile, log))
 
+	def get_max_npixels(self):
+		"""Upper bound to the number of rows of the nuclear single-pixel table.
+		The segmentation mask size when crops are stored, as the analysis can
+		only drop pixels from it, otherwise the bounding box volume. """
+		if type(None) == type(self.crops):
+			return(int(np.prod([c[1] - c[0] + 1 for c in self.box])))
+		return(int(self.size))
+
 	def get_summary(self):
 		"""Get nuclear summary. """
 
@@ -449,6 +490,95 @@ class Nucleus(iot.IOinterface):
 
 		return(data)
 
+	def read_box(self, impath, an_type = None, **kwargs):
+		"""Read the nuclear box from a channel file, without decoding the rest
+		of the field. The channel is prepared as in Series.get_channel.
+
+		Args:
+		impath (string): path to the channel image file.
+		an_type (int): analysis type according to pygpseq.const (opt).
+		**kwargs: rescale_deconvolved and rescaling factor options.
+
+		Returns:
+			np.array: channel box selection.
+		"""
+
+		# Read box
+		rescale = 1
+		if 'rescale_deconvolved' in kwargs.keys():
+			if kwargs['rescale_deconvolved']:
+				rescale = imt.get_rescaling_factor(impath, **kwargs)
+		box = imt.read_tiff(impath, 3, rescale = rescale, mmap = True,
+			roi = imt.get_box_slices(self.box))
+
+		# Make Z-projection
+		if len(box.shape) > len(self.box):
+			box = imt.mk_z_projection(box, an_type)
+
+		# Output
+		return(np.array(box))
+
+	def select_pixels(self, mask, dna, sig, laminD, centrD, laminD_norm, part):
+		"""Build the single-pixel table of the nucleus, with background
+		removal, through boolean-mask indexing.
+
+		Args:
+			mask (np.ndarray): nuclear mask.
+			dna (np.ndarray): DNA channel.
+			sig (np.ndarray): Signal channel.
+			laminD (np.ndarray): lamina distance.
+			centrD (np.ndarray): center distance.
+			laminD_norm (np.ndarray): normalized lamina distance.
+			part (np.ndarray): partial volume mask.
+
+		Returns:
+			np.ndarray: single-pixel table, const.DTYPE_NUCLEAR_DATA.
+		"""
+
+		# Identify nuclear pixels
+		mask = 1 == mask
+
+		# Prepare output
+		data = np.zeros(mask.sum(), dtype = const.DTYPE_NUCLEAR_DATA)
+		data['n'] = self.n
+		data['dna'] = dna[mask]
+		data['sig'] = sig[mask]
+		data[const.DLAMIN_LABEL] = laminD[mask]
+		data['centr_d'] = centrD[mask]
+		data[const.DLAMIN_NORM_LABEL] = laminD_norm[mask]
+		data['part'] = part[mask]
+
+		# Remove background, in place on the integer columns
+		for (field, bg) in [('dna', self.dna_bg), ('sig', self.sig_bg)]:
+			bg = int(np.ceil(bg))
+			col = data[field]
+			col[col < bg] = bg
+			col -= bg
+
+		return(data)
+
+	def set_crops(self, mask, dna, sig, crop_dir = None):
+		"""Store compact nuclear crops, to avoid re-reading and re-segmenting
+		the whole field during analysis.
+
+		Args:
+			mask (np.ndarray): nuclear mask crop.
+			dna (np.ndarray): DNA channel crop.
+			sig (np.ndarray): Signal channel crop.
+			crop_dir (string): folder to spill the crops to (opt).
+		"""
+
+		crops = {'mask' : mask.astype('bool'), 'dna' : dna.copy(),
+			'sig' : sig.copy()}
+
+		if type(None) == type(crop_dir):
+			self.crops = crops
+		else:
+			if not os.path.isdir(crop_dir): os.makedirs(crop_dir)
+			self.crops = os.path.join(crop_dir,
+				"s%03d.n%04d.npz" % (self.s, self.n))
+			np.savez(self.crops, **crops)
+
 	def calc_density_profile(self, dna, dnorm, nbins = 200):
 		'''Build nucleus density profile.
 
@@ -461,27 +591,10 @@ class Nucleus(iot.IOinterface):
 		density_profile = [self.c, self.s, self.n]
 		volume_profile = [self.c, self.s, self.n]
 
-		# Prepare denominators
-		M = dna.shape[0]      # Nuclear voxel count
-		sumI = np.nansum(dna) # Nuclear voxel intensity sum
-		denom = sumI / M      # Average voxel intensity
-
 		# Calculate for each bin
-		breaks = np.linspace(0, 1, nbins + 1)
-		for i in range(1, len(breaks)):
-
-			# Identify voxels in the bin
-			layerN = dnorm >= breaks[i - 1] if i == 1 else dnorm > breaks[i - 1]
-			layerN = np.logical_and(layerN, dnorm <= breaks[i])
-			Nvx = np.nansum(layerN.astype('i'))
-			volume_profile.append(Nvx)
-
-			if 0 == Nvx:
-				density_profile.append(np.nan)
-			else:
-				# Build profile
-				numer = np.nansum(dna[layerN]) / Nvx
-				density_profile.append(numer / denom)
+		density, volume = stt.calc_density_profiles(dna, dnorm, nbins)
+		density_profile.extend(density[0].tolist())
+		volume_profile.extend(volume[0].tolist())
 
 		return (np.array(density_profile), np.array(volume_profile))
 
@@ -18,12 +18,15 @@ from skimage.measure import label
 from pygpseq import const
 
 from pygpseq.tools.binarize import Binarize
+from pygpseq.tools.cache import get_channel_cache, MaskCache
 from pygpseq.tools import io as iot
 from pygpseq.tools import image as imt
+from pygpseq.tools import objects
 from pygpseq.tools import plot
 from pygpseq.tools import stat as stt
 from pygpseq.tools import string as st
 from pygpseq.tools import vector as vt
+from pygpseq.tools.trace import traced
 
 from pygpseq.anim.nucleus import Nucleus
 
@@ -41,6 +44,9 @@ class Series(iot.IOinterface):
       dna_bg (float): estimated dna channel background.
       sig_bg (float): estimated signal channel background.
       flist (list): series file info.
+      record (pygpseq.tools.checkpoint.CheckpointRecord): segmentation
+        checkpoint record, loaded at the first access to the nuclei.
+        Backgrounds and number of nuclei are read from its metadata.
     """
 
     __version__ = const.VERSION
@@ -52,6 +58,7 @@ class Series(iot.IOinterface):
     dna_bg = None
     sig_bg = None
     filist = []
+    record = None
 
     def __init__(self, ds, condition = None, **kwargs):
         """Run IOinterface __init__ method.
@@ -59,6 +66,7 @@ class Series(iot.IOinterface):
         Args:
           ds (dict): series information list.
           condition (pyGPSeq.wraps.Condition): condition wrapper (opt).
+          **kwargs: passed to IOinterface if no condition is provided.
         """
 
         # If required, inherit from `condition` wrap
@@ -68,7 +76,7 @@ class Series(iot.IOinterface):
             self.basedir = condition.path
             self.c = condition.name
         else:
-            super(Series, self).__init__()
+            super(Series, self).__init__(**kwargs)
         
         # Save input parameters
         self.name = ds[0]
@@ -124,6 +132,13 @@ class Series(iot.IOinterface):
         # Output
         return((kwargs, log))
 
+    def count_nuclei(self):
+        """Return the number of nuclei, without loading them from the
+        segmentation checkpoint record. """
+        if not type(None) == type(self.record):
+            return(self.record.meta['nnuclei'])
+        return(len(self.nuclei))
+
     def export_nuclei(self, **kwargs):
         """Export current series nuclei. """
 
@@ -138,7 +153,7 @@ class Series(iot.IOinterface):
         kwargs, log = self.adjust_options(**kwargs)
 
         # Export nuclei
-        [n.export(**kwargs) for n in self.nuclei]
+        [n.export(**kwargs) for n in self.get_nuclei()]
         
         # Produce log
         log = np.zeros(len(self.nuclei), dtype = const.DTYPE_NUCLEAR_SUMMARY)
@@ -188,6 +203,7 @@ class Series(iot.IOinterface):
             # Return -1 if no matching channel is found
             return(-1)
 
+    @traced()
     def find_nuclei(self, **kwargs):
         """Segment current series.
 
@@ -247,6 +263,20 @@ class Series(iot.IOinterface):
 
         combineWith2D = not type(None) == type(kwargs['mask2d_folder'])
 
+        # Look for the mask in the segmentation cache
+        cache = None
+        cached = None
+        if not already_segmented and "mask_cache" in kwargs.keys():
+            if not type(None) == type(kwargs['mask_cache']):
+                cache = MaskCache(kwargs['mask_cache'],
+                    kwargs['mask_cache_size'] * 1024**3)
+                rescale = 'rescale_deconvolved' in kwargs.keys()
+                rescale = rescale and kwargs['rescale_deconvolved']
+                ckey = cache.get_key(os.path.join(self.basedir,
+                    self.find_channel(kwargs['dna_names'])[0]), Segmenter,
+                    rescale_deconvolved = rescale)
+                cached = cache.get(ckey)
+
         # Skip or binarize
         if already_segmented:
             log += self.printout("Skipped binarization, using provided mask.",3)
@@ -254,15 +284,22 @@ class Series(iot.IOinterface):
             mask = imt.read_tiff(mpath, 3) != 0 # Read and binarize
             thr = 0
         else:
-            log += self.printout("Binarizing...", 2)
-            (mask, thr, tmp_log) = Segmenter.run(i)
-            log += tmp_log
+            if not type(None) == type(cached):
+                log += self.printout("Skipped binarization, using cached mask.",
+                    3)
+                mask, thr = cached
+            else:
+                log += self.printout("Binarizing...", 2)
+                (mask, thr, tmp_log) = Segmenter.run(i)
+                log += tmp_log
 
-            # Filter based on object size
-            mask, tmp_log = Segmenter.filter_obj_XY_size(mask)
-            log += tmp_log
-            mask, tmp_log = Segmenter.filter_obj_Z_size(mask)
-            log += tmp_log
+                # Filter based on object size
+                mask, tmp_log = Segmenter.filter_obj_size(mask)
+                log += tmp_log
+
+                # Store in the segmentation cache
+                if not type(None) == type(cache):
+                    cache.set(ckey, mask, thr)
 
             if combineWith2D:
                 mask2d_path = os.path.join(kwargs['mask2d_folder'],
@@ -271,7 +308,7 @@ class Series(iot.IOinterface):
                     mask2d = imt.read_tiff(mask2d_path)
 
                     # If labeled, inherit nuclei labels
-                    mask = binarization.combine_2d_mask(mask, mask2d,
+                    mask = Segmenter.combine_2d_mask(mask, mask2d,
                         labeled2d = kwargs['labeled'])
 
         # Estimate background 
@@ -325,12 +362,24 @@ class Series(iot.IOinterface):
         # Initialize nuclei
         log += self.printout('Bounding ' + str(L.max()) + ' nuclei...', 2)
         kwargs['logpath'] = self.logpath
-        kwargs['i'] = i
         kwargs['thr'] = thr
         kwargs['series_id'] = self.n
         kwargs['cond_name'] = self.c
-        seq = range(1, L.max() + 1)
-        self.nuclei = [Nucleus(n = n, mask = L == n, **kwargs) for n in seq]
+
+        # Spill nuclear crops to disk if requested
+        crop_dir = None
+        if "crop_folder" in kwargs.keys():
+            if not type(None) == type(kwargs['crop_folder']):
+                crop_dir = os.path.join(kwargs['crop_folder'], self.c)
+
+        self.nuclei = []
+        measures = objects.measure(L)
+        for (m, (n, box, mask, crops)) in zip(measures, imt.extract_objects(
+            L, kwargs['offset'], [i, sig_ch], measures)):
+            nucleus = Nucleus(n = n, mask = mask, i = crops[0], box = box,
+                measures = m, **kwargs)
+            nucleus.set_crops(mask, crops[0], crops[1], crop_dir)
+            self.nuclei.append(nucleus)
 
         return((self, log))
 
@@ -338,6 +387,7 @@ class Series(iot.IOinterface):
         """Return number of channels in the series. """
         return(len(self.filist))
 
+    @traced()
     def get_channel(self, ch_name, log = None, **kwargs):
         """Read the series specified channel.
 
@@ -354,29 +404,55 @@ class Series(iot.IOinterface):
         if None == log: log = ""
         log += self.printout('Reading channel "' + str(ch_name) + '"...', 2)
 
-        # Read channel
+        # Look for the channel in the cache
         f = self.find_channel(ch_name)
-        imch = imt.read_tiff(os.path.join(self.basedir, f[0]))
-        imch = imt.slice_k_d_img(imch, 3)
+        fpath = os.path.join(self.basedir, f[0])
+        rescale = 'rescale_deconvolved' in kwargs.keys()
+        rescale = rescale and kwargs['rescale_deconvolved']
+        project = kwargs['an_type'] in [const.AN_SUM_PROJ, const.AN_MAX_PROJ]
+        cache = self.get_channel_cache(**kwargs)
+        ckey = cache.get_key(fpath, rescale_deconvolved = rescale,
+            an_type = kwargs['an_type'] if project else None)
+        imch = cache.get(ckey)
+        if not type(None) == type(imch):
+            log += self.printout('Using cached channel...', 3)
+            return((imch, log))
+
+        # Read channel
+        imch = imt.read_tiff(fpath, 3, mmap = True)
 
         # Deconvolved images correction
-        if 'rescale_deconvolved' in kwargs.keys():
-            if kwargs['rescale_deconvolved']:
-                # Get DNA scaling factor and rescale
-                sf = imt.get_rescaling_factor(f[0], **kwargs)
-                imch = (imch / sf).astype('float')
-                msg = 'Rescaling "' + f[0] + '" [' + str(sf) + ']...'
-                log += self.printout(msg, 3)
+        if rescale:
+            # Get DNA scaling factor and rescale
+            sf = imt.get_rescaling_factor(f[0], **kwargs)
+            imch = np.divide(imch, sf, dtype = 'float')
+            msg = 'Rescaling "' + f[0] + '" [' + str(sf) + ']...'
+            log += self.printout(msg, 3)
 
         # Make Z-projection
-        if kwargs['an_type'] in [const.AN_SUM_PROJ, const.AN_MAX_PROJ]:
+        if project:
             msg = 'Generating Z-projection [' + str(kwargs['an_type']) + ']...'
             log += self.printout(msg, 3)
             if 2 != len(imch.shape):
                 imch = imt.mk_z_projection(imch, kwargs['an_type'])
 
         # Prepare output
-        return((imch, log))
+        return((cache.set(ckey, imch), log))
+
+    def get_channel_cache(self, channel_cache_size = None,
+        channel_cache_folder = None, **kwargs):
+        """Return the decoded channel cache of the current process.
+
+        Args:
+          channel_cache_size (float): memory budget, in GiB (opt).
+          channel_cache_folder (string): spill folder (opt).
+
+        Returns:
+          pygpseq.tools.cache.ChannelCache: channel cache.
+        """
+        if not type(None) == type(channel_cache_size):
+            channel_cache_size = channel_cache_size * 1024**3
+        return(get_channel_cache(channel_cache_size, channel_cache_folder))
 
     def get_channel_names(self, channel_field = None):
         """Return the names of the channels in the series. """
@@ -384,32 +460,87 @@ class Series(iot.IOinterface):
             channel_field = const.REG_CHANNEL_NAME
         return([c[channel_field] for c in self.filist.values()])
 
+    def get_checkpoint_meta(self):
+        """Segmentation checkpoint metadata: backgrounds and number of
+        nuclei, see set_record. """
+        f = lambda bg: bg if type(None) == type(bg) else float(bg)
+        return({'dna_bg' : f(self.dna_bg), 'sig_bg' : f(self.sig_bg),
+            'nnuclei' : len(self.get_nuclei())})
+
+    def get_descriptor(self, nuclei_ids = None):
+        """Describe the series with the information needed to segment or
+        analyze it in a worker process, without the parent condition.
+
+        Args:
+          nuclei_ids (list[int]): ids of the nuclei to include (opt, def: all).
+
+        Returns:
+          dict: series descriptor, see from_descriptor.
+        """
+
+        if type(None) == type(nuclei_ids):
+            nuclei = list(self.get_nuclei())
+        else:
+            nuclei = dict([(n.n, n) for n in self.get_nuclei()])
+            nuclei = [nuclei[nid] for nid in nuclei_ids]
+
+        return({'ds' : [self.name, self.filist, self.n],
+            'basedir' : self.basedir, 'c' : self.c, 'logpath' : self.logpath,
+            'verbose' : self.verbose, 'dna_bg' : self.dna_bg,
+            'sig_bg' : self.sig_bg, 'nuclei' : nuclei})
+
+    def get_nuclei(self):
+        """Return the series nuclei, loading them from the segmentation
+        checkpoint record if not done yet. """
+
+        if not type(None) == type(self.record):
+            d = self.record.load()
+            self.dna_bg = d['dna_bg']
+            self.sig_bg = d['sig_bg']
+            self.nuclei = d['nuclei']
+            self.record = None
+            for param in const.PARAM_PROPAGATE:
+                self.propagate_attr(param)
+
+        return(self.nuclei)
+
+    @traced()
     def get_nuclei_data(self, nuclei_ids, **kwargs):
-        """Retrieve a single nucleus from the current series. """
+        """Retrieve nuclear data from the crops stored at segmentation.
 
-        # Read channel images
-        kwargs, log = self.adjust_options(**kwargs)
+        Args:
+          nuclei_ids (list[int]): ids of the nuclei to retrieve.
+          **kwargs
+
+        Returns:
+          tuple: nuclear data, density/volume profiles and log string.
+        """
+
+        log = ""
 
-        # Re-build mask
-        bi = Binarize(path = self.logpath, append = True, **kwargs)
-        bi.verbose = self.verbose
-        mask, thr, tmp_log = bi.run(kwargs['dna_ch'].copy())
-        log += tmp_log
+        # Nuclei segmented without crops require the full field
+        if any([type(None) == type(n.crops) for n in self.nuclei]):
+            kwargs, log = self.adjust_options(**kwargs)
+            bi = Binarize(path = self.logpath, append = True, **kwargs)
+            bi.verbose = self.verbose
+            kwargs['mask'], thr, tmp_log = bi.run(kwargs['dna_ch'].copy())
+            log += tmp_log
 
         # Empty nuclear data array
         data = []
         density_profile = []
         volume_profile = []
+        nuclei = dict([(n.n, n) for n in self.nuclei])
         for nucleus_id in nuclei_ids:
             # Select nucleus
-            n = self.nuclei[nucleus_id -1]
+            n = nuclei[nucleus_id]
 
             # Setup nucleus instance verbosity
             if not self.verbose:
                 n.verbose = False
 
             # Retrieve nuclear data
-            ndata, dp_tmp, vp_tmp, nlog = n.get_data(mask = mask, **kwargs)
+            ndata, dp_tmp, vp_tmp, nlog = n.get_data(**kwargs)
 
             # Update log and save nuclear data
             log += nlog
@@ -424,6 +555,45 @@ class Series(iot.IOinterface):
         for i in range(len(self.nuclei)):
             self.nuclei[i][key] = self[key]
 
+    def set_record(self, record):
+        """Set the segmentation checkpoint record, loaded at the first access
+        to the nuclei. Backgrounds are restored from the record metadata, or
+        from the record itself if it has no metadata.
+
+        Args:
+          record (pygpseq.tools.checkpoint.CheckpointRecord): record.
+        """
+
+        self.record = record
+        meta = record.meta
+        if not all([k in meta.keys() for k in ['dna_bg', 'sig_bg', 'nnuclei']]):
+            self.get_nuclei()
+            return
+
+        self.dna_bg = meta['dna_bg']
+        self.sig_bg = meta['sig_bg']
+
+# FUNCTIONS ====================================================================
+
+def from_descriptor(d):
+    """Rebuild a series from its descriptor.
+
+    Args:
+      d (dict): series descriptor, see Series.get_descriptor.
+
+    Returns:
+      pygpseq.anim.Series: series instance.
+    """
+
+    s = Series(d['ds'], path = d['logpath'], append = True)
+    s.basedir = d['basedir']
+    s.c = d['c']
+    s.verbose = d['verbose']
+    s.dna_bg = d['dna_bg']
+    s.sig_bg = d['sig_bg']
+    s.nuclei = d['nuclei']
+    return(s)
+
 # END ==========================================================================
 
 ################################################################################
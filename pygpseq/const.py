@@ -40,7 +40,9 @@ _const.KWARGS_AVOIDLIST = ('conds')
 
 # Step-related main() class parameters
 _const.PARAM_STATIC = ('basedir', 'cdescr', 'debugging', 'font_size', 'logpath',
-	'ncores', 'notes', 'outdir', 'plotting', 'skip', 'suffix', 'verbose')
+	'ncores', 'notes', 'outdir', 'plotting', 'skip', 'suffix', 'timing', 'trace',
+	'verbose')
+_const.PARAM_INST = ('basedir', 'dna_names', 'ext', 'reg', 'sig_names')
 _const.PARAM_SEG = ('adp_thr', 'calc_n_surface', 'dna_names', 'ext',
 	'min_z_size', 'seg_type', 'sig_names', 'offset', 'radius_interval', 'reg',
 	'rescale_deconvolved', 'rm_z_tips', 'seg_type', 'sig_names')
@@ -48,6 +50,12 @@ _const.PARAM_AN = ('an_type', 'aspect', 'nbins', 'normalize_distance', 'nsf',
 	'part_n_erosion', 'sigma_smooth', 'sigma_density')
 _const.PARAM_PROPAGATE = ('logpath',)
 
+# Binarize parameters affecting the segmentation masks
+_const.PARAM_BINARIZE = ('adp_closing', 'adp_method', 'adp_mode', 'adp_neigh',
+	'an_type', 'do_adaptive_thr', 'do_clear_borders', 'do_clear_Z_borders',
+	'do_fill_holes', 'do_global_thr', 'min_z_size', 'radius_interval',
+	'seg_type')
+
 # Analysis-related -------------------------------------------------------------
 
 # Series regexp fields
@@ -154,6 +162,18 @@ _const.OUTDIR_PNG_REPORT = _const.OUTDIR_PNG + 'report/'
 _const.OUTDIR_TIF = 'out_tif/'
 _const.OUTDIR_DEBUG = 'debugging/'
 
+# Default segmentation mask cache folder
+_const.MASK_CACHE_DEFAULT = '~/.cache/pygpseq/masks/'
+
+# Segmentation mask cache schema version, part of every mask key.
+# Bump it whenever the segmentation output changes for the same settings.
+# 2: local thresholds of integer images are not truncated anymore.
+_const.MASK_CACHE_VERSION = 2
+
+# Environment variable with the span folder of the traced run, inherited by
+# worker processes
+_const.TRACE_ENV = 'PYGPSEQ_TRACE_DIR'
+
 # Plot-related------------------------------------------------------------------
 
 # Plot constants
@@ -15,9 +15,11 @@ from scipy.interpolate import RegularGridInterpolator
 from scipy.ndimage.morphology import distance_transform_edt
 
 from pygpseq.tools import distance as dist, image as imt, stat as stt
+from pygpseq.tools.trace import traced
 
 # FUNCTIONS ====================================================================
 
+@traced()
 def add_allele(data):
 	'''
 	Add allele labels to DOTTER-based table with GPSeq-like centrality.
@@ -107,6 +109,7 @@ def add_allele(data):
 	data.loc[validIdx, 'Allele'] = subt['Allele']
 	return(data)
 
+@traced()
 def add_allele_polarity(t, nuclei, aspect):
 	'''Add inter-homologous angle in respect to the nucleus center of mass
 	for homologous couples.
@@ -179,6 +182,7 @@ def add_allele_polarity(t, nuclei, aspect):
 
 	return(t)
 
+@traced()
 def calc_dot_distances(msg, t, nuclei, aspect, dist_type,
 	discard_dilation_mode = False):
 	'''
@@ -252,6 +256,7 @@ def calc_dot_distances(msg, t, nuclei, aspect, dist_type,
 	# Output
 	return((t, msg))
 
+@traced()
 def dots2cells(t, nuclei, dilate_factor):
 	'''
 	Assign dots to cells
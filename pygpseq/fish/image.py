@@ -18,18 +18,22 @@ from pygpseq.fish import dot
 from pygpseq.fish import nucleus
 
 from pygpseq.tools import Binarize
+from pygpseq.tools.cache import MaskCache
 from pygpseq.tools import image as imt
 from pygpseq.tools.io import IOinterface, printout
 from pygpseq.tools import plot
+from pygpseq.tools.trace import traced
 
 # FUNCTIONS ====================================================================
 
+@traced()
 def analyze_field_of_view(sid, data, im2fov, dilate_factor, istruct, aspect,
     mask_dir, mask_prefix, plotCompartments, pole_fraction,
     outdir, noplot, labeled, compressed, dist_type, nbins,
     discard_dilation_mode,
     an_type, seg_type, # Required by the Binarize class
-    mask2d_dir = None, verbose = False, debug = False, debug_dir = ""):
+    mask2d_dir = None, verbose = False, debug = False, debug_dir = "",
+    mask_cache = None, mask_cache_size = None):
     '''Given a table with FISH data, add information on:
         - lamin/center absolute/normalized distance
         - angle between homogue pairs
@@ -57,6 +61,8 @@ def analyze_field_of_view(sid, data, im2fov, dilate_factor, istruct, aspect,
         seg_type
         verbose (bool): display action log.
         debug (bool): debugging mode.
+        mask_cache (string): path to segmentation mask cache folder.
+        mask_cache_size (float): maximum mask cache size, in GiB.
     '''
 
     # ASSERT ===================================================================
@@ -77,7 +83,7 @@ def analyze_field_of_view(sid, data, im2fov, dilate_factor, istruct, aspect,
 
     # Read image
     msg += printout("Reading image ...", 2, v)
-    im = imt.read_tiff(im2fov[sid], k = 3, rescale = sf)
+    im = imt.read_tiff(im2fov[sid], k = 3, rescale = sf, mmap = True)
     if type(None) == type(im):
         return(None)
 
@@ -112,14 +118,29 @@ def analyze_field_of_view(sid, data, im2fov, dilate_factor, istruct, aspect,
             thr = 0
             already_segmented = type(None) != type(imbin)
     
+    # Look for the mask in the segmentation cache
+    cached = None
+    if not already_segmented and not type(None) == type(mask_cache):
+        if None == mask_cache_size: mask_cache_size = 4.
+        cache = MaskCache(mask_cache, mask_cache_size * 1024**3)
+        ckey = cache.get_key(im2fov[sid], Segmenter, rescale = sf)
+        cached = cache.get(ckey)
+
     if not already_segmented:
-        msg += printout("Binarizing...", 2, v)
-        (imbin, thr, log) = Segmenter.run(im)
-        msg += log
+        if not type(None) == type(cached):
+            msg += printout("Skipped binarization, using cached mask.", 3, v)
+            imbin, thr = cached
+        else:
+            msg += printout("Binarizing...", 2, v)
+            (imbin, thr, log) = Segmenter.run(im)
+            msg += log
+
+            # Filter based on object size
+            imbin, tmp = Segmenter.filter_obj_size(imbin)
 
-        # Filter based on object size
-        imbin, tmp = Segmenter.filter_obj_XY_size(imbin)
-        imbin, tmp = Segmenter.filter_obj_Z_size(imbin)
+            # Store in the segmentation cache
+            if not type(None) == type(mask_cache):
+                cache.set(ckey, imbin, thr)
 
         if not type(None) == type(mask2d_dir):
             mask2d_path = os.path.join(mask2d_dir,
@@ -15,6 +15,7 @@ import math
 import numpy as np
 import os
 import pandas as pd
+from scipy import ndimage as ndi
 from skimage import draw
 import skimage.io as io
 from skimage.morphology import dilation
@@ -22,11 +23,13 @@ import warnings
 
 from pygpseq import const
 from pygpseq.anim import Nucleus
-from pygpseq.tools import image as imt, plot
+from pygpseq.tools import image as imt, objects, plot
 from pygpseq.tools import distance as dist, stat as stt
+from pygpseq.tools.trace import traced
 
 # FUNCTIONS ====================================================================
 
+@traced()
 def annotate_compartments(msg, t, nuclei, outdir, pole_fraction, aspect):
 	'''
 	Add compartment status to dots table (by DOTTER).
@@ -282,6 +285,7 @@ def annotate_compartments(msg, t, nuclei, outdir, pole_fraction, aspect):
 
 	return((t, vcomp_table, msg))
 
+@traced()
 def build_nuclei(msg, L, dilate_factor, series_id, thr, dna_bg, sig_bg,
 	aspect, offset, logpath, i, istruct, discard_dilation_mode,
 	dist_type = const.LD_ARG_LABELS[const.LD_DEFAULT],
@@ -313,7 +317,7 @@ def build_nuclei(msg, L, dilate_factor, series_id, thr, dna_bg, sig_bg,
 		'series_id' : series_id, 'thr' : thr,
 		'dna_bg' : dna_bg, 'sig_bg' : sig_bg,
 		'aspect' : aspect, 'offset' : offset,
-		'logpath' : logpath, 'i' : i
+		'logpath' : logpath
 	}
 
 	# Default nuclear ID list and empty dictionary
@@ -326,24 +330,42 @@ def build_nuclei(msg, L, dilate_factor, series_id, thr, dna_bg, sig_bg,
 	if 0 != dilate_factor: msg += " with dilation [%d]" % dilate_factor
 	msg += "...\n"
 
-	# Iterate through nuclei
-	for n in range(1, L.max() + 1):
-		if 0 == np.sum((L == n).astype(int)): continue
+	# Box offset and dilation margin, for every dimension
+	offset = list(offset)
+	if len(offset) != len(L.shape):
+		offset = [offset[0] for d in L.shape]
+	margin = [0 for d in L.shape]
+	if 0 != dilate_factor:
+		margin = [int(d // 2) for d in istruct.shape]
 
-		original_mask = L == n
+	# Iterate through nuclei, measured once
+	for m in objects.measure(L):
+		n = int(m['label'])
+
+		# Crop nucleus, with room for dilation and box offset
+		crop = tuple([slice(max(0, b[0] - o - d), min(s, b[1] + o + d + 1))
+			for (b, o, d, s) in zip(m['box'], offset, margin, L.shape)])
+		original_mask = L[crop] == n
 
 		# Make nucleus
 		if 0 != dilate_factor:
 			# With dilated mask
-			mask = dilation(L == n, istruct)
+			mask = dilation(original_mask, istruct)
 		else:
-			mask = L == n
-		nucleus = Nucleus(n = n, mask = mask, **kwargs)
+			mask = original_mask
 
 		# Apply box
 		msg += "    > Applying nuclear box [%d]...\n" % (n,)
-		mask = imt.apply_box(mask, nucleus.box)
-		original_mask = imt.apply_box(original_mask, nucleus.box)
+		box = [(int(max(0, c.start + b.start - o)),
+			int(min(s - 1, c.start + b.stop - 1 + o)))
+			for (b, c, o, s) in zip(ndi.find_objects(mask.astype('u1'))[0],
+			crop, offset, L.shape)]
+		sl = tuple([slice(b[0] - c.start, b[1] - c.start + 1)
+			for (b, c) in zip(box, crop)])
+		mask = mask[sl].copy()
+		original_mask = original_mask[sl].copy()
+		nucleus = Nucleus(n = n, mask = mask, i = imt.apply_box(i, box),
+			box = box, measures = m if 0 == dilate_factor else None, **kwargs)
 
 		# Store nucleus
 		nucleus.mask = mask
@@ -396,6 +418,7 @@ def build_nuclei(msg, L, dilate_factor, series_id, thr, dna_bg, sig_bg,
 
 	return((msg, curnuclei, dp, nv))
 
+@traced()
 def flag_G1_cells(t, nuclei, outdir, dilate_factor, dot_file_name):
 	'''
 	Assign a binary flag identifying the predominant cell population
@@ -12,8 +12,12 @@
 __all__ = ['matplotlib', 'numpy', 'scipy', 'skimage', 'tifffile']
 
 from pygpseq.tools.binarize import Binarize
-from pygpseq.tools import chromab, distance, image, io, path, plot, stat
-from pygpseq.tools import string, vector
+from pygpseq.tools.accumulator import ProfileAccumulator
+from pygpseq.tools.store import PixelStore
+from pygpseq.tools.checkpoint import CheckpointStore
+from pygpseq.tools import cache, checkpoint, chromab, distance, image, io
+from pygpseq.tools import objects, parallel, path, plot, stat, string, trace
+from pygpseq.tools import tiles, vector
 
 # END ==========================================================================
 
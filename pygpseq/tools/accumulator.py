@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: mergeable accumulator of binned profile statistics.
+'''
+
+# DEPENDENCIES =================================================================
+
+import numpy as np
+
+from pygpseq.tools import stat as stt
+
+# CONSTANTS ====================================================================
+
+# Sketch bucket codes: negative values, exact integers, positive values
+SKETCH_NEG = 0
+SKETCH_EXACT = 1
+SKETCH_POS = 2
+
+# Largest absolute integer stored exactly in the sketch
+SKETCH_EXACT_MAX = 2**10
+
+# CLASSES ======================================================================
+
+class ProfileAccumulator(object):
+    """Mergeable accumulator of binned profile statistics.
+    Points are assigned to the bins of np.linspace(0, xmax, nbins), as in
+    stat.binned_profile. Count, mean, sum of squared deviations and max are
+    tracked exactly per bin. Median, mode and boxplot statistics (see
+    get_box_stats) are calculated from a per-bin quantile sketch, with
+    logarithmically spaced buckets as in DDSketch. Integers within
+    +/-SKETCH_EXACT_MAX are stored exactly, every other value is replaced by
+    the representative value of its bucket, within a relative error of
+    rel_err. Hence, the bound holds for every bin independently of the
+    other values (e.g., outliers) and for negative values too.
+    Medians and quartiles are within rel_err of the exact ones. Modes are
+    calculated on the same per-bin breaks as stat.binned_mode (i.e., from
+    0 to the exact bin max), and are exact unless a point lies within
+    rel_err of a break. NaN y are skipped.
+    Only the occupied buckets are kept, so memory use grows with the
+    logarithm of the range of the values, not with their number.
+
+    Attributes:
+      nbins (int): curve precision.
+      rel_err (float): relative error of the sketch.
+      breaks (np.ndarray): profile bin breaks.
+      n (np.ndarray): number of points per bin.
+      mean (np.ndarray): mean per bin.
+      m2 (np.ndarray): sum of squared deviations from the mean per bin.
+      ymax (np.ndarray): max per bin.
+      keys (np.ndarray): sorted occupied sketch buckets, see get_keys.
+      counts (np.ndarray): number of points per occupied sketch bucket.
+    """
+
+    nbins = 200
+    rel_err = .001
+    breaks = None
+    n = None
+    mean = None
+    m2 = None
+    ymax = None
+    keys = None
+    counts = None
+
+    def __init__(self, xmax, nbins = None, rel_err = None):
+        """
+        Args:
+          xmax (float): upper bound of the profile domain.
+          nbins (int): curve precision (opt, def: 200).
+          rel_err (float): relative error of the sketch (opt, def: .001).
+        """
+
+        if not type(None) == type(nbins):
+            self.nbins = nbins
+        if not type(None) == type(rel_err):
+            assert_msg = 'relative error in (0, 1) expected.'
+            assert 0 < rel_err and 1 > rel_err, assert_msg
+            self.rel_err = rel_err
+
+        # An extra bin for points at xmax, as np.digitize does
+        self.breaks = np.linspace(0, xmax, self.nbins)
+        nb = self.nbins + 1
+        self.n = np.zeros(nb, dtype = 'i8')
+        self.mean = np.zeros(nb)
+        self.m2 = np.zeros(nb)
+        self.ymax = np.zeros(nb)
+        self.keys = np.zeros(0, dtype = 'i8')
+        self.counts = np.zeros(0, dtype = 'i8')
+
+    def add_moments(self, n, mean, m2, ymax):
+        """Merge per-bin moments into the accumulator. """
+
+        tot = self.n + n
+        sel = tot != 0
+        delta = mean[sel] - self.mean[sel]
+        self.m2[sel] += m2[sel] + delta**2 * self.n[sel] * n[sel] / tot[sel]
+        self.mean[sel] += delta * n[sel] / tot[sel]
+        self.ymax[sel] = np.where(0 == self.n[sel], ymax[sel],
+            np.maximum(self.ymax[sel], ymax[sel]))
+        self.n = tot
+
+    def add_sketch(self, keys, counts):
+        """Merge sketch buckets into the accumulator.
+
+        Args:
+          keys (np.ndarray): sketch buckets, see get_keys.
+          counts (np.ndarray): number of points per bucket.
+        """
+        keys, idx = np.unique(np.concatenate([self.keys, keys]),
+            return_inverse = True)
+        self.counts = np.bincount(idx.ravel(),
+            np.concatenate([self.counts, counts]),
+            keys.shape[0]).astype('i8')
+        self.keys = keys
+
+    def get_bin(self, b = None):
+        """Sketch of a profile bin, or of every point.
+
+        Args:
+          b (int): profile bin (opt, def: every point).
+
+        Returns:
+          tuple: sorted representative values and their number of points.
+        """
+
+        # Keys are sorted by profile bin first
+        sel = slice(None)
+        if not type(None) == type(b):
+            sel = slice(*np.searchsorted(self.keys,
+                [(3 * b) << 32, (3 * (b + 1)) << 32]))
+        values = self.get_values(self.keys[sel])
+        counts = self.counts[sel]
+
+        # Merge the same buckets of different bins, then sort by value
+        values, idx = np.unique(values, return_inverse = True)
+        counts = np.bincount(idx.ravel(), counts,
+            values.shape[0]).astype('i8')
+        return((values, counts))
+
+    def get_box_stats(self, b = None, whis = None, max_fliers = None,
+        seed = None):
+        """Boxplot statistics of a profile bin, or of every point, as
+        accepted by matplotlib Axes.bxp. Quartiles, whiskers and outliers
+        are calculated from the sketch, within its relative error.
+        Outliers are capped to a random sample.
+
+        Args:
+          b (int): profile bin (opt, def: every point).
+          whis (float): whisker reach, in IQR units (opt, def: 1.5).
+          max_fliers (int): maximum number of outliers (opt, def: 1000).
+          seed (int): outlier sampling seed (opt, def: 0).
+
+        Returns:
+          dict: boxplot statistics.
+        """
+
+        if None == whis:
+            whis = 1.5
+
+        # Select bin
+        if type(None) == type(b):
+            n = self.n.sum()
+            mean = (self.mean * self.n).sum() / n if 0 != n else np.nan
+        else:
+            n = self.n[b]
+            mean = self.mean[b] if 0 != n else np.nan
+        if 0 == n:
+            return(stt.box_stats([]))
+        values, counts = self.get_bin(b)
+
+        # Quartiles, with linear interpolation between order statistics
+        q1 = sketch_quantile(values, counts, .25)
+        q3 = sketch_quantile(values, counts, .75)
+        stats = {'n' : int(n), 'mean' : mean, 'q1' : q1, 'q3' : q3,
+            'med' : sketch_quantile(values, counts, .5), 'iqr' : q3 - q1}
+
+        # Whiskers, at the farthest values within reach
+        inside = values[np.logical_and(values >= q1 - whis * stats['iqr'],
+            values <= q3 + whis * stats['iqr'])]
+        stats['whislo'] = inside.min() if 0 != inside.shape[0] else q1
+        stats['whishi'] = inside.max() if 0 != inside.shape[0] else q3
+
+        # Outliers
+        out = np.logical_or(values < stats['whislo'],
+            values > stats['whishi'])
+        stats['fliers'] = stt.sample_counts(values[out], counts[out],
+            max_fliers, seed)
+
+        return(stats)
+
+    def get_keys(self, bins, y):
+        """Sketch buckets of points. Every key packs the profile bin, the
+        bucket code (SKETCH_NEG, SKETCH_EXACT or SKETCH_POS) and the bucket
+        index: the value itself for exact integers, otherwise the index i
+        of the (gamma**(i - 1), gamma**i] bucket of the absolute value.
+
+        Args:
+          bins (np.ndarray): profile bin of every point.
+          y (np.ndarray): y coordinates, not NaN.
+
+        Returns:
+          np.ndarray: sketch bucket of every point.
+        """
+
+        y = np.asarray(y, dtype = 'float')
+        exact = np.logical_and(y == np.round(y),
+            np.absolute(y) <= SKETCH_EXACT_MAX)
+        codes = np.where(exact, SKETCH_EXACT,
+            np.where(y < 0, SKETCH_NEG, SKETCH_POS))
+
+        idx = np.round(y)
+        with np.errstate(divide = 'ignore'):
+            logy = np.log(np.absolute(y[np.logical_not(exact)]))
+        idx[np.logical_not(exact)] = np.ceil(logy / np.log(self.get_gamma()))
+        idx = np.clip(idx, -2**31 + 1, 2**31 - 1).astype('i8')
+
+        return(((bins.astype('i8') * 3 + codes) << 32) + idx + 2**31)
+
+    def get_gamma(self):
+        """Ratio between consecutive sketch bucket bounds. """
+        return((1 + self.rel_err) / (1 - self.rel_err))
+
+    def get_mode(self, b):
+        """Binned mode of a profile bin, as stat.binned_mode does. """
+
+        values, counts = self.get_bin(b)
+
+        # Bin breaks
+        breaks = np.linspace(0, self.ymax[b], self.nbins)
+
+        # Count bins occurrences
+        counts = np.bincount(np.digitize(values, breaks), counts,
+            self.nbins + 1)
+        occ = np.where(0 != counts)[0]
+        counts = counts[occ]
+
+        # Order counts
+        ordered = np.argsort(counts).tolist()
+        ordered.reverse()
+
+        # Return mode
+        return(breaks[occ[ordered[0]] - 1])
+
+    def get_profile(self):
+        """Calculate the binned profile, with the same format and bins as
+        stat.binned_profile. """
+
+        # Get mean and median for every bin
+        data = np.zeros((self.nbins,),
+            dtype = [('breaks', 'f'), ('mean', 'f'), ('median', 'f'),
+            ('std', 'f'), ('mode', 'f'), ('max', 'f'), ('mean_raw', 'f'),
+            ('median_raw', 'f'), ('std_raw', 'f'), ('mode_raw', 'f'),
+            ('max_raw', 'f'), ('n', 'f')])
+
+        # Only bins lower than the last occupied one are reported
+        nb = np.where(0 != self.n)[0]
+        if 0 == nb.shape[0]:
+            return(data)
+        nb = min(nb.max(), self.nbins)
+        data['breaks'][:nb] = self.breaks[:nb]
+        for field in ['mean', 'median', 'mode', 'std', 'max']:
+            data[field][:nb] = np.nan
+
+        sel = np.where(0 != self.n[:nb])[0]
+        n = self.n[sel]
+        data['mean'][sel] = self.mean[sel]
+        data['std'][sel] = np.sqrt(self.m2[sel] / n)
+        data['max'][sel] = self.ymax[sel]
+        data['n'][sel] = n
+
+        # Medians and binned modes from the sketch
+        for b in sel:
+            values, counts = self.get_bin(b)
+            cum = np.cumsum(counts)
+            lo = values[np.searchsorted(cum, (cum[-1] - 1) // 2, 'right')]
+            hi = values[np.searchsorted(cum, cum[-1] // 2, 'right')]
+            data['median'][b] = lo if 1 == cum[-1] % 2 else (lo + hi) / 2.
+            data['mode'][b] = self.get_mode(b)
+
+        # Output
+        return(data)
+
+    def get_values(self, keys):
+        """Representative value of sketch buckets, see get_keys. Bucket
+        (gamma**(i - 1), gamma**i] is represented by 2 * gamma**i /
+        (gamma + 1), within rel_err of any value in it. """
+
+        codes = (keys >> 32) % 3
+        idx = (keys & (2**32 - 1)) - 2**31
+        values = idx.astype('float')
+
+        logs = codes != SKETCH_EXACT
+        gamma = self.get_gamma()
+        with np.errstate(over = 'ignore'):
+            values[logs] = 2 * gamma**idx[logs] / (gamma + 1)
+        values[codes == SKETCH_NEG] *= -1
+        return(values)
+
+    def merge(self, other):
+        """Merge another accumulator, with the same bins, into this one.
+
+        Args:
+          other (ProfileAccumulator): accumulator to merge.
+
+        Returns:
+          ProfileAccumulator: this accumulator.
+        """
+
+        assert_msg = 'cannot merge accumulators with different bins.'
+        assert np.array_equal(self.breaks, other.breaks), assert_msg
+        assert self.rel_err == other.rel_err, assert_msg
+
+        self.add_sketch(other.keys, other.counts)
+        self.add_moments(other.n, other.mean, other.m2, other.ymax)
+        return(self)
+
+    def update(self, x, y):
+        """Add points to the accumulator.
+
+        Args:
+          x (np.ndarray): x coordinates.
+          y (np.ndarray): y coordinates.
+
+        Returns:
+          ProfileAccumulator: this accumulator.
+        """
+
+        x = np.asarray(x)
+        y = np.asarray(y)
+        if 'f' == y.dtype.kind:
+            x = x[np.logical_not(np.isnan(y))]
+            y = y[np.logical_not(np.isnan(y))]
+        if 0 == y.shape[0]:
+            return(self)
+
+        # Assign data to the bins
+        nb = self.nbins + 1
+        assigned_bins = np.digitize(x, self.breaks)
+
+        # Per-bin moments of the new points
+        n = np.bincount(assigned_bins, minlength = nb)
+        mean = np.bincount(assigned_bins, weights = y, minlength = nb)
+        mean[n != 0] /= n[n != 0]
+        m2 = np.bincount(assigned_bins,
+            weights = (y - mean[assigned_bins])**2, minlength = nb)
+        ymax = np.full(nb, -np.inf)
+        np.maximum.at(ymax, assigned_bins, y)
+        self.add_moments(n, mean, m2, ymax)
+
+        # Sketch
+        keys, counts = np.unique(self.get_keys(assigned_bins, y),
+            return_counts = True)
+        self.add_sketch(keys, counts)
+
+        return(self)
+
+# FUNCTIONS ====================================================================
+
+def sketch_quantile(values, counts, q):
+    """Quantile of sketched data, with linear interpolation between order
+    statistics as in np.percentile.
+
+    Args:
+      values (np.ndarray): sorted representative value of every bucket.
+      counts (np.ndarray): number of points per bucket.
+      q (float): quantile, in [0, 1].
+
+    Returns:
+      float: quantile.
+    """
+    cum = np.cumsum(counts)
+    pos = (cum[-1] - 1) * q
+    lo = values[np.searchsorted(cum, int(np.floor(pos)), 'right')]
+    hi = values[np.searchsorted(cum, int(np.ceil(pos)), 'right')]
+    return(lo + (hi - lo) * (pos - np.floor(pos)))
+
+# END ==========================================================================
+
+################################################################################
@@ -11,6 +11,7 @@
 import math
 
 import numpy as np
+from scipy import ndimage as ndi
 from skimage.filters import threshold_otsu
 from skimage.measure import label
 
@@ -18,8 +19,10 @@ from pygpseq import const
 
 from pygpseq.tools import image as imt
 from pygpseq.tools import io as iot
+from pygpseq.tools import objects
 from pygpseq.tools import stat as stt
-from pygpseq.tools import vector as vt
+from pygpseq.tools import tiles
+from pygpseq.tools.trace import traced
 
 # CLASSES ======================================================================
 
@@ -40,11 +43,14 @@ class Binarize(iot.IOinterface):
       adp_method (str): local threshold method.
       adp_mode (str): local threshold border mode.
       adp_closing (bool): perform closing operation adter adaptive threshold.
+      adp_threads (int): number of threads for the per-slice local threshold.
       do_clear_borders (bool): True to remove objects touching the borders.
       do_clear_Z_borders (bool): True to remove objects touching Z borders.
       do_fill_holes (bool): True to fill holes (both 2D and 3D).
       radius_interval (tuple[float]): object radius interval.
       min_z_size (float): minimum Z (relative) size of the objects.
+      tile_size (int): XY tile side in px, to binarize one tile at a time
+                       (None to binarize the whole image at once).
     """
 
     an_type = 0
@@ -55,11 +61,13 @@ class Binarize(iot.IOinterface):
     adp_method = 'gaussian'
     adp_mode = 'constant'
     adp_closing = True
+    adp_threads = 1
     do_clear_borders = True
     do_clear_Z_borders = False
     do_fill_holes = True
     radius_interval = (10., float('inf'))
     min_z_size = .25
+    tile_size = None
 
     def __init__(self, **kwargs):
         """Initialize binarization settings all at once with kwargs.
@@ -107,7 +115,14 @@ class Binarize(iot.IOinterface):
             assert_msg = 'boolean expected, got "%s".' % type(value)
             assert type(True) == type(value), assert_msg
 
-        elif name == 'adp_neigh':
+        elif name == 'tile_size':
+            # Require int or None
+            assert_msg = 'int or None expected, got "%s".' % type(value)
+            assert type(value) in [type(0), type(None)], assert_msg
+            if not type(None) == type(value):
+                assert 0 < value, 'positive tile size expected.'
+
+        elif name in ['adp_neigh', 'adp_threads']:
             # Require int
             assert_msg = 'int expected, got "%s".' % type(value)
             assert type(0) == type(value), assert_msg
@@ -125,91 +140,6 @@ class Binarize(iot.IOinterface):
             assert value in seg_types, "got '%s', expected one of %s." % (
                 str(value), str(seg_types))
     
-    def filter_obj_XY_size(self, mask):
-        """Filter objects XY size.
-        Uses self.radius_interval to filter the objects in the provided mask
-        based on the selected segmentation type.
-
-        Args:
-          mask (np.array): binary image
-
-        Returns:
-          tuple: filtered binary image and log string
-        """
-
-        # Start logging
-        log = ''
-        log += self.printout('Filtering objects XY size...', 2)
-
-        # From radius to size
-        sinter = stt.r_to_size(self.radius_interval, self.seg_type)
-        log += self.printout('Allowed size interval: [%.2f, %.2f] [%s]' % (
-            sinter[0], sinter[1], imt.get_unit(mask.shape)), 3)
-
-        # Identify objects XY size
-        log += self.printout('Retrieving objects XY size...', 3)
-        L = label(mask)
-        xysizes = imt.get_objects_xysize(L)
-        log += self.printout('Found %d objects.' % L.max(), 4)
-        
-        # Select objects to be discarded
-        torm = np.logical_or(xysizes < sinter[0], xysizes > sinter[1])
-        torm = [ii for ii, x in enumerate(torm) if x]
-        log += self.printout('Discarding %d objects.' % len(torm), 3)
-
-        # Remove objects outside of size interval
-        mask = vt.rm_from_mask(L, torm)
-
-        # Output
-        return((mask, log))
-
-    def filter_obj_Z_size(self, mask):
-        """Filter objects Z size.
-        Uses self.min_z_size to filter the objects in the provided mask.
-
-        Args:
-          mask (np.array): binary image
-
-        Returns:
-          tuple: filtered binary image and log string
-        """
-
-        # Start logging
-        log = ''
-        log += self.printout('Filtering objects Z size...', 2)
-
-        # If not a stack, return the mask
-        if 3 > len(mask.shape): return((mask, log))
-
-        # Check provided conditions
-        doFilterZsize = 0 != int(math.ceil(self.min_z_size))
-        doFilterZsize = doFilterZsize and self.an_type == const.AN_3D
-        if not doFilterZsize: return((mask, log))
-
-        # From size to number of slices
-        if self.min_z_size > 1:
-            self.min_z_size = int(math.ceil(self.min_z_size))
-        else:
-            self.min_z_size = self.min_z_size * mask.shape[0]
-            self.min_z_size = int(math.ceil(self.min_z_size))
-        log += self.printout('Minimum %d slices.' % self.min_z_size, 3)
-
-        # Identify objects Z size
-        log += self.printout('Retrieving objects Z size...', 3)
-        L = label(mask)
-        log += self.printout('Found %d objects.' % L.max(), 4)
-        
-        # Select objects to be discarded
-        torm = np.array(imt.get_objects_zsize(L)) < self.min_z_size
-        torm = [ii for ii, x in enumerate(torm) if x]
-        log += self.printout('Discarding %d objects.' % len(torm), 3)
-
-        # Remove objects lower than minimum size
-        mask = vt.rm_from_mask(L, torm)
-
-        # Output
-        return((mask, log))
-
     def combine_2d_mask(self, maskND, mask2D, labeled2d = False):
         """Applies a 2D mask to another one (either 2D or 3D).
         Nothing is done if the major mask is not 2/3D.
@@ -242,6 +172,114 @@ class Binarize(iot.IOinterface):
 
         return(maskND)
 
+    def get_tile_halo(self):
+        """Calculate the tile overlap needed to binarize one tile at a time,
+        as the reach of the neighbourhood operations of run: adaptive
+        threshold filter and closing.
+
+        Returns:
+          int: tile halo in px.
+        """
+
+        # Closing after global threshold
+        halo = 2 if self.do_global_thr else 0
+
+        # Adaptive threshold filter, and closing
+        if self.do_adaptive_thr and 1 < self.adp_neigh:
+            block_size = self.adp_neigh + (1 - self.adp_neigh % 2)
+            reach = block_size // 2
+            if 'gaussian' == self.adp_method:
+                reach = max(reach, int(4 * (block_size - 1) / 6. + .5))
+            if self.adp_closing:
+                reach += 2
+            halo = max(halo, reach)
+
+        return(halo)
+
+    def filter_obj_size(self, mask):
+        """Filter objects XY and Z size.
+        Labels and measures the objects once, and removes those outside of
+        both size intervals in a single pass, see select_obj_XY_size and
+        select_obj_Z_size.
+
+        Args:
+          mask (np.array): binary image
+
+        Returns:
+          tuple: filtered binary image and log string
+        """
+
+        # Filter one tile at a time
+        if not type(None) == type(self.tile_size):
+            return(self.filter_obj_size_tiled(mask))
+
+        L = label(mask)
+        measures = objects.measure(L)
+        keep, log = self.select_obj_XY_size(L, measures)
+        tmp, tmp_log = self.select_obj_Z_size(L, measures)
+        log += tmp_log
+
+        return((np.logical_and(keep, tmp)[L], log))
+
+    def filter_obj_size_tiled(self, mask):
+        """Filter objects XY and Z size, one XY tile at a time, see
+        filter_obj_size. Objects are labeled per tile and stitched across
+        tile seams (see pygpseq.tools.tiles.TiledLabels), and measured tile
+        by tile. Besides the output mask, memory use is bounded by the tile
+        size.
+
+        Args:
+          mask (np.array): binary image
+
+        Returns:
+          tuple: filtered binary image and log string
+        """
+
+        labels = tiles.TiledLabels(mask, self.tile_size)
+        sizes, zsizes = labels.get_sizes()
+        measures = np.zeros(labels.ncomponents,
+            dtype = objects.get_measures_dtype(len(mask.shape)))
+        measures['label'] = np.arange(1, labels.ncomponents + 1)
+        measures['size'] = sizes[1:]
+        measures['zsize'] = zsizes[1:]
+
+        keep, log = self.select_obj_XY_size(mask, measures)
+        tmp, tmp_log = self.select_obj_Z_size(mask, measures)
+        log += tmp_log
+        keep = np.logical_and(keep, tmp)
+
+        out = np.zeros(mask.shape, dtype = 'bool')
+        for tid in range(len(labels.tiles)):
+            out[(Ellipsis,) + labels.tiles[tid]] = keep[labels.get_tile(tid)]
+        return((out, log))
+
+    def filter_obj_XY_size(self, mask):
+        """Filter objects XY size, see select_obj_XY_size.
+
+        Args:
+          mask (np.array): binary image
+
+        Returns:
+          tuple: filtered binary image and log string
+        """
+        L = label(mask)
+        keep, log = self.select_obj_XY_size(L)
+        return((keep[L], log))
+
+    def filter_obj_Z_size(self, mask):
+        """Filter objects Z size, see select_obj_Z_size.
+
+        Args:
+          mask (np.array): binary image
+
+        Returns:
+          tuple: filtered binary image and log string
+        """
+        L = label(mask)
+        keep, log = self.select_obj_Z_size(L)
+        return((keep[L], log))
+
+    @traced()
     def run(self, im, m = None, labeled2d = False):
         """Binarize image with current instance settings.
         Perform, if requested, the following actions in this order:
@@ -266,9 +304,13 @@ class Binarize(iot.IOinterface):
             log += self.printout('No threshold applied.', -1)
             return((im, log))
 
+        # Binarize one tile at a time
+        if not type(None) == type(self.tile_size):
+            return(self.run_tiled(im, m, labeled2d))
+
         # Make Z-projection ----------------------------------------------------
         if const.SEG_3D != self.seg_type and 2 != len(im.shape):
-            log += self.printout('Generating Z-projection [%d]...' % (
+            log += self.printout('Generating Z-projection [%s]...' % (
                 const.SEG_LABELS[self.seg_type],), 2)
             im = imt.mk_z_projection(im, self.seg_type)
 
@@ -289,7 +331,8 @@ class Binarize(iot.IOinterface):
             log += self.printout(msg, 2)
             mask.append(imt.threshold_adaptive(im, self.adp_neigh,
                 doClosing = self. adp_closing,
-                method = self.adp_method, mode = self.adp_mode))
+                method = self.adp_method, mode = self.adp_mode,
+                threads = self.adp_threads))
 
         # Combine masks
         if len(mask) == 2: mask = np.logical_and(mask[0], mask[1])
@@ -303,8 +346,8 @@ class Binarize(iot.IOinterface):
         if self.do_clear_borders:
             msg = 'Removing objects touching the image border...'
             log += self.printout(msg, 2)
-            mask = imt.clear_borders2(label(mask), self.do_clear_Z_borders)
-            mask = mask != 0
+            mask = imt.clear_borders2(label(mask), self.do_clear_Z_borders,
+                relabel = False) != 0
         
         # Fill holes -----------------------------------------------------------
         if self.do_fill_holes:
@@ -319,6 +362,226 @@ class Binarize(iot.IOinterface):
 
         return((mask, thr, log))
 
+    @traced()
+    def run_tiled(self, im, m = None, labeled2d = False):
+        """Binarize image with current instance settings, one XY tile at a
+        time, see run. Tiles overlap by the reach of the neighbourhood
+        operations (see get_tile_halo), and the global threshold is
+        calculated from a histogram built tile by tile. Objects and holes
+        are labeled per tile and stitched across tile seams, to clear
+        borders and fill holes. Besides the output mask (and the
+        Z-projection, if any), memory use is bounded by the tile size.
+
+        Args:
+          im (np.ndarray): image to be thresholded, can be memory-mapped
+          m (np.ndarray): mask to be combined after segmentation
+          labeled (bool): whether the additional m mask is labeled
+
+        Returns:
+          tuple: binarized image, Otsu's threshold value and log string
+        """
+
+        log = ''
+        log += self.printout('Binarizing in tiles of %d px...' % (
+            self.tile_size,), 2)
+
+        # Make Z-projection ----------------------------------------------------
+        if const.SEG_3D != self.seg_type and 2 != len(im.shape):
+            log += self.printout('Generating Z-projection [%s]...' % (
+                const.SEG_LABELS[self.seg_type],), 2)
+            proj = None
+            for (core, region, inner) in tiles.get_tiles(im.shape,
+                self.tile_size):
+                tmp = imt.mk_z_projection(np.asarray(im[(Ellipsis,) + core]),
+                    self.seg_type)
+                if type(None) == type(proj):
+                    proj = np.zeros(im.shape[-2:], dtype = tmp.dtype)
+                proj[core] = tmp
+            im = proj
+
+        # Binarize tiles -------------------------------------------------------
+
+        # Global threshold, from the whole image histogram
+        thr = 0
+        if self.do_global_thr:
+            thr = tiles.threshold_otsu(im, self.tile_size)
+            log += self.printout('Thresholding image, global thr: %f' % thr, 2)
+
+        doAdaptive = self.do_adaptive_thr and 1 < self.adp_neigh
+        if doAdaptive:
+            msg = 'Applying adaptive threshold to neighbourhood: %d' % (
+                self.adp_neigh,)
+            log += self.printout(msg, 2)
+
+        mask = np.zeros(im.shape, dtype = 'bool')
+        for (core, region, inner) in tiles.get_tiles(im.shape,
+            self.tile_size, self.get_tile_halo()):
+            tile = np.asarray(im[(Ellipsis,) + region])
+
+            tmask = []
+            if self.do_global_thr:
+                tmask.append(imt.binarize(tile, thr))
+            if doAdaptive:
+                tmask.append(imt.threshold_adaptive(tile, self.adp_neigh,
+                    doClosing = self.adp_closing,
+                    method = self.adp_method, mode = self.adp_mode,
+                    threads = self.adp_threads))
+
+            # Combine masks
+            if len(tmask) == 2: tmask = np.logical_and(tmask[0], tmask[1])
+            else: tmask = tmask[0]
+            mask[(Ellipsis,) + core] = tmask[(Ellipsis,) + inner]
+
+            # Combine extra mask
+            if not type(None) == type(m):
+                mask[(Ellipsis,) + core] = self.combine_2d_mask(
+                    mask[(Ellipsis,) + core], m[core], labeled2d) != 0
+
+        # Remove objects touching borders --------------------------------------
+        if self.do_clear_borders:
+            msg = 'Removing objects touching the image border...'
+            log += self.printout(msg, 2)
+            axes = [-1, -2]
+            if self.do_clear_Z_borders: axes.append(0)
+
+            labels = tiles.TiledLabels(mask, self.tile_size)
+            keep = np.logical_not(labels.is_touching(axes))
+            keep[0] = False
+            for tid in range(len(labels.tiles)):
+                mask[(Ellipsis,) + labels.tiles[tid]] = keep[
+                    labels.get_tile(tid)]
+        
+        # Fill holes -----------------------------------------------------------
+        if self.do_fill_holes:
+            log += self.printout('Filling holes...', 2)
+
+            # Background not connected to the borders, as imt.fill_holes:
+            # in the whole image, and in every Z slice
+            labels = [(tiles.TiledLabels(mask, self.tile_size,
+                ndi.generate_binary_structure(len(mask.shape), 1), True),
+                None)]
+            if 3 == len(mask.shape):
+                structure = np.zeros((3, 3, 3), dtype = 'bool')
+                structure[1] = ndi.generate_binary_structure(2, 1)
+                labels.append((tiles.TiledLabels(mask, self.tile_size,
+                    structure, True), [-1, -2]))
+            holes = [np.logical_not(L.is_touching(axes))
+                for (L, axes) in labels]
+            for h in holes: h[0] = False
+
+            for tid in range(len(labels[0][0].tiles)):
+                core = (Ellipsis,) + labels[0][0].tiles[tid]
+                tmask = mask[core]
+                for i in range(len(labels)):
+                    tmask = np.logical_or(tmask,
+                        holes[i][labels[i][0].get_tile(tid)])
+                mask[core] = tmask
+
+        # Output ---------------------------------------------------------------
+
+        # Re-assigne extra-mask labels
+        if not type(None) == type(m):
+            mask = self.combine_2d_mask(mask, m, labeled2d)
+
+        return((mask, thr, log))
+
+    def select_obj_XY_size(self, L, measures = None):
+        """Select objects based on their XY size.
+        Uses self.radius_interval to select the objects in the provided
+        labeled image based on the selected segmentation type.
+
+        Args:
+          L (np.array): labeled image, only its shape is used if measures
+                        are provided
+          measures (np.ndarray): object measurements, see
+                                 pygpseq.tools.objects.measure (opt)
+
+        Returns:
+          tuple: keep table (see pygpseq.tools.objects.get_keep_table) and
+                 log string
+        """
+
+        # Start logging
+        log = ''
+        log += self.printout('Filtering objects XY size...', 2)
+
+        # From radius to size
+        sinter = stt.r_to_size(self.radius_interval, self.seg_type)
+        log += self.printout('Allowed size interval: [%.2f, %.2f] [%s]' % (
+            sinter[0], sinter[1], imt.get_unit(L.shape)), 3)
+
+        # Identify objects XY size
+        log += self.printout('Retrieving objects XY size...', 3)
+        if type(None) == type(measures):
+            measures = objects.measure(L)
+        xysizes = measures['size']
+        nlabels = objects.count_labels(L, measures)
+        log += self.printout('Found %d objects.' % nlabels, 4)
+        
+        # Select objects to be discarded
+        keep = objects.get_keep_table(nlabels,
+            tokeep = measures['label'][np.logical_and(
+            xysizes >= sinter[0], xysizes <= sinter[1])] - 1)
+        log += self.printout('Discarding %d objects.' % (
+            nlabels - keep.sum()), 3)
+
+        # Output
+        return((keep, log))
+
+    def select_obj_Z_size(self, L, measures = None):
+        """Select objects based on their Z size.
+        Uses self.min_z_size to select the objects in the provided labeled
+        image.
+
+        Args:
+          L (np.array): labeled image, only its shape is used if measures
+                        are provided
+          measures (np.ndarray): object measurements, see
+                                 pygpseq.tools.objects.measure (opt)
+
+        Returns:
+          tuple: keep table (see pygpseq.tools.objects.get_keep_table) and
+                 log string
+        """
+
+        # Start logging
+        log = ''
+        log += self.printout('Filtering objects Z size...', 2)
+        nlabels = objects.count_labels(L, measures)
+        keep = objects.get_keep_table(nlabels)
+
+        # If not a stack, keep every object
+        if 3 > len(L.shape): return((keep, log))
+
+        # Check provided conditions
+        doFilterZsize = 0 != int(math.ceil(self.min_z_size))
+        doFilterZsize = doFilterZsize and self.an_type == const.AN_3D
+        if not doFilterZsize: return((keep, log))
+
+        # From size to number of slices
+        if self.min_z_size > 1:
+            self.min_z_size = int(math.ceil(self.min_z_size))
+        else:
+            self.min_z_size = self.min_z_size * L.shape[0]
+            self.min_z_size = int(math.ceil(self.min_z_size))
+        log += self.printout('Minimum %d slices.' % self.min_z_size, 3)
+
+        # Identify objects Z size
+        log += self.printout('Retrieving objects Z size...', 3)
+        log += self.printout('Found %d objects.' % nlabels, 4)
+        
+        if type(None) == type(measures):
+            measures = objects.measure(L)
+
+        # Select objects to be discarded
+        keep = objects.get_keep_table(nlabels, tokeep = measures['label'][
+            measures['zsize'] >= self.min_z_size] - 1)
+        log += self.printout('Discarding %d objects.' % (
+            nlabels - keep.sum()), 3)
+
+        # Output
+        return((keep, log))
+
 # END ==========================================================================
 
 ################################################################################
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: segmentation mask and decoded channel caches.
+'''
+
+# DEPENDENCIES =================================================================
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from pygpseq import const
+
+from pygpseq.tools import path as pt
+
+# CLASSES ======================================================================
+
+class ChannelCache(object):
+    """Per-process cache of decoded channels, with a memory budget.
+    Channels are keyed on the image file path, size and modification time,
+    and on the settings used to prepare them (e.g., rescaling and
+    projection). Cached channels are read-only. When the budget is
+    exceeded, the least recently used channels are dropped from memory.
+    Memory-mapped channels do not count towards the budget. The budget is 0
+    by default, as analysis reads the nuclear crops stored at segmentation,
+    so that channels are only cached in memory on request.
+    If a spill folder is set, channels are also saved there as uncompressed
+    .npy files, and memory-mapped when requested again by another stage,
+    process or run.
+
+    Attributes:
+      max_size (int): memory budget in bytes.
+      spill_dir (string): spill folder path (None to keep in memory only).
+      entries (OrderedDict): cached channels, least recently used first.
+      size (int): cached bytes.
+    """
+
+    max_size = 0
+    spill_dir = None
+    entries = None
+    size = 0
+
+    def __init__(self, max_size = None, spill_dir = None):
+        """
+        Args:
+          max_size (int): memory budget in bytes (opt, def: 0).
+          spill_dir (string): spill folder path (opt).
+        """
+        self.entries = OrderedDict()
+        self.configure(max_size, spill_dir)
+
+    def configure(self, max_size = None, spill_dir = None):
+        """Update memory budget and spill folder. """
+
+        if not type(None) == type(max_size):
+            self.max_size = int(max_size)
+        if not type(None) == type(spill_dir):
+            self.spill_dir = pt.add_trailing_slash(
+                os.path.expanduser(spill_dir))
+            if not os.path.isdir(self.spill_dir):
+                os.makedirs(self.spill_dir, exist_ok = True)
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used channels, down to max_size. """
+        while self.size > self.max_size and 0 != len(self.entries):
+            key, imch = self.entries.popitem(last = False)
+            if not isinstance(imch, np.memmap):
+                self.size -= imch.nbytes
+
+    def get(self, key):
+        """Retrieve a channel.
+
+        Args:
+          key (string): channel key, see get_key.
+
+        Returns:
+          np.ndarray: read-only channel, None if missing.
+        """
+
+        if key in self.entries.keys():
+            self.entries.move_to_end(key)
+            return(self.entries[key])
+
+        if not type(None) == type(self.spill_dir):
+            fpath = self.spill_dir + key + '.npy'
+            try:
+                imch = np.load(fpath, mmap_mode = 'r')
+            except (IOError, OSError, ValueError):
+                return(None)
+            self.entries[key] = imch
+            return(imch)
+
+        return(None)
+
+    def get_key(self, path, **kwargs):
+        """Build the key of a channel.
+
+        Args:
+          path (string): path to the image file.
+          **kwargs: settings used to prepare the channel.
+
+        Returns:
+          string: channel key.
+        """
+
+        fstat = os.stat(path)
+        params = {'path' : os.path.abspath(path), 'size' : fstat.st_size,
+            'mtime' : fstat.st_mtime, 'version' : const.VERSION}
+        params.update(kwargs)
+        return(hashlib.sha1(json.dumps(params, default = str,
+            sort_keys = True).encode()).hexdigest())
+
+    def set(self, key, imch):
+        """Store a channel, then drop channels in excess.
+
+        Args:
+          key (string): channel key, see get_key.
+          imch (np.ndarray): channel.
+
+        Returns:
+          np.ndarray: read-only cached channel.
+        """
+
+        if type(None) == type(self.spill_dir) and 0 == self.max_size:
+            imch.setflags(write = False)
+            return(imch)
+
+        if not type(None) == type(self.spill_dir):
+            fpath = self.spill_dir + key + '.npy'
+            with open(fpath + '.%d.tmp' % os.getpid(), 'wb') as f:
+                np.save(f, imch)
+            os.replace(fpath + '.%d.tmp' % os.getpid(), fpath)
+            imch = np.load(fpath, mmap_mode = 'r')
+        else:
+            imch.setflags(write = False)
+            if not isinstance(imch, np.memmap):
+                self.size += imch.nbytes
+
+        self.entries[key] = imch
+        self.evict()
+        return(imch)
+
+class MaskCache(object):
+    """On-disk cache of segmentation masks, addressed by content.
+    Masks are keyed on the content hash of the segmented image file, the
+    Binarize settings (const.PARAM_BINARIZE), any additional pipeline
+    setting, the package version and the cache schema version
+    (const.MASK_CACHE_VERSION). They are stored as uncompressed .npz
+    files. When the cache exceeds max_size, the least recently used masks
+    are evicted. Lookups and evictions are logged to the cache folder, so
+    that every process sharing the cache contributes to the report.
+
+    Attributes:
+      path (string): cache folder path.
+      max_size (int): maximum cache size in bytes.
+    """
+
+    path = None
+    max_size = 4 * 1024**3
+
+    def __init__(self, path, max_size = None):
+        """
+        Args:
+          path (string): cache folder path.
+          max_size (int): maximum cache size in bytes (opt, def: 4 GiB).
+        """
+
+        self.path = pt.add_trailing_slash(os.path.expanduser(path))
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, exist_ok = True)
+        if not type(None) == type(max_size):
+            self.max_size = int(max_size)
+
+    def evict(self):
+        """Remove the least recently used masks, down to max_size. """
+
+        entries = []
+        for fname in os.listdir(self.path):
+            if fname.endswith('.npz'):
+                try:
+                    fstat = os.stat(self.path + fname)
+                except OSError:
+                    continue
+                entries.append((fstat.st_mtime, fstat.st_size, fname))
+        entries.sort()
+
+        total = sum([e[1] for e in entries])
+        for (mtime, size, fname) in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(self.path + fname)
+                self.log_event('evict')
+            except OSError:
+                pass
+            total -= size
+
+    def get(self, key):
+        """Retrieve a mask, marking it as recently used.
+
+        Args:
+          key (string): mask key, see get_key.
+
+        Returns:
+          tuple: mask and threshold, None if missing.
+        """
+
+        fpath = self.path + key + '.npz'
+        try:
+            with np.load(fpath) as f:
+                out = (f['mask'], f['thr'][()])
+            os.utime(fpath)
+        except (IOError, OSError, KeyError, ValueError):
+            self.log_event('miss')
+            return(None)
+
+        self.log_event('hit')
+        return(out)
+
+    def get_key(self, impath, segmenter, **kwargs):
+        """Build the key of a mask.
+
+        Args:
+          impath (string): path to the segmented image file.
+          segmenter (pygpseq.tools.Binarize): segmentation settings.
+          **kwargs: additional settings affecting the mask.
+
+        Returns:
+          string: mask key.
+        """
+
+        params = dict([(k, segmenter[k]) for k in const.PARAM_BINARIZE])
+        params.update(kwargs)
+        params['version'] = const.VERSION
+        params['schema'] = const.MASK_CACHE_VERSION
+
+        h = hashlib.sha1(file_hash(impath).encode())
+        h.update(json.dumps(params, default = str, sort_keys = True).encode())
+        return(h.hexdigest())
+
+    def get_stats(self):
+        """Count logged lookups and evictions.
+
+        Returns:
+          dict: number of 'hit', 'miss' and 'evict' events.
+        """
+
+        stats = {'hit' : 0, 'miss' : 0, 'evict' : 0}
+        if os.path.isfile(self.path + 'events.log'):
+            with open(self.path + 'events.log', 'r') as f:
+                for line in f:
+                    if line.strip() in stats.keys():
+                        stats[line.strip()] += 1
+        return(stats)
+
+    def log_event(self, event):
+        """Log a lookup or eviction. """
+        with open(self.path + 'events.log', 'a') as f:
+            f.write(event + '\n')
+
+    def report(self, since = None):
+        """Report hits, misses and evictions.
+
+        Args:
+          since (dict): get_stats output, to report only later events (opt).
+
+        Returns:
+          string: report.
+        """
+
+        stats = self.get_stats()
+        if not type(None) == type(since):
+            stats = dict([(k, stats[k] - since[k]) for k in stats.keys()])
+        return('Mask cache "%s": %d hit(s), %d miss(es), %d eviction(s).' % (
+            self.path, stats['hit'], stats['miss'], stats['evict']))
+
+    def set(self, key, mask, thr):
+        """Store a mask, then evict masks in excess.
+
+        Args:
+          key (string): mask key, see get_key.
+          mask (np.ndarray): mask.
+          thr (float): threshold used to produce the mask.
+        """
+
+        fpath = self.path + key + '.npz'
+        with open(fpath + '.%d.tmp' % os.getpid(), 'wb') as f:
+            np.savez(f, mask = mask, thr = thr)
+        os.replace(fpath + '.%d.tmp' % os.getpid(), fpath)
+        self.evict()
+
+# FUNCTIONS ====================================================================
+
+def get_channel_cache(max_size = None, spill_dir = None):
+    """Return the channel cache of the current process.
+
+    Args:
+      max_size (int): memory budget in bytes (opt).
+      spill_dir (string): spill folder path (opt).
+
+    Returns:
+      ChannelCache: channel cache.
+    """
+    channels.configure(max_size, spill_dir)
+    return(channels)
+
+def file_hash(path, chunk_size = None):
+    """Calculate the SHA-1 hash of a file content.
+
+    Args:
+      path (string): file path.
+      chunk_size (int): number of bytes read at a time (opt, def: 1 MiB).
+
+    Returns:
+      string: hexadecimal digest.
+    """
+
+    if None == chunk_size:
+        chunk_size = 1024**2
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return(h.hexdigest())
+
+# Channel cache of the current process
+channels = ChannelCache()
+
+# END ==========================================================================
+
+################################################################################
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: run checkpoint store, with one record per unit of work.
+'''
+
+# DEPENDENCIES =================================================================
+
+import pickle as cp
+import json
+import os
+import time
+
+from pygpseq import const
+
+from pygpseq.tools import path as pt
+
+# CLASSES ======================================================================
+
+class CheckpointRecord(object):
+    """Handle to a checkpoint record, loaded only when needed.
+
+    Attributes:
+      path (string): path to the pickled record.
+      meta (dict): record metadata, from the manifest.
+    """
+
+    path = None
+    meta = {}
+
+    def __init__(self, path, meta = None):
+        """
+        Args:
+          path (string): path to the pickled record.
+          meta (dict): record metadata (opt).
+        """
+        self.path = path
+        if not type(None) == type(meta):
+            self.meta = meta
+
+    def load(self):
+        """Unpickle the record. """
+        with open(self.path, 'rb') as f:
+            return(cp.load(f))
+
+class CheckpointStore(object):
+    """Checkpoint directory, with one pickled record per (stage, condition,
+    series) unit and a JSON manifest. The manifest lists the finished units
+    and the parameters used for every stage. Records are written atomically,
+    so that an interrupted run leaves only finished units behind.
+
+    Attributes:
+      path (string): checkpoint directory path.
+      manifest (dict): records and stage parameters.
+      stages (tuple[string]): stages, in run order.
+    """
+
+    path = None
+    manifest = None
+    stages = ('inst', 'seg', 'an')
+
+    def __init__(self, path):
+        """
+        Args:
+          path (string): checkpoint directory path.
+        """
+
+        self.path = pt.add_trailing_slash(path)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self.manifest = {'version' : const.VERSION, 'params' : {},
+            'records' : {}}
+        if os.path.isfile(self.path + 'manifest.json'):
+            try:
+                with open(self.path + 'manifest.json', 'r') as f:
+                    self.manifest = json.load(f)
+            except ValueError:
+                pass
+
+    def check_params(self, stage, params):
+        """Check the parameters of a stage against those in the manifest.
+        On mismatch, the records of the stage and of the following ones are
+        dropped.
+
+        Args:
+          stage (string): stage name.
+          params (dict): current stage parameters.
+
+        Returns:
+          bool: whether the parameters match.
+        """
+
+        if not stage in self.manifest['params'].keys():
+            return(True)
+        if self.manifest['params'][stage] == normalize(params):
+            return(True)
+
+        self.drop(*self.stages[self.stages.index(stage):])
+        return(False)
+
+    def drop(self, *stages):
+        """Remove the records and parameters of the provided stages. """
+
+        for key in list(self.manifest['records'].keys()):
+            if key.split('/')[0] in stages:
+                fpath = self.path + self.manifest['records'][key]['file']
+                if os.path.isfile(fpath):
+                    os.remove(fpath)
+                self.manifest['records'].pop(key)
+        for stage in stages:
+            self.manifest['params'].pop(stage, None)
+        self.write_manifest()
+
+    def get_key(self, stage, condition = None, series = None):
+        """Build a record key. """
+        return('/'.join([str(k) for k in [stage, condition, series]
+            if not type(None) == type(k)]))
+
+    def get_record(self, stage, condition = None, series = None):
+        """Get a handle to a record, without loading it.
+
+        Args:
+          stage (string): stage name.
+          condition (string): condition name (opt).
+          series (int): series id (opt).
+
+        Returns:
+          CheckpointRecord: record handle.
+        """
+        key = self.get_key(stage, condition, series)
+        record = self.manifest['records'][key]
+        meta = record['meta'] if 'meta' in record.keys() else None
+        return(CheckpointRecord(self.path + record['file'], meta))
+
+    def has(self, stage, condition = None, series = None):
+        """Check whether a unit is finished. """
+        key = self.get_key(stage, condition, series)
+        if not key in self.manifest['records'].keys():
+            return(False)
+        fname = self.manifest['records'][key]['file']
+        return(os.path.isfile(self.path + fname))
+
+    def load(self, stage, condition = None, series = None):
+        """Load a record. """
+        return(self.get_record(stage, condition, series).load())
+
+    def save(self, obj, stage, condition = None, series = None, meta = None):
+        """Pickle a record and add it to the manifest.
+
+        Args:
+          obj: object to be stored.
+          stage (string): stage name.
+          condition (string): condition name (opt).
+          series (int): series id (opt).
+          meta (dict): JSON-compatible metadata, stored in the manifest to
+                       be read without loading the record (opt).
+        """
+
+        key = self.get_key(stage, condition, series)
+        fname = key.replace('/', '.') + '.cpickle'
+        with open(self.path + fname + '.tmp', 'wb') as f:
+            cp.dump(obj, f)
+        os.replace(self.path + fname + '.tmp', self.path + fname)
+
+        self.manifest['records'][key] = {'file' : fname, 'time' : time.time()}
+        if not type(None) == type(meta):
+            self.manifest['records'][key]['meta'] = meta
+        self.write_manifest()
+
+    def set_params(self, stage, params):
+        """Record the parameters of a stage in the manifest. """
+        self.manifest['params'][stage] = normalize(params)
+        self.write_manifest()
+
+    def write_manifest(self):
+        """Write the manifest, atomically. """
+        self.manifest['version'] = const.VERSION
+        with open(self.path + 'manifest.json.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent = 2, sort_keys = True)
+        os.replace(self.path + 'manifest.json.tmp',
+            self.path + 'manifest.json')
+
+# FUNCTIONS ====================================================================
+
+def normalize(params):
+    """Convert parameters to their JSON representation, for comparison.
+
+    Args:
+      params (dict): parameters.
+
+    Returns:
+      dict: JSON-compatible parameters.
+    """
+    return(json.loads(json.dumps(params, default = str, sort_keys = True)))
+
+# END ==========================================================================
+
+################################################################################
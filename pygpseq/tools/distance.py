@@ -19,6 +19,7 @@ from scipy.stats import norm
 
 import pygpseq as gp
 from pygpseq.tools import image as imt
+from pygpseq.tools.trace import traced
 
 # FUNCTIONS ====================================================================
 
@@ -129,6 +130,7 @@ def simulate_diffusion(mask, sigma, aspect, simthr = .7):
 
     return timebox
 
+@traced()
 def calc_nuclear_distances(dist_type, mask, aspect):
     '''Calculate distance from lamina and center for each voxel in a nucleus.
     
@@ -8,6 +8,7 @@
 
 # DEPENDENCIES =================================================================
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 import sys
 
@@ -20,11 +21,13 @@ from skimage.measure import label, marching_cubes_lewiner, mesh_surface_area
 from skimage.morphology import closing, convex_hull_image, cube
 from skimage.morphology import dilation, erosion, square
 from skimage.segmentation import clear_border
+import tifffile
 import warnings
 
 from pygpseq import const
-from pygpseq.tools import vector as vt
+from pygpseq.tools import objects
 from pygpseq.tools.io import printout
+from pygpseq.tools.trace import traced
 
 # FUNCTIONS ====================================================================
 
@@ -32,12 +35,15 @@ def add_top_bottom_slides(i):
     zero_slice = np.zeros((1, i.shape[1], i.shape[2]))
     return np.concatenate([zero_slice, i, zero_slice])
 
-def apply_box(i, box):
+def apply_box(i, box, copy = False):
     """Apply square/box selection to an image.
+    The selection is a view of the image, unless a copy is requested.
+    Request a copy to modify the selection or to release the image.
 
     Args:
       i (np.array): image.
       box (list): selection square/box corner coordinates.
+      copy (bool): whether to return a copy of the selection.
 
     Returns:
       np.array: square/box selection of the provided image.
@@ -47,7 +53,9 @@ def apply_box(i, box):
     box = check_box(i.shape, box)
 
     # Apply box
-    return(i[np.ix_(*[tuple(range(t[0], t[1]+1)) for t in box])])
+    i = i[get_box_slices(box)]
+    if copy: i = i.copy()
+    return(i)
 
 def autoselect_time_frame(im):
     """Selects the first non-empty time frame found.
@@ -89,6 +97,30 @@ def binarize(i, thr):
         i = closing(i > thr, cube(3))
     return(i)
 
+def box_mean(i, block_size, mode = None, cval = 0, output = None):
+    """Calculate the mean over a square neighbourhood of every pixel of each
+    XY slice, for every slice at once. Uses a running-sum box filter, whose
+    cost does not depend on the neighbourhood size.
+
+    Args:
+      i (np.array): image (2D or 3D).
+      block_size (int): neighbourhood square side.
+      mode (string): border mode, as in scipy.ndimage (opt, def: 'reflect').
+      cval (float): border value, for the 'constant' mode.
+      output (np.array/dtype): output array or dtype (opt, def: float).
+
+    Returns:
+      np.array: neighbourhood mean.
+    """
+
+    if None == mode:
+        mode = 'reflect'
+    if type(None) == type(output):
+        output = 'float'
+    size = [1 for d in i.shape[:-2]] + [block_size, block_size]
+    return(ndi.uniform_filter(i, size, output = output, mode = mode,
+        cval = cval))
+
 def calc_surface(mask, spacing = None):
     """Calculate the surface of a binary mask.
     The provided mask is expected to have only one object.
@@ -166,50 +198,30 @@ def clear_borders(img, clean_z = None):
                 img[:, slide_id, :] = clear_border(img[:, slide_id, :])
     return(img)
 
-def clear_borders2(img, clean_z = None):
+def clear_borders2(img, clean_z = None, relabel = None):
     '''Remove objects touching the borders of the image.
+    Objects are removed with a single pass, through a label lookup table,
+    see pygpseq.tools.objects.apply_keep_table.
     
     Args:
       img (np.array): labeled image.
       clean_z (bool): True to remove the objects touching the Z borders.
+      relabel (bool): True to relabel the remaining objects with consecutive
+                      labels, in the same order as in img (opt, def: only
+                      3D images are relabeled, 2D ones keep their labels).
     
     Returns:
       np.array: cleaned image.
     '''
 
-    if 2 == len(img.shape):
-        img = clear_border(img)
-    elif 3 == len(img.shape):
-        # Identify 3D objects touching X/Y borders
-        l = []
-        l.extend(np.unique(img[:, 0, :]).tolist())
-        l.extend(np.unique(img[:, -1, :]).tolist())
-        l.extend(np.unique(img[:, :, 0]).tolist())
-        l.extend(np.unique(img[:, :, -1]).tolist())
-        ii = set(l)
-
-        # Remove them
-        for i in ii:
-            img[img == i] = 0
-
-        # Apply also to Z borders
-        if True == clean_z:
-            # Identify
-            l = []
-            l.extend(np.unique(img[0, :, :]).tolist())
-            l.extend(np.unique(img[-1, :, :]).tolist())
-            ii = set(l)
-
-            # Remove
-            for i in ii:
-                img[img == i] = 0
+    if type(None) == type(relabel):
+        relabel = 3 == len(img.shape)
 
-        # Re-label
-        img = label(img)
-
-    # Output
-    return(img)
+    torm = get_border_labels(img, clean_z)
+    keep = objects.get_keep_table(int(img.max()), torm = torm[0 != torm] - 1)
+    return(objects.apply_keep_table(img, keep, relabel))
 
+@traced()
 def describe_shape(mask, spacing = None):
     """Calculate sphericity (3d) or solidity (2d) of the provided mask.
     The provided mask is expected to have only one object.
@@ -280,6 +292,67 @@ def estimate_background(i, mask, seg_type):
 
     return(bg)
 
+def extract_objects(L, offset = None, images = None, measures = None):
+    """Extract every labeled object with a single pass over the label image.
+    Object boxes are identified with scipy.ndimage.find_objects, or taken
+    from the provided measurements, then padded with the provided offset and
+    clipped to the image borders.
+
+    Note:
+      If no offset is specified, it defaults to 0. If only one offset is
+      specified, or the number of offsets does not match the number of
+      dimensions, the first one is used for every dimension.
+
+    Args:
+      L (np.array): labeled image.
+      offset (tuple[int]): bounding box offset in px/vx [Z Y X].
+      images (list[np.array]): images with the same shape as L, to be cropped.
+      measures (np.ndarray): object measurements, see
+                             pygpseq.tools.objects.measure (opt).
+
+    Returns:
+      list: a (label, box, mask, crops) tuple for every non-empty object. The
+            box contains the inclusive corner coordinates, the mask is the
+            boolean object crop, and crops are views of the provided images
+            over the same box.
+    """
+
+    # Default values
+    if None == offset:
+        offset = 0
+    if type(0) == type(offset):
+        offset = [offset]
+    offset = list(offset)
+    if len(offset) != len(L.shape):
+        offset = [offset[0] for d in L.shape]
+    if None == images:
+        images = []
+
+    # Force integer labels
+    if L.dtype == np.bool_:
+        L = L.astype('u1')
+
+    # Object boxes
+    if type(None) == type(measures):
+        boxes = [(lid + 1, [(s.start, s.stop - 1) for s in sl])
+            for (lid, sl) in enumerate(ndi.find_objects(L))
+            if not type(None) == type(sl)]
+    else:
+        boxes = zip(measures['label'].tolist(), measures['box'].tolist())
+
+    objs = []
+    for (lid, box) in boxes:
+
+        # Pad object box
+        box = [(max(0, b[0] - o), min(d - 1, b[1] + o))
+            for (b, o, d) in zip(box, offset, L.shape)]
+        sl = tuple([slice(t[0], t[1] + 1) for t in box])
+
+        # Crop mask and images
+        objs.append((lid, box, L[sl] == lid, [i[sl] for i in images]))
+
+    return(objs)
+
 def fill_holes(mask):
     '''Fill mask holes.'''
     mask = ndi.binary_fill_holes(mask)
@@ -299,6 +372,35 @@ def get_dtype(i):
             return("uint%d" % (depth,))
     return("uint")
 
+def get_border_labels(L, clean_z = None):
+    '''Identify the objects touching the borders of the image.
+
+    Args:
+      L (np.array): labeled image.
+      clean_z (bool): True to include the Z borders of a 3D image.
+
+    Returns:
+      np.array: labels found on the borders, background included.
+    '''
+
+    axes = [-1, -2]
+    if 3 == len(L.shape) and True == clean_z:
+        axes.append(0)
+    return(np.unique(np.concatenate([np.take(L, [0, -1], a).ravel()
+        for a in axes])))
+
+def get_box_slices(box):
+    """Convert square/box corner coordinates into slices, to select the
+    square/box as a view or as a read_tiff region of interest.
+
+    Args:
+      box (list): selection square/box corner coordinates.
+
+    Returns:
+      tuple[slice]: square/box selection.
+    """
+    return(tuple([slice(int(t[0]), int(t[1]) + 1) for t in box]))
+
 def get_mid_section_idx(i, mask, mid_type = None):
     """Identify mid-section index.
 
@@ -345,11 +447,14 @@ def get_objects_zsize(L):
       L (np.array): labelled thresholded image.
 
     Returns:
-      list: Z size of every object in the labelled image.
+      list: Z size of every object in the labelled image, see
+            pygpseq.tools.objects.measure.
     """
 
-    sizes = [(L == i).astype('int').sum(0).max() for i in range(1, L.max())]
-    return(sizes)
+    measures = objects.measure(L)
+    sizes = np.zeros(int(L.max()), dtype = measures['zsize'].dtype)
+    sizes[measures['label'] - 1] = measures['zsize']
+    return(sizes.tolist())
 
 def get_objects_xysize(L):
     """Retrieve objects size (2/3D).
@@ -358,12 +463,9 @@ def get_objects_xysize(L):
       L (np.array): labelled thresholded image.
 
     Returns:
-      list: XY size of every object in the labelled image.
+      list: size of every non-empty object in the labelled image.
     """
-
-    Larray = L.reshape([np.prod(L.shape)]).tolist()
-    sizes = [t[1] for t in vt.uniquec(Larray) if t[0] != 0]
-    return(sizes)
+    return(objects.measure(L)['size'].tolist())
 
 def get_partial_nuclear_volume(mask, i, erosion):
     """Retrieve the partial volume of a nucleus.
@@ -568,14 +670,23 @@ def mk_z_projection(i, p_type):
         i = i.max(0).astype(i.dtype)
     return(i)
 
-def read_tiff(impath, k = None, noSelection = False, rescale = 1):
+@traced()
+def read_tiff(impath, k = None, noSelection = False, rescale = 1,
+    mmap = False, roi = None):
     '''Read tiff image.
+    Uncompressed images can be memory-mapped: the output is then a read-only
+    view of the file, and only the accessed pixels are loaded. When a region
+    of interest is provided, only the pages overlapping it are decoded.
+    Without rescaling, re-slicing and region selection return views.
 
     Args:
       impath (str): path to tiff image.
       k (int): number of dimensions in output image for re-slicing.
       noSelection (bool): whether to discard empty dimensions.
       rescale (float): scaling factor.
+      mmap (bool): whether to memory-map uncompressed images.
+      roi (tuple[slice]): region of interest, over the last len(roi)
+                          dimensions of the (re-sliced) image.
     
     Returns:
       np.ndarray: image.
@@ -587,7 +698,18 @@ def read_tiff(impath, k = None, noSelection = False, rescale = 1):
     # Read TIFF (capture any parsing issues)
     try:
         with warnings.catch_warnings(record = True) as wlist:
-            im = imread(impath)
+            im = None
+            if mmap or not type(None) == type(roi):
+                im = read_tiff_pages(impath, k, roi, mmap)
+            if type(None) == type(im):
+                im = imread(impath)
+
+                # Reshape and re-slice
+                while 0 == im.shape[0] and not noSelection: im = im[0]
+                if type(0) == type(k): im = slice_k_d_img(im, k)
+                if not type(None) == type(roi):
+                    im = im[(Ellipsis,) + tuple(roi)]
+
             if 0 != len(wlist):
                 if "axes do not match shape" in str(wlist[0]):
                     printout("image axes do not match metadata in '%s'. %s" % (
@@ -598,43 +720,77 @@ def read_tiff(impath, k = None, noSelection = False, rescale = 1):
             canAbort = False)
         return(None)
 
-    # Reshape and re-slice
-    while 0 == im.shape[0] and not noSelection: im = im[0]
-    if type(0) == type(k): im = slice_k_d_img(im, k)
-
     # Rescale
-    if 1 != rescale: im = (im / rescale).astype('float')
+    if 1 != rescale: im = np.divide(im, rescale, dtype = 'float')
 
     return(im)
 
+def read_tiff_pages(impath, k = None, roi = None, mmap = False):
+    '''Read a tiff image, memory-mapping it or decoding only the pages
+    overlapping the region of interest.
+
+    Args:
+      impath (str): path to tiff image.
+      k (int): number of dimensions in output image for re-slicing.
+      roi (tuple[slice]): region of interest, over the last len(roi)
+                          dimensions of the (re-sliced) image.
+      mmap (bool): whether to memory-map uncompressed images.
+
+    Returns:
+      np.ndarray: image.
+      None: if the image pages cannot be selected, use read_tiff.
+    '''
+
+    if type(None) == type(roi):
+        roi = ()
+    roi = tuple(roi)
+
+    with tifffile.TiffFile(impath) as tif:
+        shape = tuple(tif.series[0].shape)
+        npages = len(tif.pages)
+        if 0 in shape or len(roi) > len(shape):
+            return(None)
+
+        # Fixed leading dimensions, as in slice_k_d_img
+        nfix = 0
+        if type(0) == type(k) and k <= len(shape):
+            nfix = len(shape) - k
+
+        # Memory-map uncompressed images
+        if mmap:
+            try:
+                im = tifffile.memmap(impath, mode = 'r')
+            except (ValueError, TypeError):
+                im = None
+            if not type(None) == type(im) and im.shape == shape:
+                return(im[(0,) * nfix][(Ellipsis,) + roi])
+
+        # Only YX planes can be selected
+        if 0 == len(roi) or int(np.prod(shape[:-2])) != npages:
+            return(None)
+
+        # Select the pages overlapping the region of interest
+        idx = [0] * nfix + [slice(None)] * (len(shape) - nfix)
+        for i in range(len(roi)):
+            idx[len(shape) - len(roi) + i] = roi[i]
+        pidx = np.arange(npages).reshape(shape[:-2])[tuple(idx[:-2])]
+        pidx = np.asarray(pidx)
+        if 0 == pidx.size:
+            return(None)
+
+        im = tif.asarray(key = pidx.ravel().tolist())
+        im = im.reshape(pidx.shape + shape[-2:])
+
+    return(im[(Ellipsis,) + tuple(idx[-2:])])
+
 def rm_from_mask(L, torm):
     # Remove elements from a mask.
+    # See pygpseq.tools.objects.rm_from_mask.
     # 
     # Args:
     #     L (np.array[int]): labelled objects.
     #     torm (list): list of objects indexes (to remove).
-
-    if len(torm) <= L.max() - len(torm):
-        # Update list of objects to be discarded
-        torm = [e + 1  for e in torm]
-
-        # Identify which objects to discard
-        rm_mask = np.vectorize(lambda x: x in torm)(L)
-
-        # Discard and re-label
-        L[rm_mask] = 0
-    else:
-        # Select objects to be kept
-        tokeep = [e + 1 for e in range(L.max()) if not e in torm]
-
-        # Identify which objects to discard
-        rm_mask = np.vectorize(lambda x: not x in tokeep)(L)
-
-        # Discard and re-label
-        L[rm_mask] = 0
-
-    # Output
-    return(L > 0)
+    return(objects.rm_from_mask(L, torm))
 
 def slice_k_d_img(img, k):
     """Select one k-d image from a n-d image.
@@ -652,49 +808,69 @@ def slice_k_d_img(img, k):
     if k > len(img.shape):
         return(img)
 
-    # Slice image
-    idxs = [(0,) for i in range(len(img.shape) - k)]
-    for i in range(k):
-        idxs.append(tuple(range(img.shape[len(img.shape) - k + i])))
-    img = img[np.ix_(*idxs)].reshape(img.shape[len(img.shape) - k:])
+    # Slice image, returning a view
+    img = img[(0,) * (len(img.shape) - k)]
 
     # Output
     return(img)
 
 def threshold_adaptive(i, block_size, doClosing = True,
-    method = None, mode = None, param = None):
+    method = None, mode = None, param = None, threads = None):
     """Adaptive threshold.
+    Thresholds are calculated per XY slice. The 'mean' method is calculated
+    for every slice at once (see box_mean). Other methods can process slices
+    in parallel threads, as the underlying filters release the GIL.
 
     Args:
       i (np.array): image.
       block_size (int): neighbourhood, if even then it is incremented by 1.
       doClosing (bool): to trigger closing operation after local thresholding.
       method, mode, param: additional parameters for threshold_local.
+      threads (int): number of threads (opt, def: 1).
 
     Returns:
       np.array: thresholded image.
     """
 
+    # Default values
+    if None == method:
+        method = 'gaussian'
+    if None == mode:
+        mode = 'reflect'
+    if None == threads:
+        threads = 1
+
     # Increment neighbourhood size
     if 0 == block_size % 2:
         block_size += 1
 
-    # Local threshold mask
-    lmask = i.copy()
-    
-    # Apply threshold per slice
-    if 3 == len(i.shape):
-        for slice_id in range(i.shape[0]):
-            lmask[slice_id, :, :] = filters.threshold_local(
+    # Local threshold
+    if 'mean' == method:
+        lthr = box_mean(i, block_size, mode,
+            output = np.empty(i.shape, dtype = 'float32'))
+    elif 3 == len(i.shape):
+        lthr = np.empty(i.shape, dtype = 'float32')
+        def threshold_slice(slice_id):
+            lthr[slice_id, :, :] = filters.threshold_local(
                 i[slice_id, :, :], block_size, method = method,
                 mode = mode, param = param)
-        lmask = i >= lmask
-        if doClosing: lmask = closing(lmask, cube(3))
+        if 1 < threads:
+            with ThreadPoolExecutor(min(threads, i.shape[0])) as pool:
+                list(pool.map(threshold_slice, range(i.shape[0])))
+        else:
+            for slice_id in range(i.shape[0]):
+                threshold_slice(slice_id)
     else:
-        lmask = filters.threshold_local(i, block_size, method = method,
-            mode = mode, param = param)
-        lmask = i >= lmask
-        if doClosing: lmask = closing(lmask, square(3))
+        lthr = filters.threshold_local(i, block_size, method = method,
+            mode = mode, param = param).astype('float32')
+
+    # Local threshold mask
+    lmask = i >= lthr
+    if doClosing:
+        if 3 == len(i.shape):
+            lmask = closing(lmask, cube(3))
+        else:
+            lmask = closing(lmask, square(3))
 
     # Output
     return(lmask)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: labeled object measurement, and filtering through label
+              lookup tables.
+'''
+
+# DEPENDENCIES =================================================================
+
+import numpy as np
+from scipy import ndimage as ndi
+
+# FUNCTIONS ====================================================================
+
+def apply_keep_table(L, keep, relabel = False):
+    """Remove objects from a labeled image, in a single pass.
+
+    Args:
+      L (np.ndarray[int]): labeled image.
+      keep (np.ndarray[bool]): keep table, see get_keep_table.
+      relabel (bool): True to relabel the kept objects with consecutive
+                      labels, otherwise they keep their original labels.
+
+    Returns:
+      np.ndarray: labeled image, without the removed objects.
+    """
+
+    if relabel:
+        lut = np.cumsum(keep) * keep
+    else:
+        lut = np.arange(keep.shape[0]) * keep
+    return(lut.astype(L.dtype)[L])
+
+def count_labels(L, measures = None):
+    """Count the labels of a labeled image (i.e., maximum label).
+
+    Args:
+      L (np.ndarray[int]): labeled image.
+      measures (np.ndarray): object measurements, see measure. If provided,
+                             labels are counted from them instead (opt).
+
+    Returns:
+      int: number of labels.
+    """
+
+    if type(None) == type(measures):
+        return(int(L.max()))
+    if 0 == measures.shape[0]:
+        return(0)
+    return(int(measures['label'].max()))
+
+def get_keep_table(nlabels, torm = None, tokeep = None):
+    """Build the keep table of a labeled image: a boolean array, indexed by
+    label, True for the objects to be kept. The background (0) is never
+    kept. Tables from different filters can be combined with logical
+    operators, and applied at once, without relabeling in between.
+
+    Args:
+      nlabels (int): number of labels (i.e., maximum label).
+      torm (list[int]): indexes (label - 1) of the objects to be removed
+                        (opt).
+      tokeep (list[int]): indexes (label - 1) of the objects to be kept.
+                          Every other object is removed (opt).
+
+    Returns:
+      np.ndarray[bool]: keep table, of nlabels + 1 elements.
+    """
+
+    if type(None) == type(tokeep):
+        keep = np.ones(nlabels + 1, dtype = 'bool')
+    else:
+        keep = np.zeros(nlabels + 1, dtype = 'bool')
+        keep[np.asarray(tokeep, dtype = 'int') + 1] = True
+    if not type(None) == type(torm):
+        keep[np.asarray(torm, dtype = 'int') + 1] = False
+    keep[0] = False
+    return(keep)
+
+def get_measures_dtype(ndim):
+    """Return the dtype of the object measurements, see measure.
+
+    Args:
+      ndim (int): number of image dimensions.
+
+    Returns:
+      list: structured array dtype.
+    """
+    return([('label', 'u4'), ('size', 'u8'), ('flat_size', 'u8'),
+        ('zsize', 'u4'), ('box', 'i8', (ndim, 2)), ('centroid', 'f8', (ndim,))])
+
+def measure(L):
+    """Measure every labeled object. Object sizes are counted with a single
+    np.bincount pass, and object boxes identified with a single
+    scipy.ndimage.find_objects pass. Every other measurement is performed
+    on the object box only.
+
+    Args:
+      L (np.ndarray[int]): labeled image (2D or 3D).
+
+    Returns:
+      np.ndarray: one row per non-empty object, sorted by label, with label,
+                  size (number of px/vx), flat_size (size of the Z
+                  projection), zsize (maximum number of voxels in a
+                  single Z column, 1 in 2D), box (inclusive corner
+                  coordinates) and centroid. See get_measures_dtype.
+    """
+
+    if L.dtype == np.bool_:
+        L = L.astype('u1')
+
+    slices = ndi.find_objects(L)
+    labels = [lid + 1 for lid in range(len(slices))
+        if not type(None) == type(slices[lid])]
+    measures = np.zeros(len(labels), dtype = get_measures_dtype(len(L.shape)))
+    if 0 == len(labels):
+        return(measures)
+
+    measures['label'] = labels
+    measures['size'] = np.bincount(L.ravel(), minlength = len(slices) + 1
+        )[labels]
+
+    for i in range(len(labels)):
+        sl = slices[labels[i] - 1]
+        crop = L[sl] == labels[i]
+        measures['box'][i] = [(s.start, s.stop - 1) for s in sl]
+        measures['centroid'][i] = [c.mean() + s.start
+            for (c, s) in zip(np.nonzero(crop), sl)]
+        if 3 == len(L.shape):
+            zsizes = crop.sum(0)
+            measures['flat_size'][i] = (0 != zsizes).sum()
+            measures['zsize'][i] = zsizes.max()
+    if 3 != len(L.shape):
+        measures['flat_size'] = measures['size']
+        measures['zsize'] = 1
+
+    return(measures)
+
+def rm_from_mask(L, torm):
+    """Remove objects from a labeled image.
+
+    Args:
+      L (np.ndarray[int]): labeled image.
+      torm (list[int]): indexes (label - 1) of the objects to be removed.
+
+    Returns:
+      np.ndarray[bool]: mask of the kept objects.
+    """
+    return(get_keep_table(int(L.max()), torm)[L])
+
+# END ==========================================================================
+
+################################################################################
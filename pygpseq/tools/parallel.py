@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: parallel task scheduling library.
+'''
+
+# DEPENDENCIES =================================================================
+
+import multiprocessing
+
+# FUNCTIONS ====================================================================
+
+def mk_task(f, *args, **kwargs):
+    """Build a task to be run with run_tasks.
+
+    Args:
+      f (fun): picklable (i.e., module-level) function.
+      *args, **kwargs: arguments for f.
+
+    Returns:
+      tuple: (f, args, kwargs).
+    """
+    return((f, args, kwargs))
+
+def run_task(indexed_task):
+    """Run a single indexed task, as built by mk_task.
+
+    Args:
+      indexed_task (tuple): (task index, (f, args, kwargs)).
+
+    Returns:
+      tuple: (task index, f output).
+    """
+    i, (f, args, kwargs) = indexed_task
+    return((i, f(*args, **kwargs)))
+
+def run_tasks(tasks, ncores = None):
+    """Run tasks from a single queue, yielding results as soon as available.
+    Tasks are dispatched in the provided order, one at a time, so that a slow
+    task does not hold back the others. With one core, the tasks are run
+    sequentially in the current process.
+
+    Args:
+      tasks (list): tasks, as built by mk_task.
+      ncores (int): number of worker processes (opt, def: 1).
+
+    Returns:
+      generator: (task index, task output) in order of completion.
+    """
+
+    if None == ncores:
+        ncores = 1
+    ncores = max(1, min(ncores, len(tasks)))
+
+    if 1 == ncores:
+        for indexed_task in enumerate(tasks):
+            yield run_task(indexed_task)
+        return
+
+    pool = multiprocessing.Pool(ncores)
+    try:
+        for out in pool.imap_unordered(run_task, enumerate(tasks), 1):
+            yield out
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+# END ==========================================================================
+
+################################################################################
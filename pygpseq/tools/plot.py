@@ -27,6 +27,7 @@ import tifffile
 from pygpseq import const
 
 from pygpseq.tools import path as pt, stat as stt
+from pygpseq.tools.store import PixelStore
 
 # FUNCTIONS ====================================================================
 
@@ -166,7 +167,8 @@ def boxplot(fig, subplot, data, labels, widths, ylabel, nnuclei,
     Args:
       fig (plt.figure): figure canvas.
       subplot (int): subplot signature (i.e., 111, 122,...).
-      data (list): list of datasets to boxplot.
+      data (list): list of datasets to boxplot, or of their boxplot
+                   statistics (see pygpseq.tools.stat.box_stats).
       labels (list[string]): x-axis #1 tick values.
       widths (list[float]): boxplot widths.
       ylabel (string): y-axis label.
@@ -197,9 +199,11 @@ def boxplot(fig, subplot, data, labels, widths, ylabel, nnuclei,
     ax1 = fig.add_subplot(subplot)
     ax2 = ax1.twiny()
 
-    # Produce boxplot
-    bp = ax1.boxplot(data, labels = labels,
-        sym = '.', widths = widths, patch_artist = True)
+    # Produce boxplot from precomputed statistics
+    stats = [d if type({}) == type(d) else stt.box_stats(d) for d in data]
+    stats = [dict(stats[i], label = labels[i]) for i in range(len(stats))]
+    bp = ax1.bxp(stats, widths = widths, patch_artist = True,
+        flierprops = {'marker' : '.'})
 
     # Change boxplot appearance
     [b.set(color = '#000000') for b in bp['boxes']]
@@ -238,6 +242,8 @@ def density_with_range(density, fwhm_range,
 
     Args:
       density (dict): dictionary w/ density function and coords for its plot.
+                      The function can be replaced by its values at the
+                      FWHM range, e.g., to pickle the density.
       fwhm_range (list): FWHM range of major density peak.
       new_figure (plt.figure): figure object to plot to.
       show (bool): True to display the figure.
@@ -260,7 +266,10 @@ def density_with_range(density, fwhm_range,
     # Plot
     plt.plot(density['x'], density['y'], 'k')
     plt.hold(True)
-    plt.plot(fwhm_range, density['f'](fwhm_range), 'b.')
+    if callable(density['f']):
+        plt.plot(fwhm_range, density['f'](fwhm_range), 'b.')
+    else:
+        plt.plot(fwhm_range, density['f'], 'b.')
     plt.axvline(x = fwhm_range[0], color = 'red', linestyle = '-.')
     plt.axvline(x = fwhm_range[1], color = 'red', linestyle = '-.')
     plt.ticklabel_format(style = 'sci', axis = 'x', scilimits = (0, 0))
@@ -473,6 +482,71 @@ def export_mask_png(outpath, im, title):
     # Close plot figure
     plt.close(fig)
 
+def get_pixel_box_stats(profiles):
+    """Retrieve the single-pixel DNA and signal boxplot statistics of every
+    condition, precomputed with the profiles.
+
+    Args:
+      profiles (list): list of profile dictionaries.
+
+    Returns:
+      list: {'dna' : dict, 'sig' : dict} boxplot statistics per condition.
+    """
+    return([dict([(k, p[k]['box_all']) for k in ['dna', 'sig']])
+        for p in profiles])
+
+def get_pixel_histograms(indata, dfield, nbins = None):
+    """Calculate the 2D histograms of DNA, signal and Signal/DNA ratio against
+    the distance from the lamina. Disk-backed tables are read chunk by chunk,
+    twice: once for the ranges and once for the histograms.
+
+    Args:
+      indata (np.array, PixelStore): single-pixel table,
+                                     const.DTYPE_NUCLEAR_DATA.
+      dfield (string): distance column.
+      nbins (int): histogram precision (opt, def 200).
+
+    Returns:
+      dict: (histogram, xyrange) for 'dna', 'sig' and 'ratio'.
+    """
+
+    if None == nbins:
+        nbins = 200
+
+    def get_chunks():
+        if isinstance(indata, PixelStore):
+            return(indata.iter_chunks([dfield, 'dna', 'sig']))
+        return([indata])
+
+    def get_xy(chunk):
+        x = chunk[dfield]
+        rat = chunk['sig'] / chunk['dna'].astype('float')
+        return([('dna', x, chunk['dna']), ('sig', x, chunk['sig']),
+            ('ratio', x[rat != np.inf], rat[rat != np.inf])])
+
+    # XY ranges
+    xyrange = {}
+    for chunk in get_chunks():
+        for (k, x, y) in get_xy(chunk):
+            if 0 == x.shape[0]:
+                continue
+            r = [[x.min(), x.max()], [y.min(), y.max()]]
+            if k in xyrange.keys():
+                r = [[min(xyrange[k][i][0], r[i][0]),
+                    max(xyrange[k][i][1], r[i][1])] for i in range(2)]
+            xyrange[k] = r
+
+    # Local density
+    hh = dict([(k, np.zeros((nbins, nbins))) for k in xyrange.keys()])
+    for chunk in get_chunks():
+        for (k, x, y) in get_xy(chunk):
+            if 0 == x.shape[0]:
+                continue
+            hh[k] += np.histogram2d(x, y,
+                range = xyrange[k], bins = [nbins, nbins])[0]
+
+    return(dict([(k, (hh[k], xyrange[k])) for k in xyrange.keys()]))
+
 def get_nsf_label(nsfi, seg_type = None, an_type = None):
     """Get the proper plot label for the selected nuclear selection feature,
     based on the current segmentation type.
@@ -513,14 +587,15 @@ def get_nsf_label(nsfi, seg_type = None, an_type = None):
     # Output
     return(label)
 
-def multi_condition_boxplot(profiles, summaries, merged,
+def multi_condition_boxplot(profiles, summaries, merged = None,
     an_type = None, **kwargs):
     """Generate multi condition boxplots.
 
     Args:
       profiles (list): list of profile dictionaries.
       summaries (list): list of condition nuclear summaries.
-      merged (list): list of condition nuclear single-pixel tables.
+      merged (list): list of condition nuclear single-pixel tables
+                     (opt, def: profile boxplot statistics).
       an_type (int): analysis type as defined in pygpseq.const.
       **kwargs: additional keyword arguments.
     
@@ -580,8 +655,16 @@ def multi_condition_boxplot(profiles, summaries, merged,
         forceSciNotation = True
     )
 
+    # Single-pixel boxplot statistics, precomputed with the profiles
+    if type(None) == type(merged):
+        merged = get_pixel_box_stats(profiles)
+    else:
+        merged = [dict([(k, stt.box_stats(m[k])) for k in ['dna', 'sig']])
+            for m in merged]
+    npx = [m['dna']['n'] for m in merged]
+
     # Calculate boxplot relative widths
-    bp_widths = np.asarray([m.shape[0] for m in merged], dtype='float')
+    bp_widths = np.asarray(npx, dtype='float')
     bp_widths = bp_widths / bp_widths.max() * 0.9
 
     # Plot single-pixel DNA intensity
@@ -589,7 +672,7 @@ def multi_condition_boxplot(profiles, summaries, merged,
         [m['dna'] for m in merged],
         [p['condition'] for p in profiles], 
         bp_widths.tolist(), 'DNA [a.u.] [per px]',
-        [m.shape[0] for m in merged],
+        npx,
         xaxis2 = False,
         forceSciNotation = True
     )
@@ -599,7 +682,7 @@ def multi_condition_boxplot(profiles, summaries, merged,
         [m['sig'] for m in merged],
         [p['condition'] for p in profiles], 
         bp_widths.tolist(), 'Signal [a.u.] [per px]',
-        [m.shape[0] for m in merged],
+        npx,
         xaxis2 = False, ylab_pos = 'right',
         forceSciNotation = True
     )
@@ -692,6 +775,78 @@ def multi_condition_single_boxplot(profiles, data, data_field,
     export(fname, 'png')
     plt.close(fig)
 
+def nuclear_threshold_summary(sel_data, nsf, seg_type, data, selected,
+    suptitle, title, font_size = None, wspace = None, hspace = None,
+    **kwargs):
+    """Plot nuclear feature densities with FWHM range, and the selected
+    nuclei if two or more features are used.
+
+    Args:
+      sel_data (dict): density threshold plot data, per feature field.
+      nsf (list[int]): list of features used for nuclear selection
+                       according to pygpseq.const.
+      seg_type (int): segmentation type according to pygpseq.const.
+      data (np.array): nuclear summaries.
+      selected (list[int]): selected nuclei indexes.
+      suptitle (string): figure title.
+      title (string): selection title.
+      font_size (int): (opt).
+      wspace (float): vertical intra-plot spacing (opt).
+      hspace (float): horizontal intra-plot spacing (opt).
+
+    Returns:
+      plt.figure: figure canvas with plot.
+    """
+
+    # Default values
+    if None == wspace:
+        wspace = .4
+    if None == hspace:
+        hspace = .4
+
+    fig = plt.figure(figsize = [8, 8])
+    plt.suptitle(suptitle)
+
+    # Setup subplots spacing
+    plt.subplots_adjust(wspace = wspace, hspace = hspace)
+
+    if 0 == len(nsf):
+        plt.title(title)
+        return(fig)
+
+    # Feature densities
+    for i in range(len(nsf)):
+        if 1 == len(nsf):
+            plt.subplot(1, 1, 1)
+        else:
+            plt.subplot(2, 2, i + 1)
+        set_font_size(font_size)
+        density_with_range(new_figure = False,
+            **sel_data[const.NSEL_FIELDS[nsf[i]]])
+
+    if not 1 == len(nsf):
+        sub_data = data[selected]
+
+        # General scatterplot
+        plt.subplot(2, 2, 4)
+        set_font_size(font_size)
+        plt.plot(data[const.NSEL_FIELDS[nsf[0]]],
+            data[const.NSEL_FIELDS[nsf[1]]], ',k')
+        plt.hold(True)
+
+        # Selected scatterplot
+        plt.plot(sub_data[const.NSEL_FIELDS[nsf[0]]],
+            sub_data[const.NSEL_FIELDS[nsf[1]]], ',r')
+        plt.xlabel(get_nsf_label(nsf[0], seg_type))
+        plt.ylabel(get_nsf_label(nsf[1], seg_type))
+        plt.title(title)
+        plt.ticklabel_format(style = 'sci', axis = 'x',
+            scilimits = (0, 0))
+        plt.ticklabel_format(style = 'sci', axis = 'y',
+            scilimits = (0, 0))
+
+    return(fig)
+
 def ortho_3d(coords, scale = None, dot_coords = None, c = None, aspect = None,
     channels = None):
     '''
@@ -1062,14 +1217,78 @@ def single_condition_profiles(profiles, font_size = None, color = None,
     if new_figure:
         return(fig)
 
-def single_pixel_study(xs, ys, field_label, profile, nbins = None, **kwargs):
+def single_condition_profile_stats(profiles, n_nuclei = None, **kwargs):
+    """Plot mean, median, mode and max single condition profiles together.
+
+    Args:
+      profiles (dict): {dtype:{x:float, y:float}, n: int, condition:string}.
+      n_nuclei (int): number of nuclei (opt).
+      **kwargs: single_condition_profiles keyword arguments.
+
+    Returns:
+      plt.figure: figure canvas with plot.
+    """
+
+    fig = single_condition_profiles(profiles, n_nuclei = n_nuclei, **kwargs)
+    for yfield in ['median', 'mode', 'max']:
+        single_condition_profiles(profiles, n_nuclei = n_nuclei,
+            yfield = yfield, new_figure = False, **kwargs)
+
+    # Add legend
+    plt.subplot(3, 2, 1)
+    set_font_size(12)
+    plt.legend(labels = ['mean', 'median', 'mode', 'max'],
+        bbox_to_anchor = (0., 1.12, 1., .102), loc = 3,
+        ncol = 2, mode = "expand", borderaxespad = 0.)
+
+    return(fig)
+
+def single_pixel_studies(indata, profiles, suptitle, **kwargs):
+    """Plot the single-pixel study of DNA, signal and Signal/DNA ratio.
+
+    Args:
+      indata (np.array, PixelStore): single-pixel table,
+                                     const.DTYPE_NUCLEAR_DATA.
+      profiles (dict): smoothened and raw profiles (I ~ d), with per-bin
+                       boxplot statistics.
+      suptitle (string): figures title.
+      **kwargs: dfield and single_pixel_study keyword arguments.
+
+    Returns:
+      list: DNA, signal and ratio figure canvases.
+    """
+
+    # Setup data for plotting, reading the table chunk by chunk
+    nbins = kwargs['nbins'] if 'nbins' in kwargs.keys() else None
+    hists = get_pixel_histograms(indata, kwargs['dfield'], nbins)
+    pltitems = [
+        ('DNA [a.u.]', 'dna'),
+        ('Signal [a.u.]', 'sig'),
+        ('Signal/DNA', 'ratio')
+    ]
+
+    figs = []
+    for (ylab, lab) in pltitems:
+        if not lab in hists.keys():
+            continue
+        fig = single_pixel_study(hists[lab], ylab, profiles[lab], **kwargs)
+        fig.tight_layout()
+        plt.subplots_adjust(top = 0.95)
+        plt.suptitle(suptitle)
+        figs.append(fig)
+
+    return(figs)
+
+def single_pixel_study(hist, field_label, profile, nbins = None, **kwargs):
     """Plot a study of single-pixel and general behaviour of profile data.
 
     Args:
-      xs (np.array): pixel (relative) distance from nuclear lamina.
-      ys (np.array): pixel channel intensity.
+      hist (tuple): 2D histogram of pixel intensity against (relative)
+                    distance from nuclear lamina, and its XY range,
+                    see get_pixel_histograms.
       field_label (string): y-axis label.
-      profile (dict): profile to study.
+      profile (dict): profile to study, with per-bin boxplot statistics
+                      ('box').
       nbins (int): study precision (opt, def 200).
 
     Returns:
@@ -1084,21 +1303,11 @@ def single_pixel_study(xs, ys, field_label, profile, nbins = None, **kwargs):
 
     # PREPARE DATA =============================================================
 
-    # XY range
-    xyrange = [[xs.min(), xs.max()], [ys.min(), ys.max()]]
-
-    # Bin data
-    assigned_bins = np.digitize(xs,
-        np.linspace(xs.min(), xs.max(), nbins))
-    binned_ydat = [[] for i in range(nbins)]
-    for bin_id in range(nbins):
-        binned_ydat[bin_id] = ys[np.where(assigned_bins == bin_id)]
+    # Local density and XY range
+    hh, xyrange = hist
 
-    # Calculate local density
-    hh, locx, locy = scipy.histogram2d(xs, ys,
-        range = xyrange, bins = [nbins, nbins])
-    posx = np.digitize(xs, locx)
-    posy = np.digitize(ys, locy)
+    # Per-bin boxplot statistics, precomputed with the profile
+    boxes = profile['box']
 
     # Hide empty bins
     pp = (hh.T / hh.T.max(0))
@@ -1125,7 +1334,8 @@ def single_pixel_study(xs, ys, field_label, profile, nbins = None, **kwargs):
 
     # Boxplot ------------------------------------------------------------------
     ax = plt.subplot2grid((4, 3), (1, 0))
-    plt.boxplot(binned_ydat, sym = 'k.')
+    ax.bxp(boxes, flierprops = {'marker' : '.', 'markerfacecolor' : 'k',
+        'markeredgecolor' : 'k', 'linestyle' : 'none'})
     plt.ylabel(field_label)
     ax.get_xaxis().set_visible(False)
     plt.ticklabel_format(style = 'sci', axis = 'y', scilimits = (0, 0))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: deferred figure rendering, on a separate process pool.
+'''
+
+# DEPENDENCIES =================================================================
+
+import multiprocessing
+
+from matplotlib.backends.backend_pdf import PdfPages
+import matplotlib.pyplot as plt
+
+from pygpseq.tools import path as pt, plot
+from pygpseq.tools.trace import traced
+
+# CLASSES ======================================================================
+
+class RenderQueue(object):
+    """Queue of figures to be rendered and exported.
+    Figures are submitted as plot specs: the name of a pygpseq.tools.plot
+    function, its arguments and the output paths. With one core, figures are
+    rendered right away in the current process. Otherwise, they are rendered
+    by a separate process pool, while the caller goes on, until wait is
+    called. Plot arguments must be picklable.
+
+    Attributes:
+      ncores (int): number of rendering processes.
+      pool (multiprocessing.Pool): rendering pool.
+      pending (list): results of the specs submitted to the pool.
+    """
+
+    ncores = 1
+    pool = None
+    pending = None
+
+    def __init__(self, ncores = None):
+        """
+        Args:
+          ncores (int): number of rendering processes (opt, def: 1).
+        """
+        self.pending = []
+        self.configure(ncores)
+
+    def configure(self, ncores = None):
+        """Update the number of rendering processes, after rendering any
+        pending figure. The rendering pool is started right away, so that
+        it is forked before the caller allocates large data. """
+        if not type(None) == type(ncores) and ncores != self.ncores:
+            self.wait()
+            self.ncores = max(1, int(ncores))
+        if 1 != self.ncores and type(None) == type(self.pool):
+            self.pool = multiprocessing.Pool(self.ncores)
+
+    def submit(self, f, args = None, kwargs = None, pdf = None, png = None):
+        """Submit a plot spec.
+
+        Args:
+          f (string): name of the pygpseq.tools.plot function. It should
+                      return a figure, a list of figures or None if it
+                      exports its own output.
+          args (list): positional arguments for f (opt).
+          kwargs (dict): keyword arguments for f (opt).
+          pdf (string): PDF output path, one page per figure (opt).
+          png (string, list): PNG output path(s), one per figure (opt).
+        """
+
+        spec = (f, args, kwargs, pdf, png)
+        if 1 == self.ncores:
+            render(*spec)
+            return
+
+        if type(None) == type(self.pool):
+            self.pool = multiprocessing.Pool(self.ncores)
+        self.pending.append(self.pool.apply_async(render, spec))
+
+    def wait(self):
+        """Wait for every submitted figure to be rendered, then stop the
+        rendering pool. Rendering errors are raised here. """
+
+        pending = self.pending
+        self.pending = []
+        try:
+            for result in pending:
+                result.get()
+        finally:
+            if not type(None) == type(self.pool):
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+# FUNCTIONS ====================================================================
+
+def get_render_queue(ncores = None):
+    """Return the render queue of the current process.
+
+    Args:
+      ncores (int): number of rendering processes (opt).
+
+    Returns:
+      RenderQueue: render queue.
+    """
+    figures.configure(ncores)
+    return(figures)
+
+@traced()
+def render(f, args = None, kwargs = None, pdf = None, png = None):
+    """Render and export a plot spec, see RenderQueue.submit. """
+
+    if type(None) == type(args):
+        args = []
+    if type(None) == type(kwargs):
+        kwargs = {}
+
+    # Plot
+    figs = getattr(plot, f)(*args, **kwargs)
+    if type(None) == type(figs):
+        figs = []
+    elif not type([]) == type(figs):
+        figs = [figs]
+
+    # Export PDF, one page per figure
+    if not type(None) == type(pdf):
+        pp = PdfPages(pt.add_extension(pdf, '.pdf'))
+        for fig in figs:
+            fig.savefig(pp, format = 'pdf')
+        pp.close()
+
+    # Export PNG
+    if not type(None) == type(png):
+        if type('') == type(png):
+            png = [png]
+        for (fig, path) in zip(figs, png):
+            fig.savefig(pt.add_extension(path, '.png'), format = 'png')
+
+    # Close figures
+    for fig in figs:
+        plt.close(fig)
+
+# Render queue of the current process
+figures = RenderQueue()
+
+# END ==========================================================================
+
+################################################################################
@@ -17,6 +17,7 @@ from scipy import stats
 from pygpseq import const
 
 from pygpseq.tools import vector as vt
+from pygpseq.tools.trace import traced
 
 # FUNCTIONS ====================================================================
 
@@ -44,6 +45,43 @@ def angle_between_points( p0, c, p1 ):
 
     return(tetha / math.pi * 180)
 
+def binned_box_stats(x, y, nbins = None, **kwargs):
+    """Boxplot statistics of sparse data, per bin and overall.
+    Bins are the same as in binned_profile.
+
+    Args:
+      x (numeric): x coordinates.
+      y (numeric): y coordinates.
+      nbins (int): curve precision (opt, def: 200).
+      **kwargs: box_stats keyword arguments.
+
+    Returns:
+      tuple: list of boxplot statistics per bin, and overall statistics.
+    """
+
+    if None == nbins:
+        nbins = 200
+
+    # Check format
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    # Assign data to the bins
+    if 0 == x.shape[0]:
+        assigned_bins = x.astype('i8')
+    else:
+        assigned_bins = np.digitize(x, np.linspace(0, max(x), nbins))
+
+    # Sort once by bin
+    order = np.argsort(assigned_bins, kind = 'stable')
+    counts = np.bincount(assigned_bins, minlength = nbins + 1)
+    starts = np.cumsum(counts) - counts
+    ys = y[order]
+
+    boxes = [box_stats(ys[starts[b]:(starts[b] + counts[b])], **kwargs)
+        for b in range(nbins)]
+    return((boxes, box_stats(y, **kwargs)))
+
 def binned_mode(x, nbins):
     """Identify binned mode.
 
@@ -78,6 +116,8 @@ def binned_mode(x, nbins):
 
 def binned_profile(x, y, nbins = None):
     """Produce an approximation of sparse data by binning it.
+    The data is sorted once by bin and value, then every statistic is
+    computed with segmented reductions over the sorted bins.
 
     Args:
       x (numeric): x coordinates.
@@ -92,7 +132,8 @@ def binned_profile(x, y, nbins = None):
         nbins = 200
 
     # Check format
-    y = np.array(y)
+    x = np.asarray(x)
+    y = np.asarray(y)
 
     # Bin breaks
     breaks = np.linspace(0, max(x), nbins)
@@ -105,27 +146,109 @@ def binned_profile(x, y, nbins = None):
         dtype = [('breaks', 'f'), ('mean', 'f'), ('median', 'f'), ('std', 'f'),
         ('mode', 'f'), ('max', 'f'), ('mean_raw', 'f'), ('median_raw', 'f'),
         ('std_raw', 'f'), ('mode_raw', 'f'), ('max_raw', 'f'), ('n', 'f')])
-    for bin_id in range(assigned_bins.max()):
-        where = np.where(assigned_bins == bin_id)
-        data['breaks'][bin_id] = breaks[bin_id]
-        if 0 != where[0].shape[0]:
-            data['mean'][bin_id] = np.mean(y[where])
-            data['median'][bin_id] = np.median(y[where])
-            data['mode'][bin_id] = binned_mode(y[where], nbins)
-            data['std'][bin_id] = np.std(y[where])
-            data['max'][bin_id] = np.max(y[where])
-            data['n'][bin_id] = len(y[where])
-        else:
-            data['mean'][bin_id] = np.nan
-            data['median'][bin_id] = np.nan
-            data['mode'][bin_id] = np.nan
-            data['std'][bin_id] = np.nan
-            data['max'][bin_id] = np.nan
-            data['n'][bin_id] = 0
+
+    # Only bins lower than the last occupied one are reported
+    nb = assigned_bins.max()
+    data['breaks'][:nb] = breaks[:nb]
+    for field in ['mean', 'median', 'mode', 'std', 'max']:
+        data[field][:nb] = np.nan
+
+    # Sort once by bin and value
+    order = np.argsort(y, kind = 'stable')
+    order = order[np.argsort(assigned_bins[order], kind = 'stable')]
+    counts = np.bincount(assigned_bins, minlength = nb + 1)[:nb]
+    ys = y[order][:counts.sum()]
+
+    # Identify bin segments
+    sel = np.where(0 != counts)[0]
+    if 0 == sel.shape[0]:
+        return(data)
+    n = counts[sel]
+    starts = (np.cumsum(counts) - counts)[sel]
+
+    # Segmented reductions
+    mean = np.add.reduceat(ys, starts) / n.astype('float')
+    std = (ys - np.repeat(mean, n))**2
+    std = np.sqrt(np.add.reduceat(std, starts) / n)
+    ymax = np.maximum.reduceat(ys, starts)
+
+    # Segmented medians from the sorted values
+    lo = ys[starts + (n - 1) // 2].astype('float')
+    hi = ys[starts + n // 2].astype('float')
+    median = (lo + hi) / 2.
+    median[n % 2 == 1] = lo[n % 2 == 1]
+    isnan = np.add.reduceat(np.isnan(ys), starts) != 0
+    median[isnan] = np.nan
+
+    # Segmented modes, bins with NaN are passed in their original order
+    # as binned_mode depends on it
+    mode = [sorted_binned_mode(ys[s:(s + c)], nbins)
+        for (s, c) in zip(starts, n)]
+    for b in np.where(isnan)[0]:
+        idx = np.sort(order[starts[b]:(starts[b] + n[b])])
+        mode[b] = binned_mode(y[idx], nbins)
+
+    data['mean'][sel] = mean
+    data['median'][sel] = median
+    data['mode'][sel] = mode
+    data['std'][sel] = std
+    data['max'][sel] = ymax
+    data['n'][sel] = n
 
     # Output
     return(data)
 
+def box_stats(y, whis = None, max_fliers = None, seed = None):
+    """Boxplot statistics, as accepted by matplotlib Axes.bxp.
+    Quartiles are interpolated as in np.percentile, and whiskers reach the
+    farthest points within whis IQR from the box. Outliers are capped to a
+    random sample (see sample_counts).
+
+    Args:
+      y (numeric): data, NaN are skipped.
+      whis (float): whisker reach, in IQR units (opt, def: 1.5).
+      max_fliers (int): maximum number of outliers (opt, def: 1000).
+      seed (int): outlier sampling seed (opt, def: 0).
+
+    Returns:
+      dict: boxplot statistics.
+    """
+
+    if None == whis:
+        whis = 1.5
+
+    # Skip NaN
+    y = np.asarray(y)
+    if 'f' == y.dtype.kind:
+        y = y[np.logical_not(np.isnan(y))]
+
+    # Empty data
+    stats = {'n' : y.shape[0], 'fliers' : np.zeros(0)}
+    if 0 == y.shape[0]:
+        for k in ['mean', 'med', 'q1', 'q3', 'iqr', 'whislo', 'whishi']:
+            stats[k] = np.nan
+        return(stats)
+
+    # Quartiles
+    stats['mean'] = y.mean()
+    stats['q1'], stats['med'], stats['q3'] = np.percentile(y, [25, 50, 75])
+    stats['iqr'] = stats['q3'] - stats['q1']
+
+    # Whiskers, at the farthest points within reach
+    inside = y[np.logical_and(y >= stats['q1'] - whis * stats['iqr'],
+        y <= stats['q3'] + whis * stats['iqr'])]
+    if 0 == inside.shape[0]:
+        stats['whislo'], stats['whishi'] = stats['q1'], stats['q3']
+    else:
+        stats['whislo'], stats['whishi'] = inside.min(), inside.max()
+
+    # Outliers
+    fliers = y[np.logical_or(y < stats['whislo'], y > stats['whishi'])]
+    values, counts = np.unique(fliers, return_counts = True)
+    stats['fliers'] = sample_counts(values, counts, max_fliers, seed)
+
+    return(stats)
+
 def calc_density(data, **kwargs):
     """
     Calculate the Gaussian KDE of the provided data series.
@@ -173,6 +296,62 @@ def calc_density(data, **kwargs):
     out['y'] = density(out['x'])
     return(out)
 
+def calc_density_profiles(dna, dnorm, nbins = None, nid = None):
+    """Calculate density and volume profiles over normalized lamina distance,
+    for one or more nuclei at once. Every voxel is assigned to its bin with a
+    single pass, and the bins are then reduced with np.bincount. The first
+    bin is closed on both sides, the others only on the right.
+
+    Args:
+      dna (np.ndarray): single-voxel intensity array.
+      dnorm (np.ndarray): single-voxel normalized lamina distance array.
+      nbins (int): number of bins over normalized lamina distance (opt,
+                   def: 200).
+      nid (np.ndarray): 0-indexed nucleus of every voxel (opt, def: all the
+                        voxels belong to the same nucleus).
+
+    Returns:
+      tuple: density and volume profiles, with one row per nucleus.
+    """
+
+    if None == nbins:
+        nbins = 200
+
+    # Check format
+    dna = np.asarray(dna, dtype = 'float')
+    dnorm = np.asarray(dnorm, dtype = 'float')
+    if type(None) == type(nid):
+        nid = np.zeros(dna.shape[0], dtype = 'i')
+        nn = 1
+    else:
+        nid = np.asarray(nid, dtype = 'i')
+        nn = nid.max() + 1 if 0 != nid.shape[0] else 0
+
+    # Assign voxels to bins, closing the first one
+    breaks = np.linspace(0, 1, nbins + 1)
+    bins = np.searchsorted(breaks, dnorm, 'left')
+    bins[dnorm == breaks[0]] = 1
+    valid = np.logical_and(bins >= 1, bins <= nbins)
+    flat = nid[valid] * nbins + bins[valid] - 1
+
+    # Count voxels and sum intensities per bin
+    dna = np.where(np.isnan(dna), 0, dna)
+    volume = np.bincount(flat, minlength = nn * nbins).reshape((nn, nbins))
+    numer = np.bincount(flat, weights = dna[valid],
+        minlength = nn * nbins).reshape((nn, nbins))
+
+    # Average voxel intensity of every nucleus
+    M = np.bincount(nid, minlength = nn)
+    sumI = np.bincount(nid, weights = dna, minlength = nn)
+
+    # Normalize
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        denom = sumI / M
+        density = numer / volume / denom.reshape((nn, 1))
+    density[0 == volume] = np.nan
+
+    return((density, volume))
+
 def calc_theta(a, b):
     '''
     Calculate rotation angle based on a (opposite) and b (adjacent) sides.
@@ -586,8 +765,78 @@ def round_unicode(n, nsig):
     # Re-join with the exponent and return
     return(unicode('e'.join(n)))
 
+def sample_counts(values, counts, k = None, seed = None):
+    """Sample points from counted values, uniformly and without replacement.
+    The lowest and highest values are always kept.
+
+    Args:
+      values (np.array): sorted values.
+      counts (np.array): number of points per value.
+      k (int): maximum number of points (opt, def: 1000).
+      seed (int): random seed (opt, def: 0).
+
+    Returns:
+      np.array: sampled points, sorted.
+    """
+
+    if None == k:
+        k = 1000
+    if None == seed:
+        seed = 0
+
+    values = np.asarray(values)
+    counts = np.asarray(counts)
+    total = int(counts.sum())
+    if total <= k:
+        return(np.repeat(values, counts))
+
+    # Sample point indexes, then map them to their values
+    rng = np.random.RandomState(seed)
+    idx = rng.choice(total, max(0, k - 2), replace = False)
+    idx = np.concatenate([[0, total - 1], idx])
+    idx.sort()
+    return(values[np.searchsorted(np.cumsum(counts), idx, 'right')])
+
+def sorted_binned_mode(x, nbins):
+    """Identify binned mode of sorted data, as binned_mode does.
+    Bins are occupied by searching their breaks in the sorted data.
+
+    Args:
+      x (np.array): dataset, sorted in ascending order.
+      nbins (int): number of bins.
+
+    Returns:
+      int: the most occupied bin in the provided dataset.
+    """
+
+    if 0 == len(x):
+        return(np.nan)
+
+    # Breaks are increasing only for non-negative data
+    if not x[-1] >= 0:
+        return(binned_mode(x, nbins))
+
+    # Bin breaks
+    breaks = np.linspace(0, x[-1], nbins)
+
+    # Count bins occurrences
+    counts = np.diff(np.concatenate([[0],
+        np.searchsorted(x, breaks, 'left'), [len(x)]]))
+    occ = np.where(0 != counts)[0]
+    counts = counts[occ]
+
+    # Order counts
+    ordered = np.argsort(counts).tolist()
+    ordered.reverse()
+
+    # Return mode
+    return(breaks[occ[ordered[0]] - 1])
+
 def smooth_gaussian(x, y, sigma_smooth = None, nbins = None):
     """Smoothen a curve.
+    Points with NaN y are ignored. When x is sampled on the output domain
+    (e.g., bin breaks) the weights are computed with a single convolution,
+    otherwise with a dense (chunked) matrix of normal pdf values.
 
     Args:
       x (numeric): x coordinates.
@@ -609,22 +858,41 @@ def smooth_gaussian(x, y, sigma_smooth = None, nbins = None):
 
     # SMOOTHEN =================================================================
 
+    x = np.asarray(x, dtype = 'float')
+    y = np.asarray(y, dtype = 'float')
+
     # Evenly sampled domain
-    xs = np.linspace(0, max(x), nbins)
+    xs = np.linspace(0, np.max(x), nbins)
 
-    # Initialize output
-    ynum = np.zeros(len(xs))
-    ysum = np.zeros(len(xs))
+    # Skip NaN points
+    valid = np.logical_not(np.isnan(y))
 
     # Weighted moving average
-    for i in [i for i in range(len(x)) if not np.isnan(y[i])]:
-        norm = get_norm_pdf(x[i], sigma_smooth, xs)
-        ynum += norm
-        ysum += norm * y[i]
+    if len(x) == nbins and len(x) * nbins > 2**16 and np.allclose(
+        x, xs, rtol = 0, atol = 1e-6 * np.max(x)):
+        # Convolution on the output domain
+        kernel = get_norm_pdf(0, sigma_smooth,
+            (xs[1] - xs[0]) * np.arange(-(nbins - 1), nbins))
+        ynum = convolve(valid.astype('float'), kernel,
+            mode = 'valid', method = 'direct')
+        ysum = convolve(np.where(valid, y, 0), kernel,
+            mode = 'valid', method = 'direct')
+    else:
+        # Dense pdf matrix, in chunks of at most ~1M elements
+        x = x[valid]
+        y = y[valid]
+        ynum = np.zeros(len(xs))
+        ysum = np.zeros(len(xs))
+        step = max(1, 2**20 // nbins)
+        for i in range(0, len(x), step):
+            norm = get_norm_pdf(x[i:(i + step)], sigma_smooth, xs[:, None])
+            ynum += norm.sum(1)
+            ysum += norm.dot(y[i:(i + step)])
 
     # Output
     return(ysum / ynum)
 
+@traced()
 def smooth_sparse_gaussian(x, y, nbins = None, sigma_smooth = None,
     rescale_sigma = None, **kwargs):
     """Produce a smooth approximation of sparse data.
@@ -649,11 +917,54 @@ def smooth_sparse_gaussian(x, y, nbins = None, sigma_smooth = None,
         rescale_sigma = True
 
     if rescale_sigma:
-        sigma_smooth *= max(x)
+        sigma_smooth *= np.max(x)
 
     # Bin data
     data = binned_profile(x, y, nbins)
 
+    # Smoothen profiles
+    return(smooth_profile(data, sigma_smooth, nbins))
+
+@traced()
+def smooth_accumulated_gaussian(acc, nbins = None, sigma_smooth = None,
+    rescale_sigma = None, **kwargs):
+    """Produce a smooth approximation of accumulated sparse data,
+    as smooth_sparse_gaussian does.
+
+    Args:
+      acc (tools.accumulator.ProfileAccumulator): accumulated data.
+      nbins (int): curve precision (opt, def: 200).
+      sigma_smooth (float): smoothing factor (opt, def: 0.01).
+      rescale_sigma (bool): whether to multiply sigma_smooth to max(x).
+
+    Returns:
+      dict: various metrics profiles (mean, median, mode, std).
+    """
+
+    if None == nbins:
+        nbins = 200
+    if None == sigma_smooth:
+        sigma_smooth = .01
+    if None == rescale_sigma:
+        rescale_sigma = True
+
+    if rescale_sigma:
+        sigma_smooth *= acc.breaks[-1]
+
+    return(smooth_profile(acc.get_profile(), sigma_smooth, nbins))
+
+def smooth_profile(data, sigma_smooth, nbins):
+    """Smoothen a binned profile, as produced by binned_profile.
+
+    Args:
+      data (np.array): binned profile.
+      sigma_smooth (float): smoothing factor.
+      nbins (int): curve precision.
+
+    Returns:
+      dict: various metrics profiles (mean, median, mode, std).
+    """
+
     # Prepare output
     out = {
         'x' : data['breaks'].tolist(),
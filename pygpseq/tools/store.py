@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: disk-backed single-pixel table.
+'''
+
+# DEPENDENCIES =================================================================
+
+import os
+
+import numpy as np
+
+# CLASSES ======================================================================
+
+class PixelStore(object):
+    """Disk-backed single-pixel table, read chunk by chunk.
+    The table is stored in a .npy buffer (const.DTYPE_NUCLEAR_DATA), where
+    every series occupies a region of rows. Rows without DNA signal are
+    skipped when reading.
+
+    Attributes:
+      path (string): path to the .npy buffer.
+      regions (list[tuple[int]]): (first row, number of rows) of the regions.
+      part (bool): whether to read only the partial volume rows.
+      chunk_size (int): maximum number of rows per chunk.
+      nrows (int): number of readable rows, once counted.
+    """
+
+    path = None
+    regions = []
+    part = False
+    chunk_size = 2**20
+    nrows = None
+
+    def __init__(self, path, regions, part = None, chunk_size = None):
+        """
+        Args:
+          path (string): path to the .npy buffer.
+          regions (list[tuple[int]]): (first row, number of rows) of the
+                                      regions to read.
+          part (bool): read only the partial volume rows (opt, def: False).
+          chunk_size (int): maximum number of rows per chunk (opt).
+        """
+
+        self.path = path
+        self.regions = [(int(o), int(c)) for (o, c) in regions]
+        if not type(None) == type(part):
+            self.part = part
+        if not type(None) == type(chunk_size):
+            self.chunk_size = chunk_size
+
+    def __getitem__(self, field):
+        """Read a single column. """
+        return(self.get_field(field))
+
+    def __len__(self):
+        """Number of readable rows. """
+        return(self.count())
+
+    @property
+    def shape(self):
+        """Table shape, as for a 1D structured array. """
+        return((self.count(),))
+
+    def count(self):
+        """Count the readable rows, i.e., with DNA signal and, if required,
+        in the partial volume. """
+        if type(None) == type(self.nrows):
+            self.nrows = sum([chunk.shape[0]
+                for chunk in self.iter_chunks(['dna'])])
+        return(self.nrows)
+
+    def get_field(self, field):
+        """Read a whole column into memory, chunk by chunk. Use iter_chunks
+        to keep memory bounded on large tables.
+
+        Args:
+          field (string): column name.
+
+        Returns:
+          np.ndarray: column values.
+        """
+
+        out = None
+        pos = 0
+        for chunk in self.iter_chunks([field]):
+            if type(None) == type(out):
+                out = np.empty(self.count(), dtype = chunk.dtype[field])
+            out[pos:(pos + chunk.shape[0])] = chunk[field]
+            pos += chunk.shape[0]
+
+        if type(None) == type(out):
+            buf = np.lib.format.open_memmap(self.path, 'r')
+            out = np.empty(0, dtype = buf.dtype[field])
+            del buf
+
+        return(out)
+
+    def get_part(self):
+        """Return a store reading only the partial volume rows. """
+        return(PixelStore(self.path, self.regions, True, self.chunk_size))
+
+    def iter_chunks(self, fields = None):
+        """Iterate over the readable rows.
+
+        Args:
+          fields (list[string]): columns to read (opt, def: all).
+
+        Returns:
+          generator: chunks of rows, as in-memory arrays.
+        """
+
+        buf = np.lib.format.open_memmap(self.path, 'r')
+        for (offset, count) in self.regions:
+            for start in range(offset, offset + count, self.chunk_size):
+                chunk = buf[start:min(offset + count, start + self.chunk_size)]
+                sel = chunk['dna'] != 0
+                if self.part:
+                    sel &= chunk['part'] == 1
+                if type(None) == type(fields):
+                    yield np.asarray(chunk[sel])
+                else:
+                    yield np.asarray(chunk[list(fields)][sel])
+        del buf
+
+    def remove(self):
+        """Remove the .npy buffer. """
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+# END ==========================================================================
+
+################################################################################
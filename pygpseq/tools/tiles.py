@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: tiled image processing. Images are processed one XY tile at a
+              time, with a halo where neighbourhood operations need it, to
+              bound the memory footprint to the tile size.
+'''
+
+# DEPENDENCIES =================================================================
+
+import numpy as np
+from scipy import ndimage as ndi
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# CLASSES ======================================================================
+
+class TiledLabels(object):
+    """Connected components of a binary image, labeled one XY tile at a
+    time and stitched across tile seams. Only the tile seams, the labels
+    found on the image borders and the component lookup table are kept in
+    memory: tile labels are recomputed when requested.
+
+    Attributes:
+      mask (np.ndarray[bool]): binary image (2D or 3D).
+      structure (np.ndarray[bool]): connectivity structuring element.
+      background (bool): True to label the background instead.
+      tiles (list): tile cores, see get_tiles.
+      offsets (list[int]): label offset of every tile.
+      faces (dict): for every axis, the labels (offset included) found on
+                    the image borders along that axis, per tile.
+      table (np.ndarray[int]): component of every tile label (offset
+                               included), 0 for the background.
+      ncomponents (int): number of components.
+    """
+
+    mask = None
+    structure = None
+    background = False
+    tiles = []
+    offsets = []
+    faces = {}
+    table = None
+    ncomponents = 0
+
+    def __init__(self, mask, tile_size, structure = None, background = False):
+        """Label every tile and stitch the labels across tile seams.
+
+        Args:
+          mask (np.ndarray[bool]): binary image (2D or 3D).
+          tile_size (int): XY tile side in px.
+          structure (np.ndarray[bool]): connectivity structuring element
+                                        (opt, def: full connectivity).
+          background (bool): True to label the background instead.
+        """
+        super(TiledLabels, self).__init__()
+
+        if type(None) == type(structure):
+            structure = ndi.generate_binary_structure(len(mask.shape),
+                len(mask.shape))
+        self.mask = mask
+        self.structure = structure
+        self.background = background
+        self.tiles = [t[0] for t in get_tiles(mask.shape, tile_size)]
+        self.offsets = []
+        self.faces = dict([(a, []) for a in range(len(mask.shape))])
+
+        # Label tiles, keeping their edges and the labels on image borders
+        ny = len(set([t[0].start for t in self.tiles]))
+        nx = len(self.tiles) // ny
+        edges = {}
+        nlabels = 0
+        for tid in range(len(self.tiles)):
+            L, n = self.label_tile(tid)
+            self.offsets.append(nlabels)
+            L = L.astype('i8')
+            L[0 != L] += nlabels
+            nlabels += n
+
+            core = self.tiles[tid]
+            if 3 == len(mask.shape):
+                self.faces[0].append(np.unique(L[[0, -1]]))
+            if 0 == core[0].start:
+                self.faces[len(mask.shape) - 2].append(np.unique(L[..., 0, :]))
+            if mask.shape[-2] == core[0].stop:
+                self.faces[len(mask.shape) - 2].append(np.unique(L[..., -1, :]))
+            if 0 == core[1].start:
+                self.faces[len(mask.shape) - 1].append(np.unique(L[..., 0]))
+            if mask.shape[-1] == core[1].stop:
+                self.faces[len(mask.shape) - 1].append(np.unique(L[..., -1]))
+
+            edges[(tid // nx, tid % nx)] = (L[..., 0, :], L[..., -1, :],
+                L[..., 0], L[..., -1])
+
+        # Stitch labels connected across seams: label the two-pixel strips
+        # along every seam, and join the tile labels in the same strip label
+        strips = []
+        for c in range(nx - 1):
+            strips.append(np.stack([
+                np.concatenate([edges[(r, c)][3] for r in range(ny)], -1),
+                np.concatenate([edges[(r, c + 1)][2] for r in range(ny)], -1)
+                ], -1))
+        for r in range(ny - 1):
+            strips.append(np.stack([
+                np.concatenate([edges[(r, c)][1] for c in range(nx)], -1),
+                np.concatenate([edges[(r + 1, c)][0] for c in range(nx)], -1)
+                ], -2))
+
+        nodes = []
+        components = []
+        ncomp = nlabels + 1
+        for strip in strips:
+            S, n = ndi.label(0 != strip, self.structure)
+            nodes.append(strip[0 != S])
+            components.append(S[0 != S] + ncomp - 1)
+            ncomp += n
+
+        if 0 != len(nodes):
+            nodes = np.concatenate(nodes)
+            components = np.concatenate(components)
+        else:
+            nodes = np.zeros(0, dtype = 'i8')
+            components = np.zeros(0, dtype = 'i8')
+        graph = coo_matrix((np.ones(nodes.shape[0], dtype = 'bool'),
+            (nodes, components)), shape = (ncomp, ncomp))
+        roots = connected_components(graph, directed = False)[1][:nlabels + 1]
+        roots, self.table = np.unique(roots[1:], return_inverse = True)
+        self.table = np.concatenate([[0], self.table.ravel() + 1])
+        self.ncomponents = roots.shape[0]
+
+    def get_tile(self, tid):
+        """Label a tile with the stitched components.
+
+        Args:
+          tid (int): tile index.
+
+        Returns:
+          np.ndarray[int]: component labels of the tile core.
+        """
+        L, n = self.label_tile(tid)
+        lut = self.table[self.offsets[tid]:self.offsets[tid] + n + 1].copy()
+        lut[0] = 0
+        return(lut[L])
+
+    def get_image(self, dtype = 'i8'):
+        """Label the whole image with the stitched components, one tile at
+        a time.
+
+        Args:
+          dtype (string): output dtype (opt, def: 'i8').
+
+        Returns:
+          np.ndarray[int]: component labels.
+        """
+        L = np.zeros(self.mask.shape, dtype = dtype)
+        for tid in range(len(self.tiles)):
+            L[(Ellipsis,) + self.tiles[tid]] = self.get_tile(tid)
+        return(L)
+
+    def get_sizes(self):
+        """Measure the size of every component, one tile at a time. As
+        tiles split only the XY plane, every Z column lies in a single tile.
+
+        Returns:
+          tuple: number of px/vx and maximum number of voxels in a single Z
+                 column (1 in 2D) of every component, indexed by component
+                 label.
+        """
+
+        sizes = np.zeros(self.ncomponents + 1, dtype = 'u8')
+        zsizes = np.zeros(self.ncomponents + 1, dtype = 'u4')
+        for tid in range(len(self.tiles)):
+            L = self.get_tile(tid)
+            sizes += np.bincount(L.ravel(),
+                minlength = sizes.shape[0]).astype('u8')
+
+            if 3 == len(L.shape):
+                # Voxels of every (component, Z column) pair
+                L = L.reshape((L.shape[0], -1))
+                zids, cids = np.nonzero(L)
+                pairs, counts = np.unique(L[zids, cids] * L.shape[1] + cids,
+                    return_counts = True)
+                np.maximum.at(zsizes, pairs // L.shape[1], counts.astype('u4'))
+            else:
+                zsizes[np.unique(L)] = 1
+        zsizes[0] = 0
+
+        return((sizes, zsizes))
+
+    def is_touching(self, axes = None):
+        """Identify the components touching the image borders.
+
+        Args:
+          axes (list[int]): axes of the borders (opt, def: all).
+
+        Returns:
+          np.ndarray[bool]: True for the components touching the borders,
+                            indexed by component label.
+        """
+
+        if type(None) == type(axes):
+            axes = range(len(self.mask.shape))
+        axes = set([a % len(self.mask.shape) for a in axes])
+
+        touching = np.zeros(self.ncomponents + 1, dtype = 'bool')
+        for a in axes:
+            for labels in self.faces[a]:
+                touching[self.table[labels]] = True
+        touching[0] = False
+        return(touching)
+
+    def label_tile(self, tid):
+        """Label a tile, without stitching.
+
+        Args:
+          tid (int): tile index.
+
+        Returns:
+          tuple: tile labels and number of labels.
+        """
+        tile = np.asarray(self.mask[(Ellipsis,) + self.tiles[tid]])
+        if self.background:
+            tile = np.logical_not(tile)
+        return(ndi.label(tile, self.structure))
+
+# FUNCTIONS ====================================================================
+
+def get_histogram(im, tile_size, nbins = 256):
+    """Calculate the intensity histogram of an image, one tile at a time.
+    Bins as skimage.exposure.histogram: one bin per value for integer
+    images, nbins bins over the image range otherwise.
+
+    Args:
+      im (np.ndarray): image (2D or 3D), can be memory-mapped.
+      tile_size (int): XY tile side in px.
+      nbins (int): number of bins, for non-integer images.
+
+    Returns:
+      tuple: counts and bin centers.
+    """
+
+    tiles = [(Ellipsis,) + t[0] for t in get_tiles(im.shape, tile_size)]
+
+    # Image range
+    vrange = [(tile.min(), tile.max()) for tile in
+        (np.asarray(im[t]) for t in tiles)]
+    vmin = min([r[0] for r in vrange])
+    vmax = max([r[1] for r in vrange])
+
+    if np.issubdtype(im.dtype, np.integer):
+        vmin = int(vmin)
+        vmax = int(vmax)
+        counts = np.zeros(vmax - vmin + 1, dtype = 'i8')
+        for t in tiles:
+            counts += np.bincount((np.asarray(im[t]).astype('i8') - vmin
+                ).ravel(), minlength = counts.shape[0])
+        return((counts, np.arange(vmin, vmax + 1)))
+
+    counts = np.zeros(nbins, dtype = 'i8')
+    for t in tiles:
+        tmp, edges = np.histogram(np.asarray(im[t]), nbins, (vmin, vmax))
+        counts += tmp
+    return((counts, (edges[:-1] + edges[1:]) / 2.))
+
+def get_tiles(shape, tile_size, halo = 0):
+    """Split the XY plane of an image in tiles.
+
+    Args:
+      shape (tuple[int]): image shape, the last two dimensions are tiled.
+      tile_size (int): tile side in px.
+      halo (int): tile overlap, for neighbourhood operations.
+
+    Returns:
+      list: a (core, region, inner) tuple of (Y, X) slices for every tile,
+            in row-major order. The cores cover the image without
+            overlapping, the regions are the cores padded with the halo
+            and clipped to the image borders, and inner selects the core
+            from the region.
+    """
+
+    tiles = []
+    for y in range(0, shape[-2], tile_size):
+        for x in range(0, shape[-1], tile_size):
+            core = (slice(y, min(y + tile_size, shape[-2])),
+                slice(x, min(x + tile_size, shape[-1])))
+            region = tuple([slice(max(0, s.start - halo), min(d, s.stop + halo))
+                for (s, d) in zip(core, shape[-2:])])
+            inner = tuple([slice(s.start - r.start, s.stop - r.start)
+                for (s, r) in zip(core, region)])
+            tiles.append((core, region, inner))
+    return(tiles)
+
+def threshold_otsu(im, tile_size, nbins = 256):
+    """Calculate Otsu's threshold from the image histogram, built one tile at
+    a time. Same as skimage.filters.threshold_otsu, see get_histogram.
+
+    Args:
+      im (np.ndarray): image (2D or 3D), can be memory-mapped.
+      tile_size (int): XY tile side in px.
+      nbins (int): number of bins, for non-integer images.
+
+    Returns:
+      float: threshold value.
+    """
+
+    counts, centers = get_histogram(im, tile_size, nbins)
+
+    # Single intensity value
+    if 1 == (0 != counts).sum():
+        return(centers[0 != counts][0])
+
+    counts = counts.astype('float64')
+    weight1 = np.cumsum(counts)
+    weight2 = np.cumsum(counts[::-1])[::-1]
+    mean1 = np.cumsum(counts * centers) / weight1
+    mean2 = (np.cumsum((counts * centers)[::-1]) / weight2[::-1])[::-1]
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+
+    return(centers[np.argmax(variance12)])
+
+# END ==========================================================================
+
+################################################################################
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: named span instrumentation, with wall time, CPU time and peak
+              memory, aggregated over every process of a run.
+'''
+
+# DEPENDENCIES =================================================================
+
+from contextlib import contextmanager
+import functools
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from pygpseq import const
+
+from pygpseq.tools import path as pt
+
+# CLASSES ======================================================================
+
+class Tracer(object):
+    """Recorder of named spans, shared by every process of a run.
+    Each span records its wall time, the CPU time of its process and the
+    peak resident set size of its process at its end. As the peak RSS is a
+    lifetime high-water mark, it bounds the memory used by the process up
+    to the end of the span, not by the span alone. When
+    tracing is on, the span folder is kept in an environment variable
+    (const.TRACE_ENV), so that worker processes started afterwards (either
+    by multiprocessing or joblib) record to the same folder, one JSON-lines
+    file per process. When tracing is off, spans are not recorded.
+    """
+
+    def configure(self, path = None):
+        """Turn tracing on, recording spans to the provided folder.
+
+        Args:
+          path (string): span folder path (opt, def: keep the current one).
+        """
+
+        if type(None) == type(path):
+            return
+        path = pt.add_trailing_slash(os.path.abspath(path))
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok = True)
+        os.environ[const.TRACE_ENV] = path
+
+    def get_path(self):
+        """Return the span folder path, None if tracing is off. """
+        return(os.environ.get(const.TRACE_ENV, None))
+
+    def is_enabled(self):
+        """Return True if tracing is on. """
+        return(not type(None) == type(self.get_path()))
+
+    def read(self):
+        """Read the spans recorded by every process.
+
+        Returns:
+          list: spans (dict), sorted by start time.
+        """
+
+        path = self.get_path()
+        if type(None) == type(path) or not os.path.isdir(path):
+            return([])
+
+        spans = []
+        for fname in os.listdir(path):
+            if not fname.endswith('.jsonl'):
+                continue
+            with open(path + fname, 'r') as f:
+                for line in f:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        pass
+        spans.sort(key = lambda s: s['start'])
+        return(spans)
+
+    def record(self, name, start, wall, cpu, rss, **attrs):
+        """Record a finished span.
+
+        Args:
+          name (string): span name.
+          start (float): start time, in seconds since the epoch.
+          wall (float): wall time, in seconds.
+          cpu (float): process CPU time, in seconds.
+          rss (float): process peak RSS at span end, in MiB.
+          **attrs: additional span attributes.
+        """
+
+        path = self.get_path()
+        if type(None) == type(path):
+            return
+
+        span = {'name' : name, 'pid' : os.getpid(),
+            'tid' : threading.get_ident(), 'start' : start, 'wall' : wall,
+            'cpu' : cpu, 'rss' : rss}
+        if 0 != len(attrs):
+            span['attrs'] = attrs
+
+        try:
+            with open(path + '%d.jsonl' % os.getpid(), 'a') as f:
+                f.write(json.dumps(span, default = str) + '\n')
+        except (IOError, OSError):
+            pass
+
+    def report(self, spans = None):
+        """Aggregate the recorded spans by name. Times of nested spans are
+        included in those of the enclosing ones.
+
+        Args:
+          spans (list): spans, see read (opt, def: every recorded span).
+
+        Returns:
+          dict: run summary, with per-name number of calls, total, mean and
+                maximum wall time, total CPU time and maximum process peak
+                RSS at span end (MiB). Names are sorted by total wall time,
+                in decreasing order.
+        """
+
+        if type(None) == type(spans):
+            spans = self.read()
+
+        stats = {}
+        for s in spans:
+            if not s['name'] in stats.keys():
+                stats[s['name']] = {'calls' : 0, 'wall' : 0., 'wall_max' : 0.,
+                    'cpu' : 0., 'rss' : 0.}
+            ss = stats[s['name']]
+            ss['calls'] += 1
+            ss['wall'] += s['wall']
+            ss['wall_max'] = max(ss['wall_max'], s['wall'])
+            ss['cpu'] += s['cpu']
+            if not type(None) == type(s['rss']):
+                ss['rss'] = max(ss['rss'], s['rss'])
+        for ss in stats.values():
+            ss['wall_mean'] = ss['wall'] / ss['calls']
+
+        names = sorted(stats.keys(), key = lambda k: -stats[k]['wall'])
+
+        if 0 == len(spans):
+            wall = 0.
+        else:
+            wall = max([s['start'] + s['wall'] for s in spans])
+            wall -= spans[0]['start']
+
+        return({'version' : const.VERSION, 'wall' : wall,
+            'processes' : len(set([s['pid'] for s in spans])),
+            'spans' : [dict([('name', k)] + sorted(stats[k].items()))
+                for k in names]})
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Record the enclosed code as a span, if tracing is on.
+
+        Args:
+          name (string): span name.
+          **attrs: additional span attributes.
+        """
+
+        if not self.is_enabled():
+            yield
+            return
+
+        start = time.time()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - wall,
+                time.process_time() - cpu, get_peak_rss(), **attrs)
+
+    def stop(self, remove = True):
+        """Turn tracing off.
+
+        Args:
+          remove (bool): remove the span folder (opt, def: True).
+        """
+
+        path = self.get_path()
+        if type(None) == type(path):
+            return
+        del os.environ[const.TRACE_ENV]
+        if remove:
+            shutil.rmtree(path, ignore_errors = True)
+
+    def write_report(self, fpath, spans = None):
+        """Export the span report as JSON, see report. """
+        with open(fpath, 'w') as f:
+            json.dump(self.report(spans), f, indent = 2)
+
+    def write_trace(self, fpath, spans = None):
+        """Export the spans in the Trace Event Format, to be browsed as a
+        flame chart (e.g., with chrome://tracing, Perfetto or speedscope).
+
+        Args:
+          fpath (string): output file path.
+          spans (list): spans, see read (opt, def: every recorded span).
+        """
+
+        if type(None) == type(spans):
+            spans = self.read()
+
+        t0 = 0 if 0 == len(spans) else spans[0]['start']
+        events = []
+        for s in spans:
+            args = {'cpu' : s['cpu'], 'rss' : s['rss']}
+            if 'attrs' in s.keys():
+                args.update(s['attrs'])
+            events.append({'name' : s['name'],
+                'cat' : s['name'].split('.')[0], 'ph' : 'X',
+                'ts' : (s['start'] - t0) * 1e6, 'dur' : s['wall'] * 1e6,
+                'pid' : s['pid'], 'tid' : s['tid'], 'args' : args})
+
+        with open(fpath, 'w') as f:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, f)
+
+# FUNCTIONS ====================================================================
+
+def get_peak_rss():
+    """Return the peak resident set size of the current process, in MiB.
+    None if not available on the current platform. """
+
+    if type(None) == type(resource):
+        return(None)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if 'darwin' == sys.platform:
+        return(rss / 1024.**2)
+    return(rss / 1024.)
+
+def get_tracer(path = None):
+    """Return the tracer, turning tracing on if a span folder is provided.
+
+    Args:
+      path (string): span folder path (opt).
+
+    Returns:
+      Tracer: tracer.
+    """
+    spans.configure(path)
+    return(spans)
+
+def traced(name = None):
+    """Decorator recording every call of a function as a span.
+
+    Args:
+      name (string): span name (opt, def: module and qualified name of the
+                     function, without the package name).
+    """
+
+    def decorator(f):
+        fname = name
+        if type(None) == type(fname):
+            fname = '%s.%s' % (f.__module__, f.__qualname__)
+            if fname.startswith(const.PACK_NAME + '.'):
+                fname = fname[len(const.PACK_NAME) + 1:]
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not spans.is_enabled():
+                return(f(*args, **kwargs))
+            with spans.span(fname):
+                return(f(*args, **kwargs))
+
+        return(wrapper)
+    return(decorator)
+
+# Tracer, shared by the processes of a run
+spans = Tracer()
+
+# END ==========================================================================
+
+################################################################################
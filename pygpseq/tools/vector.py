@@ -10,6 +10,8 @@
 
 import numpy as np
 
+from pygpseq.tools import objects
+
 # FUNCTIONS ====================================================================
 
 def flatten_and_select(v, s):
@@ -64,34 +66,16 @@ def merge_nparrays(npal):
     return(merged)
 
 def rm_from_mask(L, torm):
-    """Remove elements from a mask.
+    """Remove elements from a mask, see pygpseq.tools.objects.rm_from_mask.
 
     Args:
       L (np.array[int]): labelled objects.
       torm (list): list of objects indexes (to remove).
-    """
-
-    if len(torm) <= L.max() - len(torm):
-        # Update list of objects to be discarded
-        torm = [e + 1  for e in torm]
-
-        # Identify which objects to discard
-        rm_mask = np.vectorize(lambda x: x in torm)(L)
-
-        # Discard and re-label
-        L[rm_mask] = 0
-    else:
-        # Select objects to be kept
-        tokeep = [e + 1 for e in range(L.max()) if not e in torm]
 
-        # Identify which objects to discard
-        rm_mask = np.vectorize(lambda x: not x in tokeep)(L)
-
-        # Discard and re-label
-        L[rm_mask] = 0
-
-    # Output
-    return(L > 0)
+    Returns:
+      np.array[bool]: mask of the kept objects.
+    """
+    return(objects.rm_from_mask(L, torm))
 
 def uniquec(l):
     """Count the instances of the uniqued integers in l.
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: tests for the mergeable profile accumulator.
+'''
+
+# DEPENDENCIES =================================================================
+
+import pickle
+import unittest
+
+import numpy as np
+
+from pygpseq.tools import stat as stt
+from pygpseq.tools.accumulator import ProfileAccumulator
+
+# FUNCTIONS ====================================================================
+
+def accumulate(x, y, chunk_size = 9973, **kwargs):
+    """Accumulate points chunk by chunk, merging one accumulator per chunk,
+    as analysis workers and conditions do. """
+    acc = ProfileAccumulator(x.max(), **kwargs)
+    for i in range(0, x.shape[0], chunk_size):
+        part = ProfileAccumulator(x.max(), **kwargs)
+        part.update(x[i:(i + chunk_size)], y[i:(i + chunk_size)])
+        acc.merge(pickle.loads(pickle.dumps(part)))
+    return(acc)
+
+# CLASSES ======================================================================
+
+class TestProfileAccumulator(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = rng.uniform(0, 1, 10**5)
+
+        # Ratio-like data, with outliers and negative values
+        self.y = rng.normal(1, .2, 10**5)
+        self.y[rng.choice(10**5, 10, replace = False)] = 5000.
+        self.y[rng.choice(10**5, 50, replace = False)] = -rng.uniform(0, 3, 50)
+
+        # Intensity-like data, with outliers and negative values
+        self.yint = rng.poisson(100, 10**5).astype('i8')
+        self.yint[rng.choice(10**5, 10, replace = False)] = 10**6
+        self.yint[rng.choice(10**5, 50, replace = False)] *= -1
+
+    def check_exact_fields(self, got, exp):
+        for field in ['breaks', 'n', 'mean', 'std', 'max']:
+            np.testing.assert_allclose(got[field], exp[field],
+                rtol = 1e-5, atol = 1e-5, err_msg = field)
+
+    def test_float_profile(self):
+        acc = accumulate(self.x, self.y)
+        got = acc.get_profile()
+        exp = stt.binned_profile(self.x, self.y)
+        self.check_exact_fields(got, exp)
+
+        # Medians within the sketch relative error, despite the outliers
+        np.testing.assert_allclose(got['median'], exp['median'],
+            rtol = acc.rel_err * 1.001)
+        self.assertTrue(np.nanmax(np.absolute(got['median'] - 1)) < .1)
+
+        # Modes on the same per-bin breaks: the selected break interval
+        # misses at most the points within the sketch error of a break
+        bins = np.digitize(self.x, acc.breaks)
+        for b in np.where(0 != got['n'])[0]:
+            y = self.y[bins == b]
+            breaks = np.linspace(0, y.max(), acc.nbins)
+            counts = np.bincount(np.digitize(y, breaks),
+                minlength = acc.nbins + 1)
+            near = np.absolute(y[:, None] - breaks[None, :]) <= (
+                acc.rel_err * np.absolute(y)[:, None])
+            mode = np.argmin(np.absolute(breaks - got['mode'][b]))
+            self.assertTrue(counts.max() - counts[(mode + 1) % counts.shape[0]
+                ] <= near.any(1).sum())
+
+    def test_integer_profile(self):
+        acc = accumulate(self.x, self.yint)
+        got = acc.get_profile()
+        exp = stt.binned_profile(self.x, self.yint)
+        self.check_exact_fields(got, exp)
+
+        # Integers within +/-SKETCH_EXACT_MAX are exact
+        np.testing.assert_array_equal(got['median'], exp['median'])
+        np.testing.assert_array_equal(got['mode'], exp['mode'])
+
+    def test_box_stats(self):
+        acc = accumulate(self.x, self.y)
+        for b in [None, 100]:
+            if type(None) == type(b):
+                y = self.y
+            else:
+                y = self.y[np.digitize(self.x, acc.breaks) == b]
+            got = acc.get_box_stats(b)
+            exp = stt.box_stats(y)
+            self.assertEqual(got['n'], exp['n'])
+            for k in ['q1', 'med', 'q3']:
+                self.assertTrue(abs(got[k] - exp[k]) <=
+                    acc.rel_err * abs(exp[k]) * 1.001, k)
+
+    def test_merge(self):
+        acc = accumulate(self.x, self.y)
+        single = ProfileAccumulator(self.x.max()).update(self.x, self.y)
+        np.testing.assert_array_equal(acc.keys, single.keys)
+        np.testing.assert_array_equal(acc.counts, single.counts)
+        np.testing.assert_array_equal(acc.get_profile()['median'],
+            single.get_profile()['median'])
+
+    def test_nan(self):
+        y = self.y.copy()
+        y[::10] = np.nan
+        sel = np.logical_not(np.isnan(y))
+        got = accumulate(self.x, y).get_profile()
+        exp = accumulate(self.x[sel], y[sel]).get_profile()
+        np.testing.assert_array_equal(got['n'], exp['n'])
+        np.testing.assert_array_equal(got['median'], exp['median'])
+
+# END ==========================================================================
+
+################################################################################
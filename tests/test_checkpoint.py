@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: tests for the run checkpoint store and run resume.
+'''
+
+# DEPENDENCIES =================================================================
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pygpseq.anim import Condition, Main
+from pygpseq.anim import main as anim_main
+from pygpseq.tools.checkpoint import CheckpointRecord, CheckpointStore
+
+# CLASSES ======================================================================
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix = 'pygpseq.test.')
+
+        # Condition with two series, never read as segmentation is mocked
+        cpath = os.path.join(self.tmp, 'cond')
+        os.mkdir(cpath)
+        for sid in [1, 2]:
+            for (cid, cname) in [(1, 'dapi'), (2, 'cy5')]:
+                open(os.path.join(cpath, '%s.channel%03d.series%03d.tif' % (
+                    cname, cid, sid)), 'w').close()
+
+        self.gpi = Main()
+        self.gpi.verbose = False
+        self.gpi.logpath = os.path.join(self.tmp, 'log')
+        self.gpi.mask_cache = None
+        self.gpi.conds = [Condition(cpath, ('dapi',), ('cy5',),
+            main = self.gpi)]
+
+        # First series already segmented
+        self.store = CheckpointStore(os.path.join(self.tmp, 'gpi'))
+        self.store.save({'dna_bg' : 1., 'sig_bg' : 2., 'nuclei' : []},
+            'seg', 'cond', 1, meta = {'dna_bg' : 1., 'sig_bg' : 2.,
+            'nnuclei' : 0})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_lazy_resume(self):
+        tasks = []
+        def run_tasks(t, ncores = None):
+            tasks.extend(t)
+            return(iter([]))
+
+        with mock.patch.object(CheckpointRecord, 'load') as load, \
+            mock.patch.object(anim_main.pa, 'run_tasks', run_tasks):
+            self.gpi.run_segmentation(checkpoint = self.store, ncores = 1)
+
+            # Only the second series is segmented
+            self.assertEqual(1, len(tasks))
+            self.assertEqual(2, tasks[0][1][0]['ds'][2])
+
+            # The finished record is described by the manifest only
+            s = self.gpi.conds[0].series[0]
+            self.assertEqual(0, s.count_nuclei())
+            self.assertEqual((1., 2.), (s.dna_bg, s.sig_bg))
+            load.assert_not_called()
+
+# END ==========================================================================
+
+################################################################################
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+'''
+@author: Gabriele Girelli
+@contact: gigi.ga90@gmail.com
+@description: tests for the statistics tools.
+'''
+
+# DEPENDENCIES =================================================================
+
+import unittest
+import warnings
+
+import numpy as np
+
+from pygpseq.tools import stat as stt
+
+# FUNCTIONS ====================================================================
+
+def binned_profile_loop(x, y, nbins = 200):
+    """Bin by bin profile, as calculated before the segmented reductions. """
+    y = np.array(y)
+    breaks = np.linspace(0, max(x), nbins)
+    assigned_bins = np.digitize(x, breaks)
+    data = np.zeros((len(breaks),), dtype = [('breaks', 'f'), ('mean', 'f'),
+        ('median', 'f'), ('std', 'f'), ('mode', 'f'), ('max', 'f'),
+        ('n', 'f')])
+    for bin_id in range(assigned_bins.max()):
+        where = np.where(assigned_bins == bin_id)
+        data['breaks'][bin_id] = breaks[bin_id]
+        if 0 != where[0].shape[0]:
+            data['mean'][bin_id] = np.mean(y[where])
+            data['median'][bin_id] = np.median(y[where])
+            data['mode'][bin_id] = stt.binned_mode(y[where], nbins)
+            data['std'][bin_id] = np.std(y[where])
+            data['max'][bin_id] = np.max(y[where])
+            data['n'][bin_id] = len(y[where])
+        else:
+            for field in ['mean', 'median', 'mode', 'std', 'max']:
+                data[field][bin_id] = np.nan
+    return(data)
+
+# CLASSES ======================================================================
+
+class TestBinnedProfile(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = rng.uniform(0, 1, 10**4)
+        self.y = rng.normal(1, .2, 10**4)
+        self.y[rng.choice(10**4, 20, replace = False)] *= -1
+
+    def check_profile(self, x, y):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            got = stt.binned_profile(x, y, 50)
+            exp = binned_profile_loop(x, y, 50)
+        for field in exp.dtype.names:
+            np.testing.assert_allclose(got[field], exp[field],
+                rtol = 1e-5, atol = 1e-5, err_msg = field)
+
+    def test_profile(self):
+        self.check_profile(self.x, self.y)
+
+    def test_nan(self):
+        # NaN modes depend on the NaN position within the bin
+        y = self.y.copy()
+        y[::97] = np.nan
+        self.check_profile(self.x, y)
+        self.check_profile(self.x[::-1], y[::-1])
+
+        # Built-in max skips NaN unless it comes first
+        self.assertEqual(2., stt.binned_mode(np.array([1, 2, np.nan]), 3))
+        self.assertTrue(np.isnan(stt.binned_mode(
+            np.array([np.nan, 1, 2]), 3)))
+
+# END ==========================================================================
+
+################################################################################